@@ -0,0 +1,181 @@
+"""Clustering beats by shape with mini-batch k-means."""
+from dataclasses import dataclass
+import numpy as np
+from typing import Optional
+from . import morphology
+
+# Beats drawn per mini-batch update
+BATCH_SIZE = 1024
+# Beats the initial centres are chosen from
+INIT_BEATS = 4096
+# Clusters whose templates correlate at least this much with a larger cluster's are merged into it
+MERGE_CORRELATION = 0.95
+# Largest shift in samples between two templates compared for merging, absorbing R peak jitter
+MERGE_LAG = 2
+
+
+@dataclass
+class BeatClusters:
+    """
+    Beat clusters of a lead.
+
+    Clusters are numbered by size, so 0 is the dominant (usually normal) beat.
+    """
+    labels: np.ndarray
+    templates: np.ndarray
+    counts: np.ndarray
+    before: int
+    after: int
+
+    @property
+    def n_clusters(self) -> int:
+        """Number of clusters."""
+        return self.templates.shape[0]
+
+
+def _features(matrix: np.ndarray, scale: float) -> np.ndarray:
+    """Beats with their mean removed, in units of the lead's beat amplitude, and zero outside the signal."""
+    features = matrix.astype(np.float64)
+    with np.errstate(invalid='ignore'):
+        features -= np.nanmean(features, axis=1, keepdims=True)
+    features /= scale
+    return np.nan_to_num(features, copy=False)
+
+
+def _nearest(features: np.ndarray, centres: np.ndarray) -> np.ndarray:
+    """Index of the nearest centre to each row."""
+    distances = (centres ** 2).sum(axis=1) - 2 * features @ centres.T
+    return np.argmin(distances, axis=1)
+
+
+def _init_centres(features: np.ndarray, n_clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Choose initial centres with k-means++ seeding."""
+    centres = [features[rng.integers(features.shape[0])]]
+    closest = ((features - centres[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_clusters):
+        total = closest.sum()
+        index = rng.choice(features.shape[0], p=closest / total) if total > 0 else rng.integers(features.shape[0])
+        centres.append(features[index])
+        closest = np.minimum(closest, ((features - centres[-1]) ** 2).sum(axis=1))
+    return np.array(centres)
+
+
+def _shifted(template: np.ndarray, lag: int) -> np.ndarray:
+    """A template delayed by lag samples, NaN where it has no value."""
+    shifted = np.full(template.shape, np.nan)
+    if lag >= 0:
+        shifted[lag:] = template[:template.shape[0] - lag]
+    else:
+        shifted[:lag] = template[-lag:]
+    return shifted
+
+
+def _best_correlation(templates: np.ndarray, template: np.ndarray, max_lag: int) -> np.ndarray:
+    """Highest correlation of each template with another over shifts of up to max_lag samples."""
+    return np.nanmax([morphology.template_correlation(templates, _shifted(template, lag))
+                      for lag in range(-max_lag, max_lag + 1)], axis=0)
+
+
+def cluster_beats(signal: np.ndarray, samples: np.ndarray, before: int, after: int, n_clusters: int = 8,
+                  batch_size: int = BATCH_SIZE, n_iter: Optional[int] = None,
+                  merge_correlation: Optional[float] = MERGE_CORRELATION, max_lag: int = MERGE_LAG,
+                  chunk_beats: int = morphology.BEAT_CHUNK, seed: int = 0) -> BeatClusters:
+    """
+    Cluster beats by shape in bounded memory.
+
+    Beats are compared with their mean removed, scaled by the peak to peak
+    amplitude of the median beat. Centres are seeded by k-means++ on a sample of
+    beats and refined by mini-batch k-means, each update cutting only its batch
+    of beat windows. A final pass over the beats, chunk by chunk, labels every
+    beat and averages each cluster's beats into its template. Clusters whose
+    templates correlate at least merge_correlation with a larger cluster's, at
+    a shift of up to max_lag samples, are merged into it, so n_clusters is an
+    upper bound; the shift absorbs beats split by a sample of R peak jitter.
+    Time is linear in the number of beats and memory is bounded by batch_size
+    and chunk_beats.
+
+    Args:
+        signal: The signal
+        samples: Sample of each beat
+        before: Samples kept before each beat
+        after: Samples kept from each beat onwards
+        n_clusters: Most clusters found
+        batch_size: Beats per mini-batch update
+        n_iter: Mini-batch updates, defaults to two passes over the beats
+        merge_correlation: Template correlation above which clusters are merged, or None to keep all
+        max_lag: Largest shift in samples between templates compared for merging
+        chunk_beats: Beats per chunk of the labelling pass
+        seed: Seed of the random beat draws
+
+    Returns:
+        The labels, templates (in signal units) and sizes of the clusters
+    """
+    samples = np.asarray(samples)
+    width = before + after
+    n_beats = samples.shape[0]
+    if n_beats == 0:
+        return BeatClusters(np.empty(0, dtype=np.int64), np.empty((0, width)), np.empty(0, dtype=np.int64),
+                            before, after)
+    rng = np.random.default_rng(seed)
+    median = morphology.beat_templates(signal, samples, before, after, chunk_beats)['median']
+    scale = np.nanmax(median) - np.nanmin(median) if np.isfinite(median).any() else 0
+    scale = scale if scale > 0 else 1
+
+    def batch(indices: np.ndarray) -> np.ndarray:
+        return _features(morphology.beat_matrix(signal, samples[np.sort(indices)], before, after), scale)
+
+    n_clusters = min(n_clusters, n_beats)
+    initial = rng.choice(n_beats, min(INIT_BEATS, n_beats), replace=False)
+    centres = _init_centres(batch(initial), n_clusters, rng)
+    seen = np.zeros(n_clusters)
+    n_iter = max(int(np.ceil(2 * n_beats / batch_size)), 1) if n_iter is None else n_iter
+    for _ in range(n_iter):
+        features = batch(rng.integers(0, n_beats, min(batch_size, n_beats)))
+        nearest = _nearest(features, centres)
+        # Each centre moves towards the mean of its batch members, with a step shrinking as it sees more beats
+        members = np.bincount(nearest, minlength=n_clusters)
+        sums = np.zeros_like(centres)
+        np.add.at(sums, nearest, features)
+        seen += members
+        moved = members > 0
+        step = members[moved] / seen[moved]
+        centres[moved] += step[:, None] * (sums[moved] / members[moved, None] - centres[moved])
+
+    # Label every beat and sum each cluster's beats, skipping samples outside the signal
+    labels = np.empty(n_beats, dtype=np.int64)
+    totals = np.zeros((n_clusters, width))
+    valid = np.zeros((n_clusters, width))
+    for first, matrix in morphology.iter_beat_matrix(signal, samples, before, after, chunk_beats):
+        chunk_labels = _nearest(_features(matrix, scale), centres)
+        labels[first:first + matrix.shape[0]] = chunk_labels
+        members = np.eye(n_clusters)[chunk_labels].T
+        totals += members @ np.nan_to_num(matrix.astype(np.float64))
+        valid += members @ ~np.isnan(matrix)
+    counts = np.bincount(labels, minlength=n_clusters)
+
+    # Merge clusters into larger ones of the same shape, largest first
+    order = np.argsort(-counts, kind='stable')
+    order = order[counts[order] > 0]
+    target = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for position, cluster in enumerate(order):
+            target[cluster] = cluster
+            if merge_correlation is None or position == 0:
+                continue
+            kept = [other for other in order[:position] if target[other] == other]
+            correlation = _best_correlation(totals[kept] / valid[kept], totals[cluster] / valid[cluster], max_lag)
+            if np.nanmax(correlation) >= merge_correlation:
+                into = kept[int(np.nanargmax(correlation))]
+                target[cluster] = into
+                totals[into] += totals[cluster]
+                valid[into] += valid[cluster]
+                counts[into] += counts[cluster]
+
+    # Number the remaining clusters by size
+    kept = [cluster for cluster in order if target[cluster] == cluster]
+    kept.sort(key=lambda cluster: -counts[cluster])
+    number = {cluster: index for index, cluster in enumerate(kept)}
+    mapping = np.array([number.get(target.get(cluster, cluster), 0) for cluster in range(n_clusters)])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        templates = totals[kept] / valid[kept]
+    return BeatClusters(mapping[labels], templates, counts[kept], before, after)
@@ -0,0 +1,89 @@
+"""Binned Lorenz (Poincaré) densities of RR intervals."""
+from dataclasses import dataclass
+import numpy as np
+from typing import Iterable, Tuple
+
+# Range of RR intervals binned, in ms; the same for every recording so densities can be added
+LORENZ_RANGE = (0, 3000)
+# Width of each bin of the density, in ms
+LORENZ_BIN = 10
+
+
+@dataclass
+class LorenzDensity:
+    """
+    Counts of successive RR interval pairs on a fixed grid.
+
+    counts[i, j] is the number of pairs with RR_n in bin i and RR_n+1 in bin j.
+    Densities on the same grid add up, so a cohort's density is the sum of its
+    recordings' without keeping any RR pair.
+    """
+    counts: np.ndarray
+    start: float = LORENZ_RANGE[0]
+    bin_width: float = LORENZ_BIN
+
+    @property
+    def edges(self) -> np.ndarray:
+        """Bin edges in ms, shared by both axes."""
+        return self.start + self.bin_width * np.arange(self.counts.shape[0] + 1)
+
+    @property
+    def n_pairs(self) -> int:
+        """Number of pairs counted."""
+        return int(self.counts.sum())
+
+    def __add__(self, other: 'LorenzDensity') -> 'LorenzDensity':
+        """Combine the densities of two recordings on the same grid."""
+        if (self.counts.shape != other.counts.shape or self.start != other.start
+                or self.bin_width != other.bin_width):
+            raise ValueError('Lorenz densities are on different grids')
+        return LorenzDensity(self.counts + other.counts, self.start, self.bin_width)
+
+
+def lorenz_density(rr_intervals: np.ndarray, bin_width: float = LORENZ_BIN,
+                   rr_range: Tuple[float, float] = LORENZ_RANGE) -> LorenzDensity:
+    """
+    Bin successive RR interval pairs into a 2D histogram.
+
+    The grid is uniform, so each pair's bin is found by arithmetic and the
+    counts by one bincount, in linear time. Pairs with either interval outside
+    rr_range are left out.
+
+    Args:
+        rr_intervals: RR intervals in ms, in beat order
+        bin_width: Width of each bin in ms
+        rr_range: (lowest, highest) RR interval binned, in ms
+
+    Returns:
+        The counts of RR_n against RR_n+1
+    """
+    n_bins = int(np.ceil((rr_range[1] - rr_range[0]) / bin_width))
+    bins = np.floor((np.asarray(rr_intervals, dtype=np.float64) - rr_range[0]) / bin_width)
+    current, following = bins[:-1], bins[1:]
+    inside = (current >= 0) & (current < n_bins) & (following >= 0) & (following < n_bins)
+    flat = current[inside].astype(np.int64) * n_bins + following[inside].astype(np.int64)
+    counts = np.bincount(flat, minlength=n_bins * n_bins).reshape(n_bins, n_bins)
+    return LorenzDensity(counts, rr_range[0], bin_width)
+
+
+def combine_densities(densities: Iterable[LorenzDensity]) -> LorenzDensity:
+    """
+    Add up the Lorenz densities of several recordings.
+
+    Args:
+        densities: Densities on the same grid
+
+    Returns:
+        The combined density
+
+    Raises:
+        ValueError: If there are no densities
+    """
+    densities = iter(densities)
+    combined = next(densities, None)
+    if combined is None:
+        raise ValueError('no densities to combine')
+    combined = LorenzDensity(combined.counts.copy(), combined.start, combined.bin_width)
+    for density in densities:
+        combined = combined + density
+    return combined
@@ -1,6 +1,14 @@
 """ECG metrics and statistics calculations."""
 import numpy as np
-from typing import Dict
+from scipy import integrate
+from scipy import signal as si
+from typing import Dict, Optional
+
+# Frequency bands of the RR spectrum in Hz
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.4)
+# Template pairs compared per tile in the batched sample entropy, bounding its memory
+ENTROPY_CELLS = 1 << 20
 
 
 def calculate_hrv_metrics(rr_intervals: np.ndarray) -> Dict[str, float]:
@@ -24,4 +32,158 @@ def calculate_hrv_metrics(rr_intervals: np.ndarray) -> Dict[str, float]:
     successive_diff = np.abs(np.diff(rr_intervals))
     metrics['pnn50'] = (np.sum(successive_diff > 50) / len(successive_diff)) * 100
     
-    return metrics
\ No newline at end of file
+    return metrics
+
+
+def _window_sums(values: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    """Sum of values[lo:hi] for every window, from one cumulative sum."""
+    cumulative = np.concatenate(([0], np.cumsum(values)))
+    return cumulative[hi] - cumulative[lo]
+
+
+def sample_entropy_batch(windows: np.ndarray, lengths: np.ndarray, m: int = 2,
+                         r: float = 0.2) -> np.ndarray:
+    """
+    Sample entropy of several series at once.
+
+    Series are rows of a NaN padded array. Template matches are counted with
+    the Chebyshev distance between every pair of templates of a row, computed
+    by broadcasting over tiles of rows and templates holding at most
+    ENTROPY_CELLS template pairs, so memory does not grow with the square of
+    the series length.
+
+    Args:
+        windows: (series x samples) array, padded with NaN after each series
+        lengths: Length of each series
+        m: Template length
+        r: Tolerance as a fraction of each series' standard deviation
+
+    Returns:
+        Sample entropy of each series; NaN where no templates match
+    """
+    n_windows, width = windows.shape
+    entropy = np.full(n_windows, np.nan)
+    if width <= m + 1:
+        return entropy
+    tolerance = r * np.nanstd(windows, axis=1)
+    n_templates = width - m
+    index = np.arange(n_templates)
+    # Whole rows per tile while they fit, otherwise one row and a slice of its templates
+    block = max(ENTROPY_CELLS // (n_templates * n_templates), 1)
+    tile = n_templates if block > 1 else min(max(ENTROPY_CELLS // n_templates, 1), n_templates)
+    matches = np.zeros(n_windows, dtype=np.int64)
+    extended_matches = np.zeros(n_windows, dtype=np.int64)
+    for first in range(0, n_windows, block):
+        rows = windows[first:first + block]
+        usable = lengths[first:first + block, None, None] - m
+        limit = tolerance[first:first + block, None, None]
+        for start in range(0, n_templates, tile):
+            # Templates i of the whole row against templates j of the tile, i < j, both starting before length - m
+            other = index[start:start + tile]
+            template = np.zeros((rows.shape[0], n_templates, other.shape[0]))
+            for k in range(m):
+                np.maximum(template, np.abs(rows[:, k:n_templates + k, None] - rows[:, None, other + k]), out=template)
+            extended = np.maximum(template, np.abs(rows[:, m:, None] - rows[:, None, other + m]))
+            valid = (index[:, None] < other[None, :]) & (index[None, :, None] < usable) \
+                & (other[None, None, :] < usable)
+            matches[first:first + block] += np.count_nonzero(valid & (template <= limit), axis=(1, 2))
+            extended_matches[first:first + block] += np.count_nonzero(valid & (extended <= limit), axis=(1, 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = -np.log(extended_matches / matches)
+    entropy[~np.isfinite(entropy)] = np.nan
+    return entropy
+
+
+def windowed_hrv(beat_times: np.ndarray, window: float = 300, step: Optional[float] = None,
+                 resample_fs: float = 4, nperseg: int = 256, m: int = 2,
+                 r: float = 0.2) -> Dict[str, np.ndarray]:
+    """
+    Calculate heart rate variability metrics over every window of a recording in one batch.
+
+    Time domain metrics and the Poincaré SD1/SD2 come from cumulative sums over
+    the whole RR series. LF and HF power come from Welch's method on the RR
+    series resampled at resample_fs, run on all windows at once. An RR interval
+    belongs to the window its second beat falls in.
+
+    Args:
+        beat_times: Times of the R peaks in seconds
+        window: Window length in seconds, 5 minutes by default
+        step: Distance between window starts in seconds, defaults to the window length
+        resample_fs: Frequency the RR series is resampled at for the spectrum
+        nperseg: Length of each Welch segment in resampled samples
+        m: Template length of the sample entropy
+        r: Tolerance of the sample entropy as a fraction of each window's SDNN
+
+    Returns:
+        Arrays with one value per window: start (s), n_beats, mean_rr, sdnn, rmssd,
+        pnn50, sd1, sd2, lf, hf, lf_hf and sample_entropy; intervals in ms and
+        powers in ms^2
+    """
+    step = window if step is None else step
+    beat_times = np.asarray(beat_times, dtype=np.float64)
+    rr = np.diff(beat_times) * 1000
+    rr_times = beat_times[1:]
+    end = beat_times[-1] if beat_times.shape[0] else 0
+    starts = np.arange(0, end - window + 1e-9, step) if end >= window else np.empty(0)
+
+    # RR intervals within each window
+    lo = np.searchsorted(rr_times, starts, side='left')
+    hi = np.searchsorted(rr_times, starts + window, side='left')
+    count = hi - lo
+    # Successive differences within each window: rr[i + 1] - rr[i] for i in [lo, hi - 1)
+    diff_hi = np.maximum(hi - 1, lo)
+    diff_count = diff_hi - lo
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Centred on the overall mean to keep the cumulative sums accurate
+        centre = rr.mean() if rr.shape[0] else 0
+        centred = rr - centre
+        mean = _window_sums(centred, lo, hi) / count
+        variance = np.maximum(_window_sums(centred ** 2, lo, hi) / count - mean ** 2, 0)
+        successive = np.diff(rr)
+        diff_mean = _window_sums(successive, lo, diff_hi) / diff_count
+        diff_square = _window_sums(successive ** 2, lo, diff_hi) / diff_count
+        pnn50 = _window_sums((np.abs(successive) > 50).astype(np.float64), lo, diff_hi) / diff_count * 100
+        sd1_square = np.maximum(diff_square - diff_mean ** 2, 0) / 2
+        sd2 = np.sqrt(np.maximum(2 * variance - sd1_square, 0))
+
+    # Spectrum of the RR series resampled on a uniform grid
+    n_grid = int(round(window * resample_fs))
+    lf = hf = np.full(starts.shape[0], np.nan)
+    if starts.shape[0] and rr.shape[0] > 1:
+        grid = np.arange(int(np.ceil(end * resample_fs)) + 1) / resample_fs
+        resampled = np.interp(grid, rr_times, rr)
+        first = np.minimum(np.round(starts * resample_fs).astype(np.int64), grid.shape[0] - n_grid)
+        segments = si.detrend(resampled[first[:, None] + np.arange(n_grid)], axis=-1)
+        frequencies, power = si.welch(segments, fs=resample_fs, nperseg=min(nperseg, n_grid), axis=-1)
+        bands = []
+        for low, high in (LF_BAND, HF_BAND):
+            band = (frequencies >= low) & (frequencies < high)
+            bands.append(integrate.trapezoid(power[:, band], frequencies[band], axis=-1))
+        lf, hf = bands
+        # Windows without enough beats have no spectrum
+        lf = np.where(count > 1, lf, np.nan)
+        hf = np.where(count > 1, hf, np.nan)
+
+    # Sample entropy of each window's RR series, padded with NaN
+    width = int(count.max()) if count.shape[0] else 0
+    padded = np.full((starts.shape[0], width), np.nan)
+    columns = np.arange(width)
+    rows = columns[None, :] < count[:, None]
+    padded[rows] = rr[(lo[:, None] + columns[None, :])[rows]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'start': starts,
+            'n_beats': count,
+            'mean_rr': mean + centre,
+            'sdnn': np.sqrt(variance),
+            'rmssd': np.sqrt(diff_square),
+            'pnn50': pnn50,
+            'sd1': np.sqrt(sd1_square),
+            'sd2': sd2,
+            'lf': lf,
+            'hf': hf,
+            'lf_hf': lf / hf,
+            'sample_entropy': sample_entropy_batch(padded, count, m=m, r=r),
+        }
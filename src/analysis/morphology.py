@@ -0,0 +1,130 @@
+"""Beat-aligned windows, templates and template correlation."""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Dict, Iterator, Tuple
+
+# Beats cut per chunk when iterating over a long recording
+BEAT_CHUNK = 4096
+# Beats the median template is taken from, spread evenly over the recording
+MEDIAN_BEATS = 10000
+
+
+def beat_matrix(signal: np.ndarray, samples: np.ndarray, before: int, after: int,
+                fill: float = np.nan) -> np.ndarray:
+    """
+    Cut a window around each beat into a (beats x samples) matrix, without a per-beat loop.
+
+    Windows inside the signal are gathered from a sliding window view; windows
+    running over either end are gathered with clipped indices and the samples
+    outside the signal set to fill.
+
+    Args:
+        signal: The signal
+        samples: Sample of each beat
+        before: Samples kept before each beat
+        after: Samples kept from each beat onwards
+        fill: Value of the samples outside the signal
+
+    Returns:
+        The aligned beats, each row running from sample - before to sample + after
+    """
+    width = before + after
+    starts = np.asarray(samples, dtype=np.int64) - before
+    dtype = np.result_type(signal.dtype, np.float32) if np.isnan(fill) else signal.dtype
+    matrix = np.empty((starts.shape[0], width), dtype=dtype)
+    inside = (starts >= 0) & (starts + width <= signal.shape[0])
+    if signal.shape[0] >= width:
+        matrix[inside] = sliding_window_view(signal, width)[starts[inside]]
+    edges = np.flatnonzero(~inside)
+    if edges.shape[0]:
+        index = starts[edges, None] + np.arange(width)
+        valid = (index >= 0) & (index < signal.shape[0])
+        matrix[edges] = fill
+        rows, columns = np.nonzero(valid)
+        matrix[edges[rows], columns] = signal[index[rows, columns]]
+    return matrix
+
+
+def iter_beat_matrix(signal: np.ndarray, samples: np.ndarray, before: int, after: int,
+                     chunk_beats: int = BEAT_CHUNK, fill: float = np.nan) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Cut the beat matrix chunk by chunk, holding at most chunk_beats rows at a time.
+
+    Args:
+        signal: The signal
+        samples: Sample of each beat
+        before: Samples kept before each beat
+        after: Samples kept from each beat onwards
+        chunk_beats: Beats per chunk
+        fill: Value of the samples outside the signal
+
+    Returns:
+        Iterator of (index of the chunk's first beat, its rows of the beat matrix)
+    """
+    for first in range(0, np.shape(samples)[0], chunk_beats):
+        yield first, beat_matrix(signal, samples[first:first + chunk_beats], before, after, fill)
+
+
+def beat_templates(signal: np.ndarray, samples: np.ndarray, before: int, after: int,
+                   chunk_beats: int = BEAT_CHUNK, median_beats: int = MEDIAN_BEATS) -> Dict[str, np.ndarray]:
+    """
+    Mean and median beat, in bounded memory.
+
+    The mean is accumulated over every beat chunk by chunk. The median needs all
+    its beats at once, so it is taken over at most median_beats beats spread
+    evenly over the recording; below that it uses every beat. Samples outside
+    the signal are ignored.
+
+    Args:
+        signal: The signal
+        samples: Sample of each beat
+        before: Samples kept before each beat
+        after: Samples kept from each beat onwards
+        chunk_beats: Beats per chunk
+        median_beats: Most beats the median is taken over
+
+    Returns:
+        'mean' and 'median' templates of before + after samples
+    """
+    samples = np.asarray(samples)
+    width = before + after
+    total = np.zeros(width)
+    count = np.zeros(width, dtype=np.int64)
+    for _, matrix in iter_beat_matrix(signal, samples, before, after, chunk_beats):
+        total += np.nansum(matrix, axis=0, dtype=np.float64)
+        count += np.count_nonzero(~np.isnan(matrix), axis=0)
+    picked = samples
+    if samples.shape[0] > median_beats:
+        picked = samples[np.linspace(0, samples.shape[0] - 1, median_beats).round().astype(np.int64)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    if picked.shape[0]:
+        median = np.nanmedian(beat_matrix(signal, picked, before, after), axis=0)
+    else:
+        median = np.full(width, np.nan)
+    return {'mean': mean, 'median': median}
+
+
+def template_correlation(matrix: np.ndarray, template: np.ndarray) -> np.ndarray:
+    """
+    Pearson correlation of each beat with a template, over the samples inside the signal.
+
+    Args:
+        matrix: (beats x samples) aligned beats, with NaN outside the signal
+        template: The template
+
+    Returns:
+        The correlation of each beat, NaN for beats that are flat or have fewer than two samples
+    """
+    valid = ~np.isnan(matrix) & ~np.isnan(template)
+    n = np.count_nonzero(valid, axis=1)
+    beats = np.where(valid, matrix, 0).astype(np.float64, copy=False)
+    reference = np.where(valid, template, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beats -= (beats.sum(axis=1) / n)[:, None]
+        reference = reference - (reference.sum(axis=1) / n)[:, None]
+        beats *= valid
+        reference *= valid
+        covariance = np.einsum('ij,ij->i', beats, reference)
+        spread = np.sqrt(np.einsum('ij,ij->i', beats, beats) * np.einsum('ij,ij->i', reference, reference))
+        return covariance / spread
@@ -0,0 +1,4 @@
+"""Batch processing of recording cohorts."""
+from .runner import find_recordings, process_recording, run_batch
+
+__all__ = ['find_recordings', 'process_recording', 'run_batch']
@@ -0,0 +1,23 @@
+"""Command line entry point: python -m src.batch SOURCE OUTPUT [--workers N]."""
+import argparse
+from .runner import run_batch
+
+
+def main() -> None:
+    """Parse the command line arguments and run the batch."""
+    parser = argparse.ArgumentParser(description='Run the ECG pipeline over a cohort of recordings.')
+    parser.add_argument('source', help='Directory (searched recursively) or glob pattern of recordings')
+    parser.add_argument('output', help='Results file, .parquet or .csv')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    parser.add_argument('--cache-dir', default=None, help='Directory of the memory-mapped recording cache')
+    parser.add_argument('--profile', default=None, help='JSON file for the stage timings of the batch')
+    args = parser.parse_args()
+    table = run_batch(args.source, args.output, workers=args.workers, profile=args.profile,
+                      cache_dir=args.cache_dir)
+    if table.empty:
+        parser.exit(1, f'No recordings found in {args.source}\n')
+    print(table['status'].value_counts().to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""Multi-process batch runner over a cohort of recordings."""
+import concurrent.futures
+import glob
+import multiprocessing
+import os
+import time
+import traceback
+import numpy as np
+import pandas as pd
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, MutableMapping, Optional, Sequence, Tuple
+from .. import profiling
+from ..analysis import metrics
+from ..core.ecg_data import ECGData
+
+# File extensions ECGData can read
+EXTENSIONS = ('.csv', '.edf', '.npz')
+# Columns every results table has, even when no recording was found
+RESULT_COLUMNS = ('file_path', 'lead', 'status', 'error')
+
+# Results rows of a recording and its stage timings, if profiled
+Outcome = Tuple[List[Dict[str, Any]], Optional[profiling.Registry]]
+
+
+def find_recordings(source: str, extensions: Sequence[str] = EXTENSIONS) -> List[str]:
+    """
+    Find the recordings to process.
+
+    Args:
+        source: A directory, searched recursively, or a glob pattern
+        extensions: File extensions to keep
+
+    Returns:
+        Sorted paths of the recordings
+    """
+    if os.path.isdir(source):
+        source = os.path.join(source, '**', '*')
+    paths = glob.glob(source, recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(tuple(extensions)))
+
+
+def _failure(file_path: str, lead: Optional[int], error: BaseException) -> Dict[str, Any]:
+    """Build the results row of a recording or lead that failed."""
+    return {
+        'file_path': file_path,
+        'lead': lead,
+        'status': 'failed',
+        'error': ''.join(traceback.format_exception_only(type(error), error)).strip(),
+    }
+
+
+def process_recording(file_path: str, **kwargs: Any) -> List[Dict[str, Any]]:
+    """
+    Run the pipeline on one recording and summarise each lead.
+
+    Errors are recorded in the returned rows rather than raised.
+
+    Args:
+        file_path: Path to the recording
+        kwargs: Extra arguments for ECGData, such as leads or cache_dir
+
+    Returns:
+        One results row per lead, or a single failed row if the file could not be loaded
+    """
+    return _process_recording(file_path, False, kwargs)[0]
+
+
+def _process_recording(file_path: str, profile: bool,
+                       kwargs: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Optional[profiling.Registry]]:
+    """Run process_recording, collecting the stage timings when profile is set."""
+    if not profile:
+        return _summarise_recording(file_path, **kwargs), None
+    with profiling.collect() as registry:
+        rows = _summarise_recording(file_path, **kwargs)
+    # Per recording stage timings, as JSON
+    for row in rows:
+        row['profile'] = registry.to_json()
+    return rows, registry
+
+
+def _summarise_recording(file_path: str, **kwargs: Any) -> List[Dict[str, Any]]:
+    """Build the results rows of one recording."""
+    start = time.perf_counter()
+    try:
+        ecg_data = ECGData(file_path, **kwargs)
+        load_time = time.perf_counter() - start
+        # Detect the R peaks of all leads in one pass
+        start = time.perf_counter()
+        ecg_data.detect_r_peaks()
+        detect_time = time.perf_counter() - start
+    except Exception as error:
+        return [_failure(file_path, None, error)]
+
+    rows = []
+    for index, lead in ecg_data.channels.items():
+        start = time.perf_counter()
+        try:
+            r_peaks = lead.r_peaks[:, 0]
+            # RR intervals in ms
+            rr = np.diff(r_peaks) / lead.fs * 1000
+            row = {
+                'file_path': file_path,
+                'lead': index,
+                'status': 'ok',
+                'error': None,
+                'fs': lead.fs,
+                'n_samples': lead.signal.shape[0],
+                'duration': lead.signal.shape[0] / lead.fs,
+                'n_beats': r_peaks.shape[0],
+                'bpm': lead.bpm,
+            }
+            row.update(metrics.calculate_hrv_metrics(rr) if rr.shape[0] > 1 else {})
+            row['load_time'] = load_time
+            row['detect_time'] = detect_time
+            row['process_time'] = time.perf_counter() - start
+        except Exception as error:
+            row = _failure(file_path, index, error)
+        rows.append(row)
+    return rows
+
+
+def _run_recording(file_path: str, profile: bool, kwargs: Dict[str, Any],
+                   started: MutableMapping[str, int]) -> Tuple[List[Dict[str, Any]], Optional[profiling.Registry]]:
+    """Run _process_recording in a worker, first noting that the recording has started."""
+    started[file_path] = os.getpid()
+    return _process_recording(file_path, profile, kwargs)
+
+
+def _run_pool(paths: Sequence[str], workers: Optional[int], profile: bool, kwargs: Dict[str, Any],
+              started: MutableMapping[str, int]) -> Tuple[Dict[str, Outcome], Dict[str, BaseException]]:
+    """
+    Run recordings on one process pool.
+
+    Returns:
+        The outcome of each recording that finished, and the error of each
+        recording left unfinished because a worker died and broke the pool
+    """
+    finished: Dict[str, Outcome] = {}
+    broken: Dict[str, BaseException] = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run_recording, path, profile, kwargs, started): path for path in paths}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                finished[path] = future.result()
+            except BrokenProcessPool as error:
+                broken[path] = error
+            except Exception as error:
+                finished[path] = [_failure(path, None, error)], None
+    return finished, broken
+
+
+def run_batch(source: str, output: Optional[str] = None, workers: Optional[int] = None,
+              profile: Optional[str] = None, **kwargs: Any) -> pd.DataFrame:
+    """
+    Run the pipeline over every recording in a directory or glob across processes.
+
+    A recording that fails is recorded as failed and the run carries on. When a
+    worker dies, for instance killed for running out of memory, the pool breaks
+    and every unfinished recording with it. The recordings that were running
+    are then rerun one at a time on a pool of their own, and only those that
+    break it again are recorded as failed; the recordings that had not started
+    are resubmitted to a fresh pool.
+
+    Args:
+        source: A directory, searched recursively, or a glob pattern
+        output: Path of the results file, written as Parquet if it ends in
+            .parquet and CSV otherwise
+        workers: Number of worker processes, defaults to the number of CPUs
+        profile: Path of a JSON file for the stage timings of the whole batch; when
+            set, each row also holds the timings of its recording
+        kwargs: Extra arguments for ECGData, such as leads or cache_dir
+
+    Returns:
+        Results table with one row per lead, empty with RESULT_COLUMNS if no recording was found
+    """
+    paths = find_recordings(source)
+    results: Dict[str, Outcome] = {}
+    pending = list(paths)
+    with multiprocessing.Manager() as manager:
+        while pending:
+            # Recordings a worker has started on, so those running when the pool broke are known
+            started = manager.dict()
+            finished, broken = _run_pool(pending, workers, profile is not None, kwargs, started)
+            results.update(finished)
+            suspects = [path for path in broken if path in started]
+            if not suspects:
+                # The pool broke before any recording started, so retrying would break it again
+                suspects = list(broken)
+            for path in suspects:
+                alone, crashed = _run_pool([path], 1, profile is not None, kwargs, manager.dict())
+                results.update(alone)
+                if crashed:
+                    results[path] = [_failure(path, None, crashed[path])], None
+            pending = [path for path in broken if path not in suspects]
+
+    if profile is not None:
+        registry = profiling.Registry()
+        for _, recording_registry in results.values():
+            if recording_registry is not None:
+                registry.merge(recording_registry)
+        registry.to_json(profile)
+
+    rows = [row for path in paths for row in results[path][0]]
+    table = pd.DataFrame(rows, columns=None if paths else RESULT_COLUMNS)
+    if output is not None:
+        if output.endswith('.parquet'):
+            table.to_parquet(output, index=False)
+        else:
+            table.to_csv(output, index=False)
+    return table
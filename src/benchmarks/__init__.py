@@ -0,0 +1,8 @@
+"""Benchmarks of the pipeline on synthetic ECG."""
+from .synthetic import SyntheticECG, synthetic_ecg, match_beats, HOLTER_FS, WATCH_FS
+from .suite import BenchmarkResult, run_suite, save_results, load_results, compare, PRESETS, RATES
+
+__all__ = [
+    'SyntheticECG', 'synthetic_ecg', 'match_beats', 'HOLTER_FS', 'WATCH_FS',
+    'BenchmarkResult', 'run_suite', 'save_results', 'load_results', 'compare', 'PRESETS', 'RATES'
+]
@@ -0,0 +1,79 @@
+"""Command line entry point: python -m src.benchmarks {run,compare,memory,delineation} ..."""
+import argparse
+import os
+from .suite import (DELINEATION_LIMIT, FORMATS, MEMORY_LIMIT, PRESETS, RATES, STAGES, check_delineation_memory,
+                    check_peak_memory, compare, environment, run_suite, save_results)
+
+# Directory results are saved to when no output file is given
+RESULTS_DIR = 'benchmark_results'
+
+
+def main() -> None:
+    """Parse the command line arguments and run or compare benchmarks."""
+    parser = argparse.ArgumentParser(description='Benchmark the ECG pipeline on synthetic recordings.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Run the benchmarks and save the results')
+    run.add_argument('--preset', choices=sorted(PRESETS), default='quick', help='Recording lengths to run')
+    run.add_argument('--durations', type=float, nargs='+', default=None,
+                     help='Recording lengths in seconds, overriding the preset')
+    run.add_argument('--rates', choices=sorted(RATES), nargs='+', default=list(RATES), help='Recording types')
+    run.add_argument('--stages', choices=STAGES, nargs='+', default=list(STAGES), help='Single lead stages')
+    run.add_argument('--formats', choices=sorted(FORMATS), nargs='+', default=['npz'],
+                     help='File formats ECGData is benchmarked on')
+    run.add_argument('--leads', type=int, default=3, help='Number of leads of the recordings')
+    run.add_argument('--repeats', type=int, default=5, help='Timed calls per stage')
+    run.add_argument('--dtype', choices=('float64', 'float32'), default='float64',
+                     help='Floating point type the signals are processed in')
+    run.add_argument('--output', default=None, help='Results file, defaults to one named by the commit')
+
+    diff = commands.add_parser('compare', help='Compare two results files')
+    diff.add_argument('baseline', help='Results file of the reference commit')
+    diff.add_argument('current', help='Results file of the commit under test')
+    diff.add_argument('--tolerance', type=float, default=0.1, help='Relative slowdown flagged as a regression')
+
+    memory = commands.add_parser('memory', help='Check the peak memory of loading and detecting R peaks')
+    memory.add_argument('--duration', type=float, default=3600, help='Recording length in seconds')
+    memory.add_argument('--rate', choices=sorted(RATES), default='holter', help='Recording type')
+    memory.add_argument('--format', choices=sorted(FORMATS), default='npz', help='File format')
+    memory.add_argument('--leads', type=int, default=3, help='Number of leads of the recording')
+    memory.add_argument('--dtype', choices=('float64', 'float32'), default='float64',
+                        help='Floating point type the signals are loaded as')
+    memory.add_argument('--limit', type=float, default=MEMORY_LIMIT,
+                        help='Largest peak memory allowed, in multiples of the signals')
+
+    gaps = commands.add_parser('delineation', help='Check the peak memory of delineating a recording with a long gap')
+    gaps.add_argument('--duration', type=float, default=3600, help='Recording length in seconds')
+    gaps.add_argument('--rate', choices=sorted(RATES), default='holter', help='Recording type')
+    gaps.add_argument('--gap', type=float, default=600, help='Length of the gap in seconds')
+    gaps.add_argument('--limit', type=float, default=DELINEATION_LIMIT,
+                      help='Largest peak memory allowed, in multiples of the peak without the gap')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        durations = args.durations if args.durations is not None else PRESETS[args.preset]
+        results = run_suite(durations, args.rates, n_leads=args.leads, repeats=args.repeats,
+                            formats=args.formats, stages=args.stages, dtype=args.dtype)
+        output = args.output
+        if output is None:
+            env = environment()
+            name = f"{env['timestamp'].replace(':', '')}_{(env['commit'] or 'unknown')[:10]}.json"
+            output = os.path.join(RESULTS_DIR, name)
+        print(f'Results saved to {save_results(results, output)}')
+    elif args.command == 'memory':
+        ratio = check_peak_memory(args.duration, args.rate, n_leads=args.leads, dtype=args.dtype,
+                                  file_format=args.format, limit=args.limit)
+        print(f'Peak memory is {ratio:.2f} times the signals, within the limit of {args.limit:g}')
+    elif args.command == 'delineation':
+        ratio = check_delineation_memory(args.duration, args.rate, gap=args.gap, limit=args.limit)
+        print(f'Peak memory with the gap is {ratio:.2f} times that without it, within the limit of {args.limit:g}')
+    else:
+        table = compare(args.baseline, args.current, args.tolerance)
+        print(table.to_string(index=False))
+        regressed = table[table['regressed']]
+        if not regressed.empty:
+            print(f'{len(regressed)} stages slower by more than {args.tolerance:.0%}')
+
+
+if __name__ == '__main__':
+    main()
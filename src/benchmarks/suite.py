@@ -0,0 +1,370 @@
+"""Throughput and memory benchmarks of the pipeline stages."""
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from numpy.typing import DTypeLike
+import pandas as pd
+import scipy
+from .. import profiling
+from ..core.ecg_data import ECGData
+from ..core.ecg_lead import ECGLead
+from ..processing import compiled, delineation, detectors, transforms
+from . import synthetic
+
+# Sampling frequencies benchmarked, by recording type
+RATES = {'holter': synthetic.HOLTER_FS, 'watch': synthetic.WATCH_FS}
+# Recording lengths in seconds, from one watch strip up to a 48 hour Holter
+PRESETS = {
+    'quick': (30, 300),
+    'standard': (30, 300, 3600),
+    'full': (30, 300, 3600, 24 * 3600, 48 * 3600),
+}
+# Stages timed on a single lead
+STAGES = ('grad_square_conv', 'phasor_transform', 'threshold_calc', 'peak', 'ECGLead')
+# File formats ECGData is benchmarked on
+FORMATS = {'npz': ('.npz', synthetic.write_npz), 'edf': ('.edf', synthetic.write_edf)}
+# Signals longer than this are timed once rather than repeat times
+LONG_SIGNAL = int(1e7)
+# Largest distance between a detected and a known R peak, in seconds
+MATCH_TOLERANCE = 0.05
+# Peak memory of loading a recording and detecting its R peaks, in multiples of its signals in dtype
+MEMORY_LIMIT = 5
+# Peak memory of delineating a recording with a long gap, in multiples of the same recording without it
+DELINEATION_LIMIT = 2
+
+
+@dataclass
+class BenchmarkResult:
+    """Timing and memory of one stage on one synthetic recording."""
+    recording: str
+    fs: float
+    duration: float
+    n_leads: int
+    stage: str
+    n_samples: int
+    repeats: int
+    dtype: str
+    best_s: float
+    mean_s: float
+    samples_per_s: float
+    peak_memory: int
+    breakdown_ms: Dict[str, float] = field(default_factory=dict)
+    sensitivity: Optional[float] = None
+    precision: Optional[float] = None
+
+
+def _measure(name: str, func: Callable[[], Any], repeats: int) -> Dict[str, Any]:
+    """
+    Time a call repeatedly, then measure its peak memory in one traced call.
+
+    Memory is traced separately so that tracemalloc does not slow the timed calls.
+
+    Args:
+        name: Name of the stage
+        func: The call to measure
+        repeats: Number of timed calls
+
+    Returns:
+        Best and mean durations in s, peak memory in bytes, the total time of
+        each instrumented stage called within it in ms, and the last result
+    """
+    with profiling.collect() as registry:
+        durations = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = func()
+            durations.append(time.perf_counter() - start)
+    breakdown = {stage: stats['total_ms'] / repeats for stage, stats in registry.summary().items()
+                 if stage != name}
+
+    return {'best_s': min(durations), 'mean_s': float(np.mean(durations)), 'peak_memory': _peak_memory(func),
+            'breakdown_ms': breakdown, 'result': result}
+
+
+def _peak_memory(func: Callable[[], Any]) -> int:
+    """Peak memory in bytes allocated by a call, traced with tracemalloc."""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+    peak_memory = tracemalloc.get_traced_memory()[1] - baseline
+    if not tracing:
+        tracemalloc.stop()
+    return peak_memory
+
+
+def _lead_stages(recording: synthetic.SyntheticECG, dtype: DTypeLike = np.float64) -> Dict[str, Callable[[], Any]]:
+    """Build the single lead stage calls of a recording."""
+    raw = recording.signals[0]
+    signal = np.divide(raw, 1000, dtype=dtype)
+    fs = recording.fs
+    window = transforms.grad_square_conv(signal, fs)
+    threshold = detectors.threshold_calc(window)
+
+    def full_lead() -> ECGLead:
+        lead = ECGLead(lead=0, signal=raw, fs=fs, units=recording.units, dtype=dtype)
+        lead.r_peaks, lead.p_peaks, lead.rr_int
+        return lead
+
+    return {
+        'grad_square_conv': lambda: transforms.grad_square_conv(signal, fs),
+        'phasor_transform': lambda: transforms.phasor_transform(signal, rv=0.001),
+        'threshold_calc': lambda: detectors.threshold_calc(window),
+        'peak': lambda: detectors.peak(signal=window, threshold=threshold),
+        'ECGLead': full_lead,
+    }
+
+
+def _data_stage(file_path: str, dtype: DTypeLike = np.float64) -> Callable[[], ECGData]:
+    """Build the call that loads a recording file and detects the R peaks of every lead."""
+    def full_data() -> ECGData:
+        ecg_data = ECGData(file_path, dtype=dtype)
+        ecg_data.detect_r_peaks()
+        return ecg_data
+    return full_data
+
+
+def _accuracy(detected: np.ndarray, recording: synthetic.SyntheticECG) -> Dict[str, float]:
+    """Sensitivity and precision of detected R peaks against the known ones."""
+    true_positives, false_positives, false_negatives = synthetic.match_beats(
+        detected, recording.r_peaks, int(MATCH_TOLERANCE * recording.fs))
+    return {
+        'sensitivity': true_positives / max(true_positives + false_negatives, 1),
+        'precision': true_positives / max(true_positives + false_positives, 1),
+    }
+
+
+def run_suite(durations: Sequence[float] = PRESETS['quick'], rates: Sequence[str] = tuple(RATES),
+              n_leads: int = 3, repeats: int = 5, formats: Sequence[str] = ('npz',),
+              stages: Sequence[str] = STAGES, seed: int = 0, dtype: DTypeLike = np.float64,
+              log: Optional[Callable[[str], None]] = print) -> List[BenchmarkResult]:
+    """
+    Benchmark the pipeline on synthetic recordings of each rate and length.
+
+    Args:
+        durations: Recording lengths in seconds
+        rates: Recording types to benchmark, keys of RATES
+        n_leads: Number of leads of the recordings loaded by ECGData
+        repeats: Number of timed calls per stage; signals longer than LONG_SIGNAL are timed once
+        formats: File formats ECGData is benchmarked on, keys of FORMATS
+        stages: Single lead stages to benchmark, from STAGES
+        seed: Seed of the synthetic recordings
+        dtype: Floating point type the signals are processed in
+        log: Called with a line of progress per result, or None for silence
+
+    Returns:
+        One result per recording and stage
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rate in rates:
+            for duration in durations:
+                recording = synthetic.synthetic_ecg(duration, RATES[rate], n_leads=n_leads, seed=seed)
+                n_samples = recording.n_samples
+                count = repeats if n_samples * n_leads <= LONG_SIGNAL else 1
+                base = {'recording': rate, 'fs': recording.fs, 'duration': duration, 'n_leads': n_leads,
+                        'dtype': np.dtype(dtype).name}
+
+                calls = _lead_stages(recording, dtype)
+                measured = {stage: (calls[stage], n_samples) for stage in stages}
+                for file_format in formats:
+                    extension, write = FORMATS[file_format]
+                    file_path = write(recording, synthetic.default_path(directory, recording, extension))
+                    measured[f'ECGData.{file_format}'] = (_data_stage(file_path, dtype), n_samples * n_leads)
+
+                for stage, (func, samples) in measured.items():
+                    measurement = _measure(stage, func, count)
+                    result = measurement.pop('result')
+                    if isinstance(result, ECGLead):
+                        measurement.update(_accuracy(result.r_peaks[:, 0], recording))
+                    elif isinstance(result, ECGData):
+                        measurement.update(_accuracy(next(iter(result.channels.values())).r_peaks[:, 0],
+                                                     recording))
+                    results.append(BenchmarkResult(
+                        stage=stage, n_samples=samples, repeats=count,
+                        samples_per_s=samples / measurement['best_s'], **base, **measurement))
+                    if log is not None:
+                        log(format_result(results[-1]))
+    return results
+
+
+def check_peak_memory(duration: float = 3600, rate: str = 'holter', n_leads: int = 3,
+                      dtype: DTypeLike = np.float64, file_format: str = 'npz', limit: float = MEMORY_LIMIT,
+                      seed: int = 0) -> float:
+    """
+    Check that loading a recording and detecting its R peaks stays within a memory budget.
+
+    Args:
+        duration: Recording length in seconds
+        rate: Recording type, a key of RATES
+        n_leads: Number of leads
+        dtype: Floating point type the signals are loaded as
+        file_format: File format the recording is loaded from, a key of FORMATS
+        limit: Largest peak memory allowed, in multiples of the signals' size in dtype
+        seed: Seed of the synthetic recording
+
+    Returns:
+        Peak memory in multiples of the signals' size in dtype
+
+    Raises:
+        MemoryError: If the peak memory is above the limit
+    """
+    recording = synthetic.synthetic_ecg(duration, RATES[rate], n_leads=n_leads, seed=seed)
+    signal_bytes = recording.signals.size * np.dtype(dtype).itemsize
+    with tempfile.TemporaryDirectory() as directory:
+        extension, write = FORMATS[file_format]
+        file_path = write(recording, synthetic.default_path(directory, recording, extension))
+        del recording
+        ratio = _peak_memory(_data_stage(file_path, dtype)) / signal_bytes
+    if ratio > limit:
+        raise MemoryError(f'Peak memory is {ratio:.2f} times the signals in {np.dtype(dtype).name}, '
+                          f'above the limit of {limit:g}')
+    return ratio
+
+
+def check_delineation_memory(duration: float = 3600, rate: str = 'holter', gap: float = 600,
+                             limit: float = DELINEATION_LIMIT, seed: int = 0) -> float:
+    """
+    Check that a long gap between beats does not blow up the memory of delineating the P and T waves.
+
+    The lead goes flat for gap seconds in the middle of the recording, as when
+    an electrode comes off, so one RR interval spans the whole gap.
+
+    Args:
+        duration: Recording length in seconds
+        rate: Recording type, a key of RATES
+        gap: Length of the gap in seconds
+        limit: Largest peak memory allowed, in multiples of the peak without the gap
+        seed: Seed of the synthetic recording
+
+    Returns:
+        Peak memory with the gap in multiples of the peak without it
+
+    Raises:
+        MemoryError: If the peak memory is above the limit
+    """
+    recording = synthetic.synthetic_ecg(duration, RATES[rate], n_leads=1, seed=seed)
+    signal, fs = recording.signals[0], recording.fs
+    gap_start = int(duration / 2 * fs)
+    gap_stop = gap_start + int(gap * fs)
+    gapped_signal = signal.copy()
+    gapped_signal[gap_start:gap_stop] = 0
+    r_samples = recording.r_peaks
+    gapped = r_samples[(r_samples < gap_start) | (r_samples >= gap_stop)]
+
+    def delineate(delineate_signal: np.ndarray, samples: np.ndarray) -> Callable[[], Any]:
+        def both() -> Tuple[delineation.PWaves, delineation.TWaves]:
+            return (delineation.delineate_p_waves(delineate_signal, samples, fs),
+                    delineation.delineate_t_waves(delineate_signal, samples, fs))
+        return both
+
+    ratio = _peak_memory(delineate(gapped_signal, gapped)) / _peak_memory(delineate(signal, r_samples))
+    if ratio > limit:
+        raise MemoryError(f'Peak memory of delineation with a {gap:g} s gap is {ratio:.2f} times that '
+                          f'without it, above the limit of {limit:g}')
+    return ratio
+
+
+def format_result(result: BenchmarkResult) -> str:
+    """Format a result as one line of progress."""
+    return (f'{result.recording:>7} {result.duration:>8g}s {result.dtype:>7} {result.stage:<18} '
+            f'{result.best_s * 1000:>11.2f} ms {result.samples_per_s / 1e6:>9.2f} MS/s '
+            f'{result.peak_memory / 2 ** 20:>9.1f} MiB')
+
+
+def _git_commit() -> Optional[str]:
+    """The commit of the working tree, if it is a git repository."""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    """Describe where the benchmarks ran, for comparing results between commits."""
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'backend': compiled.get_backend(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(results: List[BenchmarkResult], path: str) -> str:
+    """
+    Save results, with the environment they ran in, as JSON.
+
+    Args:
+        results: The benchmark results
+        path: File to write
+
+    Returns:
+        The path of the file
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'environment': environment(), 'results': [asdict(result) for result in results]}, f, indent=2)
+    return path
+
+
+def load_results(path: str) -> pd.DataFrame:
+    """
+    Load saved results as a table.
+
+    Args:
+        path: File written by save_results
+
+    Returns:
+        One row per recording and stage
+    """
+    with open(path) as f:
+        table = pd.DataFrame(json.load(f)['results'])
+    # Results saved before the dtype option ran in float64
+    if 'dtype' not in table:
+        table['dtype'] = 'float64'
+    return table
+
+
+def compare(baseline: str, current: str, tolerance: float = 0.1) -> pd.DataFrame:
+    """
+    Compare two sets of saved results.
+
+    Args:
+        baseline: Results file of the reference commit
+        current: Results file of the commit under test
+        tolerance: Relative slowdown of the best time above which a stage is flagged
+
+    Returns:
+        Best times and peak memory of each stage in both runs, their ratios
+        (current over baseline) and whether the stage regressed
+    """
+    keys = ['recording', 'duration', 'n_leads', 'dtype', 'stage']
+    columns = keys + ['best_s', 'peak_memory']
+    table = load_results(baseline)[columns].merge(
+        load_results(current)[columns], on=keys, suffixes=('_baseline', '_current'))
+    table['time_ratio'] = table['best_s_current'] / table['best_s_baseline']
+    table['memory_ratio'] = table['peak_memory_current'] / table['peak_memory_baseline'].replace(0, np.nan)
+    table['regressed'] = table['time_ratio'] > 1 + tolerance
+    return table
@@ -0,0 +1,176 @@
+"""Synthetic ECG with known beat locations."""
+import os
+from dataclasses import dataclass
+import numpy as np
+from scipy import signal as si
+from typing import Optional, Tuple
+
+# Sampling frequencies of the recordings the pipeline is used on
+HOLTER_FS = 180
+WATCH_FS = 513.625
+
+# Waves of one beat as (amplitude in uV, offset from the R peak in s, width in s)
+WAVES = (
+    (150, -0.20, 0.025),   # P
+    (-100, -0.03, 0.010),  # Q
+    (1000, 0.0, 0.012),    # R
+    (-250, 0.03, 0.010),   # S
+    (300, 0.30, 0.040),    # T
+)
+
+
+@dataclass
+class SyntheticECG:
+    """A synthetic recording and the samples of its R peaks."""
+    signals: np.ndarray
+    fs: float
+    r_peaks: np.ndarray
+    units: str = 'uV'
+
+    @property
+    def n_samples(self) -> int:
+        """Number of samples per lead."""
+        return self.signals.shape[-1]
+
+    @property
+    def duration(self) -> float:
+        """Length of the recording in seconds."""
+        return self.n_samples / self.fs
+
+
+def beat_times(duration: float, bpm: float = 70, variability: float = 0.05,
+               rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Draw the times of the R peaks of a recording.
+
+    Args:
+        duration: Length of the recording in seconds
+        bpm: Mean heart rate
+        variability: Standard deviation of the RR intervals relative to their mean
+        rng: Random generator
+
+    Returns:
+        R peak times in seconds, starting one interval into the recording
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    mean_rr = 60 / bpm
+    # Draw enough intervals to cover the recording, then trim
+    n = int(duration / mean_rr * 1.2) + 2
+    rr = mean_rr * (1 + variability * rng.standard_normal(n))
+    times = np.cumsum(np.clip(rr, 0.5 * mean_rr, 1.5 * mean_rr))
+    # Keep the whole of each beat inside the recording
+    return times[times < duration - mean_rr]
+
+
+def synthetic_ecg(duration: float, fs: float = HOLTER_FS, n_leads: int = 1, bpm: float = 70,
+                  variability: float = 0.05, noise: float = 5, seed: int = 0) -> SyntheticECG:
+    """
+    Generate a synthetic ECG as a sum of Gaussian P, Q, R, S and T waves.
+
+    Each lead shares the same beats, scaled by its own gain, with baseline
+    wander and white noise added. The signal is in uV, like the loaders return.
+
+    Args:
+        duration: Length of the recording in seconds
+        fs: Sampling frequency
+        n_leads: Number of leads
+        bpm: Mean heart rate
+        variability: Standard deviation of the RR intervals relative to their mean
+        noise: Standard deviation of the white noise in uV
+        seed: Seed of the random generator
+
+    Returns:
+        The signals as a (leads x samples) array and the R peak samples
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = int(round(duration * fs))
+    r_peaks = np.rint(beat_times(duration, bpm, variability, rng) * fs).astype(np.int64)
+
+    # Template of one beat, added at every R peak
+    half = int(round(0.4 * fs))
+    t = np.arange(-half, half + 1) / fs
+    template = np.zeros(t.shape[0])
+    for amplitude, offset, width in WAVES:
+        template += amplitude * np.exp(-0.5 * ((t - offset) / width) ** 2)
+    beats = np.zeros(n_samples + 2 * half)
+    np.add.at(beats, r_peaks + half, 1)
+    # Convolution flips its kernel, so the template is placed forwards in time
+    clean = si.oaconvolve(beats, template, mode='valid')
+
+    gains = 1 - 0.3 * np.arange(n_leads) / max(n_leads, 1)
+    signals = np.empty((n_leads, n_samples))
+    time = np.arange(n_samples) / fs
+    for row in range(n_leads):
+        wander = 50 * np.sin(2 * np.pi * 0.2 * time + rng.uniform(0, 2 * np.pi))
+        signals[row] = gains[row] * clean + wander + noise * rng.standard_normal(n_samples)
+    return SyntheticECG(signals=signals, fs=fs, r_peaks=r_peaks)
+
+
+def write_npz(recording: SyntheticECG, file_path: str) -> str:
+    """
+    Write a synthetic recording in the NPZ layout read by ECGData.
+
+    Args:
+        recording: The recording
+        file_path: Path of the NPZ file
+
+    Returns:
+        The path of the file
+    """
+    leads = {f'ecg_{row + 1}': signal for row, signal in enumerate(recording.signals)}
+    np.savez(file_path, fs=recording.fs, **leads)
+    return file_path
+
+
+def write_edf(recording: SyntheticECG, file_path: str) -> str:
+    """
+    Write a synthetic recording as an EDF file read by ECGData.
+
+    Args:
+        recording: The recording
+        file_path: Path of the EDF file
+
+    Returns:
+        The path of the file
+    """
+    import pyedflib
+
+    limit = float(np.ceil(np.abs(recording.signals).max()))
+    headers = [{
+        'label': f'ECG {row + 1}', 'dimension': recording.units, 'sample_frequency': recording.fs,
+        'physical_min': -limit, 'physical_max': limit, 'digital_min': -32768, 'digital_max': 32767,
+    } for row in range(recording.signals.shape[0])]
+    with pyedflib.EdfWriter(file_path, len(headers), file_type=pyedflib.FILETYPE_EDFPLUS) as writer:
+        writer.setSignalHeaders(headers)
+        writer.writeSamples(list(recording.signals))
+    return file_path
+
+
+def match_beats(detected: np.ndarray, expected: np.ndarray, tolerance: int) -> Tuple[int, int, int]:
+    """
+    Match detected R peaks to the known ones.
+
+    Args:
+        detected: Detected R peak samples
+        expected: Known R peak samples
+        tolerance: Largest distance in samples of a match
+
+    Returns:
+        Number of true positives, false positives and false negatives
+    """
+    detected = np.sort(detected)
+    if detected.shape[0] == 0 or expected.shape[0] == 0:
+        return 0, detected.shape[0], expected.shape[0]
+    # Nearest detection to each known beat
+    right = np.clip(np.searchsorted(detected, expected), 1, detected.shape[0] - 1)
+    nearest = np.where(np.abs(detected[right - 1] - expected) <= np.abs(detected[right] - expected),
+                       right - 1, right)
+    hit = np.abs(detected[nearest] - expected) <= tolerance
+    true_positives = np.unique(nearest[hit]).shape[0]
+    return true_positives, detected.shape[0] - true_positives, expected.shape[0] - true_positives
+
+
+def default_path(directory: str, recording: SyntheticECG, extension: str) -> str:
+    """Name a synthetic recording file by its length and rate."""
+    name = f'synthetic_{recording.duration:g}s_{recording.fs:g}hz_{recording.signals.shape[0]}lead{extension}'
+    return os.path.join(directory, name)
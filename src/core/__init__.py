@@ -1,5 +1,7 @@
 """Core ECG data structures."""
 from .ecg_lead import ECGLead
 from .ecg_data import ECGData
+from .annotations import Annotations, ANNOTATION_DTYPE, WAVES
+from .segment import LeadSegment, DataSegment
 
-__all__ = ['ECGLead', 'ECGData']
\ No newline at end of file
+__all__ = ['ECGLead', 'ECGData', 'Annotations', 'ANNOTATION_DTYPE', 'WAVES', 'LeadSegment', 'DataSegment']
\ No newline at end of file
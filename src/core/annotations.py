@@ -0,0 +1,275 @@
+"""Compact, sorted store of beat and wave annotations."""
+import numpy as np
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .ecg_lead import ECGLead
+
+# Wave types, stored by their position in this tuple
+WAVES = ('P', 'Q', 'R', 'S', 'T')
+
+# One annotation: lead index, sample, width in samples and wave type
+ANNOTATION_DTYPE = np.dtype([('lead', np.int16), ('sample', np.int64), ('width', np.int32), ('wave', np.int8)])
+
+Waves = Union[str, Sequence[str], None]
+
+
+def wave_code(wave: str) -> int:
+    """
+    Code a wave type is stored as.
+
+    Args:
+        wave: Wave type, one of WAVES
+
+    Returns:
+        Position of the wave type in WAVES
+    """
+    try:
+        return WAVES.index(wave)
+    except ValueError:
+        raise ValueError(f'Unknown wave {wave!r}, expected one of {WAVES}') from None
+
+
+class Annotations:
+    """
+    Beat and wave annotations as a structured array of ANNOTATION_DTYPE.
+
+    Records are sorted by lead, wave and sample, so the annotations of one lead
+    and wave are a contiguous, sorted slice. Range and nearest queries on it use
+    searchsorted and run in O(log N); the records they return are views.
+    """
+
+    def __init__(self, records: Optional[np.ndarray] = None, fs: Optional[float] = None,
+                 is_sorted: bool = False) -> None:
+        """
+        Args:
+            records: Annotations of ANNOTATION_DTYPE, in any order
+            fs: Sampling frequency, needed for queries in seconds
+            is_sorted: Whether records are already sorted by lead, wave and sample
+        """
+        records = np.empty(0, dtype=ANNOTATION_DTYPE) if records is None else np.asarray(records)
+        if records.dtype != ANNOTATION_DTYPE:
+            raise TypeError(f'Expected records of {ANNOTATION_DTYPE}, got {records.dtype}')
+        if not is_sorted:
+            records = records[np.lexsort((records['sample'], records['wave'], records['lead']))]
+        self.records = records
+        self.fs = fs
+        # Contiguous copy of the samples, as searchsorted copies strided arrays
+        self._samples = np.ascontiguousarray(records['sample'])
+        # Slice of the records of each (lead, wave)
+        keys = records['lead'].astype(np.int64) * len(WAVES) + records['wave']
+        groups, first = np.unique(keys, return_index=True)
+        last = np.append(first[1:], keys.shape[0])
+        self._groups: Dict[Tuple[int, int], slice] = {
+            divmod(int(key), len(WAVES)): slice(int(lo), int(hi)) for key, lo, hi in zip(groups, first, last)}
+
+    @classmethod
+    def from_peaks(cls, peaks: np.ndarray, lead: int, wave: str = 'R',
+                   fs: Optional[float] = None) -> 'Annotations':
+        """
+        Build annotations from detector output.
+
+        Args:
+            peaks: (sample, width) rows as returned by detectors.peak, or 1D samples
+            lead: Lead index of the peaks
+            wave: Wave type of the peaks
+            fs: Sampling frequency
+
+        Returns:
+            The annotations
+        """
+        peaks = np.asarray(peaks)
+        records = np.empty(peaks.shape[0], dtype=ANNOTATION_DTYPE)
+        records['lead'] = lead
+        records['wave'] = wave_code(wave)
+        if peaks.ndim == 2:
+            records['sample'] = peaks[:, 0]
+            records['width'] = peaks[:, 1]
+        else:
+            records['sample'] = peaks
+            records['width'] = 0
+        return cls(records, fs=fs, is_sorted=bool(np.all(np.diff(records['sample']) >= 0)))
+
+    @classmethod
+    def from_lead(cls, lead: 'ECGLead', waves: Sequence[str] = ('R', 'P', 'T')) -> 'Annotations':
+        """
+        Build the annotations of a lead from its detected peaks.
+
+        Args:
+            lead: The lead
+            waves: Wave types to include; T peaks are skipped until they are set
+
+        Returns:
+            The annotations
+        """
+        peaks = {'R': lambda: lead.r_peaks, 'P': lambda: lead.p_peaks, 'T': lambda: lead.t_peaks}
+        parts = []
+        for wave in waves:
+            found = peaks[wave]()
+            if found is not None:
+                parts.append(cls.from_peaks(found, lead.lead, wave, lead.fs))
+        return cls.concatenate(parts, fs=lead.fs)
+
+    @classmethod
+    def concatenate(cls, parts: Iterable['Annotations'], fs: Optional[float] = None) -> 'Annotations':
+        """
+        Merge several stores into one.
+
+        Args:
+            parts: The stores to merge
+            fs: Sampling frequency, defaults to that of the first store
+
+        Returns:
+            The merged annotations
+        """
+        parts = list(parts)
+        if fs is None and parts:
+            fs = parts[0].fs
+        records = np.concatenate([part.records for part in parts]) if parts else None
+        return cls(records, fs=fs)
+
+    def __len__(self) -> int:
+        """Number of annotations."""
+        return self.records.shape[0]
+
+    def __repr__(self) -> str:
+        counts = ', '.join(f'lead {lead} {WAVES[wave]}: {group.stop - group.start}'
+                           for (lead, wave), group in self._groups.items())
+        return f'Annotations({counts})'
+
+    @property
+    def leads(self) -> Tuple[int, ...]:
+        """Lead indices with annotations."""
+        return tuple(sorted({lead for lead, _ in self._groups}))
+
+    def _to_samples(self, value: Union[float, Sequence[float], np.ndarray], seconds: bool) -> np.ndarray:
+        """Convert query positions to samples."""
+        value = np.asarray(value, dtype=np.float64)
+        if not seconds:
+            return value
+        if self.fs is None:
+            raise ValueError('Queries in seconds need fs')
+        return value * self.fs
+
+    def _search(self, group: slice, query: np.ndarray) -> np.ndarray:
+        """Positions within a group of the first samples at or after each query."""
+        # Integer queries keep searchsorted from casting the samples to float
+        return np.searchsorted(self._samples[group], np.ceil(query).astype(np.int64), side='left')
+
+    def _select_groups(self, lead: Optional[int], wave: Waves) -> Dict[Tuple[int, int], slice]:
+        """Slices of the records of the requested leads and waves."""
+        if isinstance(wave, str):
+            if lead is not None:
+                key = (lead, wave_code(wave))
+                return {key: self._groups[key]} if key in self._groups else {}
+            wave = (wave,)
+        codes = None if wave is None else {wave_code(name) for name in wave}
+        return {key: group for key, group in self._groups.items()
+                if (lead is None or key[0] == lead) and (codes is None or key[1] in codes)}
+
+    def _result(self, parts: Dict[Tuple[int, int], slice]) -> 'Annotations':
+        """Wrap slices of several groups, in sorted order, without sorting or indexing them again."""
+        parts = {key: part for key, part in parts.items() if part.stop > part.start}
+        result = Annotations.__new__(Annotations)
+        result.fs = self.fs
+        if len(parts) == 1:
+            part = next(iter(parts.values()))
+            result.records = self.records[part]
+            result._samples = self._samples[part]
+        else:
+            result.records = np.concatenate([self.records[part] for part in parts.values()] or [self.records[:0]])
+            result._samples = np.ascontiguousarray(result.records['sample'])
+        stops = np.cumsum([part.stop - part.start for part in parts.values()], dtype=np.int64)
+        result._groups = {key: slice(int(stop) - (part.stop - part.start), int(stop))
+                          for (key, part), stop in zip(parts.items(), stops)}
+        return result
+
+    def select(self, lead: Optional[int] = None, wave: Waves = None) -> 'Annotations':
+        """
+        Annotations of some leads and wave types.
+
+        Args:
+            lead: Lead index, or None for all leads
+            wave: Wave type or types, or None for all
+
+        Returns:
+            The annotations, sharing memory with this store when they are one lead and wave
+        """
+        return self._result(self._select_groups(lead, wave))
+
+    def samples(self, lead: int, wave: str = 'R') -> np.ndarray:
+        """
+        Sorted samples of one lead and wave type.
+
+        Args:
+            lead: Lead index
+            wave: Wave type
+
+        Returns:
+            A view of the samples
+        """
+        group = self._groups.get((lead, wave_code(wave)), slice(0, 0))
+        return self._samples[group]
+
+    def between(self, start: float, stop: float, lead: Optional[int] = None, wave: Waves = 'R',
+                seconds: bool = False) -> 'Annotations':
+        """
+        Annotations within [start, stop).
+
+        Args:
+            start: Start of the range
+            stop: End of the range, excluded
+            lead: Lead index, or None for all leads
+            wave: Wave type or types, or None for all
+            seconds: Whether start and stop are in seconds rather than samples
+
+        Returns:
+            The annotations in the range, as views when they are one lead and wave
+        """
+        bounds = self._to_samples((start, stop), seconds)
+        parts = {}
+        for key, group in self._select_groups(lead, wave).items():
+            lo, hi = self._search(group, bounds)
+            parts[key] = slice(group.start + int(lo), group.start + int(hi))
+        return self._result(parts)
+
+    def nearest(self, sample: Union[float, np.ndarray], lead: int, wave: str = 'R',
+                seconds: bool = False) -> np.ndarray:
+        """
+        Annotation closest to each query position.
+
+        Args:
+            sample: Position or positions to look up
+            lead: Lead index
+            wave: Wave type
+            seconds: Whether the positions are in seconds rather than samples
+
+        Returns:
+            The nearest annotation records, one per position; ties go to the earlier annotation
+        """
+        group = self._groups.get((lead, wave_code(wave)))
+        if group is None:
+            raise ValueError(f'No {wave} annotations on lead {lead}')
+        samples = self._samples[group]
+        query = self._to_samples(sample, seconds)
+        if samples.shape[0] == 1:
+            return self.records[group][np.zeros(query.shape, dtype=np.int64)]
+        right = np.clip(self._search(group, query), 1, samples.shape[0] - 1)
+        left = right - 1
+        index = np.where(query - samples[left] <= samples[right] - query, left, right)
+        return self.records[group][index]
+
+    def to_peaks(self, lead: int, wave: str = 'R') -> np.ndarray:
+        """
+        Annotations of one lead and wave type as detector output.
+
+        Args:
+            lead: Lead index
+            wave: Wave type
+
+        Returns:
+            (sample, width) rows, as returned by detectors.peak
+        """
+        group = self._groups.get((lead, wave_code(wave)), slice(0, 0))
+        records = self.records[group]
+        return np.column_stack((records['sample'], records['width']))
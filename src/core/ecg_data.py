@@ -1,21 +1,62 @@
 """ECG data container for multi-lead recordings."""
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Dict, List, Optional, Sequence
 import numpy as np
-import concurrent.futures
+from numpy.typing import DTypeLike
+from .annotations import Annotations
 from .ecg_lead import ECGLead
+from .segment import DataSegment, sample_bounds
 from ..io import loaders
+from ..analysis import metrics
+from ..processing import chunking, detectors, fusion, parallel, transforms
 
 
 @dataclass
 class ECGData:
-    """ECG data class to read ECG data from various file formats."""
+    """
+    ECG data class to read ECG data from various file formats.
+
+    leads selects which channels to load by index (0 for the first channel), and
+    start and duration select a time range in seconds. Every loaded lead is kept
+    in channels by index; the first three are also lead_1, lead_2 and lead_3.
+
+    When the leads have equal lengths, signals holds them as one preprocessed
+    (leads x samples) array, in the order of channels, shared with each lead.
+    detect_r_peaks runs R peak detection over it for all leads in one pass.
+
+    When cache_dir is set, preprocessed signals are cached there as .npy files.
+    Later loads of the same unchanged file keep the read-only memory maps as
+    the leads' signals, leaving signals unset, so a cache hit reads nothing
+    into memory until a stage needs it and chunked stages read one chunk at a
+    time; detect_r_peaks then runs lead by lead.
+
+    dtype sets the floating point type signals are read and processed in;
+    float32 halves the memory of every stage, to within float32 precision.
+
+    common_beats holds the beats the leads agree on, as (sample, agreement) rows,
+    once fuse_beats has run.
+
+    executor sets how detect_r_peaks runs: 'serial' in the calling thread, or
+    one task per lead and chunk on workers threads or processes. With
+    'processes', signals is allocated in shared memory and workers read their
+    chunks from it rather than receiving a copy. The peaks are the same either way.
+    """
     file_path: str
+    leads: Optional[List[int]] = None
+    start: float = 0
+    duration: Optional[float] = None
+    cache_dir: Optional[str] = None
+    dtype: DTypeLike = np.float64
+    executor: str = 'serial'
+    workers: Optional[int] = None
     fs: Optional[int] = None
     units: Optional[str] = None
     lead_1: Optional[ECGLead] = None
     lead_2: Optional[ECGLead] = None
     lead_3: Optional[ECGLead] = None
+    channels: Dict[int, ECGLead] = field(default_factory=dict)
+    signals: Optional[np.ndarray] = None
     common_beats: Optional[np.ndarray] = None
 
     def __post_init__(self) -> None:
@@ -41,4 +82,109 @@ class ECGData:
 
     def _read_edf_data(self) -> None:
         """Reads ECG data from EDF file."""
-        loaders.read_edf_data(self)
\ No newline at end of file
+        loaders.read_edf_data(self)
+
+    def detect_r_peaks(self) -> List[np.ndarray]:
+        """
+        Detect the R peaks of every lead, in one vectorised pass when signals is set,
+        or spread over the executor's workers.
+
+        The thresholds and peaks are stored on each lead as if it had computed them.
+
+        Returns:
+            The R peaks of each lead, in the order of channels
+        """
+        leads = list(self.channels.values())
+        if self.signals is None:
+            return [lead.r_peaks for lead in leads]
+        transform = partial(transforms.grad_square_conv, freq=self.fs, sin_wave=False)
+        chunk_size = leads[0].chunk_size
+        if self.executor != 'serial':
+            chunk_size = chunk_size or parallel.PARALLEL_CHUNK
+            with parallel.pool(self.executor, self.workers) as executor:
+                threshold = parallel.parallel_threshold(self.signals, transform, chunk_size,
+                                                        leads[0].chunk_overlap, executor=executor)
+                r_peaks = parallel.parallel_peak(self.signals, transform, threshold, chunk_size,
+                                                 leads[0].chunk_overlap, executor=executor)
+        elif chunk_size is not None:
+            threshold = chunking.chunked_threshold(self.signals, transform, chunk_size, leads[0].chunk_overlap)
+            r_peaks = chunking.chunked_peak(self.signals, transform, threshold, chunk_size, leads[0].chunk_overlap)
+        else:
+            window = transform(self.signals)
+            threshold = detectors.threshold_calc(window)
+            r_peaks = detectors.peak(signal=window, threshold=threshold)
+            for row, lead in enumerate(leads):
+                lead.window = window[row]
+        for row, lead in enumerate(leads):
+            lead.threshold = threshold[row]
+            lead.r_peaks = r_peaks[row]
+        return r_peaks
+
+    def fuse_beats(self, tolerance: float = 0.05, min_leads: Optional[int] = None) -> np.ndarray:
+        """
+        Reconcile the R peaks of every lead into one beat list, filling common_beats.
+
+        Args:
+            tolerance: Largest distance in seconds between detections of the same beat
+            min_leads: Leads that must agree on a beat for it to be kept, defaults to a majority
+
+        Returns:
+            The consensus beats as (sample, agreement) rows, where agreement is the
+            number of leads that detected the beat
+        """
+        leads = list(self.channels.values())
+        if self.signals is not None and any('r_peaks' not in lead.__dict__ for lead in leads):
+            self.detect_r_peaks()
+        samples, agreement, _ = fusion.fuse_beats([lead.r_samples for lead in leads],
+                                                  int(round(tolerance * self.fs)), min_leads)
+        self.common_beats = np.column_stack((samples, agreement))
+        return self.common_beats
+
+    def rr_int(self) -> np.ndarray:
+        """RR intervals of the consensus beats in samples, as in ECGLead.rr_int, fusing the leads if needed."""
+        if self.common_beats is None:
+            self.fuse_beats()
+        return np.diff(self.common_beats[:, 0], prepend=0)
+
+    def windowed_hrv(self, window: float = 300, step: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Heart rate variability of every window of the consensus beats, fusing the leads if needed.
+
+        Args:
+            window: Window length in seconds, 5 minutes by default
+            step: Distance between window starts in seconds, defaults to the window length
+
+        Returns:
+            Arrays of metrics with one value per window, see metrics.windowed_hrv
+        """
+        if self.common_beats is None:
+            self.fuse_beats()
+        return metrics.windowed_hrv(self.common_beats[:, 0] / self.fs, window=window, step=step)
+
+    def annotations(self, waves: Sequence[str] = ('R',)) -> Annotations:
+        """
+        The peaks of every lead in one sorted annotation store.
+
+        Args:
+            waves: Wave types to include, from 'R', 'P' and 'T'
+
+        Returns:
+            The annotations of all leads
+        """
+        return Annotations.concatenate([Annotations.from_lead(lead, waves) for lead in self.channels.values()],
+                                       fs=self.fs)
+
+    def segment(self, start: float, stop: Optional[float] = None, seconds: bool = True) -> DataSegment:
+        """
+        View a window of every lead without copying or recomputing it.
+
+        Args:
+            start: Start of the window
+            stop: End of the window, excluded, or None for the end of the recording
+            seconds: Whether start and stop are in seconds rather than samples
+
+        Returns:
+            The segment, holding a view of each lead
+        """
+        n_samples = max((lead.signal.shape[0] for lead in self.channels.values()), default=0)
+        return DataSegment(self, *sample_bounds(n_samples, self.fs, start, stop, seconds))
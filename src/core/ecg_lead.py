@@ -1,114 +1,386 @@
 """ECG lead dataclass and processing."""
 from dataclasses import dataclass
-from typing import Optional
+from typing import Callable, Dict, Iterator, Optional, Tuple
 import numpy as np
-from ..processing import detectors, transforms
-from ..processing.transforms import timer_decorator
-from ..analysis import metrics
+from numpy.typing import DTypeLike
+from ..processing import chunking, delineation, detectors, spectral, transforms
+from ..profiling import timer_decorator
+from ..analysis import clustering, lorenz, metrics, morphology
 from ..visualisation import plots
+from .annotations import Annotations
+from .segment import LeadSegment, sample_bounds
+from .stages import Staged, stage
+
+# Signals longer than this are processed in chunks unless chunk_size is given
+DEFAULT_CHUNK_SIZE = int(1e6)
+# Seconds of signal read either side of a chunk, covering transform edges and beat widths
+CHUNK_OVERLAP = 5
 
 
 @dataclass
-class ECGLead:
-    """Represents a single ECG lead/channel with automatic processing."""
+class ECGLead(Staged):
+    """
+    Represents a single ECG lead/channel.
+
+    Transforms, peaks, intervals and stats are computed on first access and memoised.
+    Assigning the signal, a parameter or a stage discards only the stages computed from it.
+    Stages keep the floating point type of the signal, set by dtype when given.
+    """
     lead: int
     signal: np.ndarray
     fs: int
     units: str
-    r_peaks: Optional[np.ndarray] = None
-    p_peaks: Optional[np.ndarray] = None
     refined_p: Optional[np.ndarray] = None
     t_peaks: Optional[np.ndarray] = None
-    window: Optional[np.ndarray] = None
-    phasor: Optional[np.ndarray] = None
-    threshold: Optional[float] = None
-    rr_int: Optional[np.ndarray] = None
+    qt_int: Optional[np.ndarray] = None
+    qtc: Optional[np.ndarray] = None
     frequency_bins: Optional[np.ndarray] = None
     time_bins: Optional[np.ndarray] = None
+    spectrogram: Optional[np.ndarray] = None
 
-    # Stats
-    bpm: Optional[float] = None
-    correlation_coefficient: Optional[float] = None
+    # Processing
+    chunk_size: Optional[int] = None
+    preprocessed: bool = False
+    dtype: Optional[DTypeLike] = None
 
     def __post_init__(self) -> None:
-        """Performs signal preprocessing and R wave detection on the ECG signal."""
+        """Performs signal preprocessing on the ECG signal."""
         self._signal_preprocessing()
-        self.r_wave_detector()
-        self.p_wave_detector()
-        self.calculate_rr_int()
-        self.r_stats()
 
     def _signal_preprocessing(self) -> None:
-        """Performs signal preprocessing on the ECG signal."""
-        if self.signal.shape[0] > 1e6:
-            print('Signal too long, slicing to 5 minutes')
-            window_slice = int(60 * self.fs * 5)
-            self.signal = self.signal[window_slice:-window_slice] / 1000
-        else:
-            print('Signal not too long, not slicing')
-            self.signal = self.signal / 1000
-        
+        """Performs signal preprocessing on the ECG signal, unless it is already preprocessed."""
+        # Long signals are processed in chunks, visible as chunk_size
+        if self.chunk_size is None and self.signal.shape[0] > DEFAULT_CHUNK_SIZE:
+            self.chunk_size = DEFAULT_CHUNK_SIZE
+        if not self.preprocessed:
+            # Scale and convert in one pass; integer signals default to float64
+            dtype = self.dtype
+            if dtype is None:
+                dtype = self.signal.dtype if np.issubdtype(self.signal.dtype, np.floating) else np.float64
+            self.signal = np.divide(self.signal, 1000, dtype=dtype)
+            self.preprocessed = True
+        elif self.dtype is not None:
+            self.signal = self.signal.astype(self.dtype, copy=False)
+
         if self.units == 'uV':
             self.signal = self.signal
 
-    @timer_decorator
+    def _r_transform(self, signal: np.ndarray) -> np.ndarray:
+        """Transform the signal for R peak detection."""
+        return transforms.grad_square_conv(signal, self.fs, sin_wave=False)
+
+    def _p_transform(self, signal: np.ndarray) -> np.ndarray:
+        """Transform the signal for P peak detection."""
+        return transforms.phasor_transform(signal, rv=0.001)
+
+    @stage('signal', 'fs')
+    def window(self) -> np.ndarray:
+        """The transformed signal used for R peak detection."""
+        return self._r_transform(self.signal)
+
+    @stage('signal')
+    def phasor(self) -> np.ndarray:
+        """The phasor transform used for P peak detection."""
+        return self._p_transform(self.signal)
+
     def threshold_calc(self, transformed_signal: np.ndarray) -> float:
-        """Calculate the threshold for the R peak detector."""
-        # Calculate the mean of the transformed signal
-        transformed_signal = transformed_signal[(transformed_signal > 0.01) & (transformed_signal < 2)]
-        return transformed_signal.mean() / 4
+        """Calculate the threshold for the peak detector."""
+        return detectors.threshold_calc(transformed_signal)
+
+    @property
+    def chunk_overlap(self) -> int:
+        """Number of samples read either side of a chunk in chunked mode."""
+        return int(CHUNK_OVERLAP * self.fs)
+
+    def _chunked_threshold(self, transform: Callable[[np.ndarray], np.ndarray]) -> float:
+        """Calculate the threshold of a transformed signal chunk by chunk."""
+        return chunking.chunked_threshold(self.signal, transform, self.chunk_size, self.chunk_overlap)
+
+    def _chunked_peak(self, transform: Callable[[np.ndarray], np.ndarray], threshold: float) -> np.ndarray:
+        """Detect the peaks of a transformed signal chunk by chunk."""
+        return chunking.chunked_peak(
+            self.signal, transform, threshold, self.chunk_size, self.chunk_overlap)
+
+    @stage('window', 'chunk_size')
+    def threshold(self) -> float:
+        """The threshold for the R peak detector."""
+        if self.chunk_size is not None:
+            return self._chunked_threshold(self._r_transform)
+        return self.threshold_calc(self.window)
+
+    @stage('phasor', 'chunk_size')
+    def p_threshold(self) -> float:
+        """The threshold for the P peak detector."""
+        if self.chunk_size is not None:
+            return self._chunked_threshold(self._p_transform)
+        return self.threshold_calc(self.phasor)
 
     @timer_decorator
-    def r_wave_detector(self) -> None:
-        """Detect the R peaks of the signal."""
-        # Window is the transformed signal
-        self.window = transforms.grad_square_conv(self.signal, self.fs, sin_wave=False)
-        # Calculate the threshold
-        self.threshold = self.threshold_calc(self.window)
-        # Perform the peak detection on this transformed signal
-        self.r_peaks = detectors.peak(signal=self.window, threshold=self.threshold)
+    def r_wave_detector(self) -> np.ndarray:
+        """
+        Detect the R peaks of the signal.
+
+        In chunked mode the transformed signal is never held in full.
+        """
+        if self.chunk_size is not None:
+            return self._chunked_peak(self._r_transform, self.threshold)
+        # Perform the peak detection on the transformed signal
+        return detectors.peak(signal=self.window, threshold=self.threshold)
+
+    r_peaks = stage('window', 'threshold', 'chunk_size')(r_wave_detector)
+
+    @stage('r_peaks')
+    def r_samples(self) -> np.ndarray:
+        """Sample positions of the R peaks, contiguous for binary search."""
+        return np.ascontiguousarray(self.r_peaks[:, 0])
 
     @timer_decorator
-    def calculate_rr_int(self) -> None:
+    def calculate_rr_int(self) -> np.ndarray:
         """Calculate the RR intervals from the R peak positions."""
-        self.rr_int = np.diff(self.r_peaks[:, 0], prepend=0)
+        return np.diff(self.r_peaks[:, 0], prepend=0)
+
+    rr_int = stage('r_peaks')(calculate_rr_int)
+
+    @stage('rr_int', 'fs')
+    def rr_ms(self) -> np.ndarray:
+        """RR intervals in ms, leaving out the first entry of rr_int, which is the position of the first beat."""
+        return self.rr_int[1:] / self.fs * 1000
+
+    @stage('signal', 'r_samples', 'fs')
+    def q_onsets(self) -> np.ndarray:
+        """QRS onset sample of every beat, -1 where not found, shared by the P and T wave delineations."""
+        return delineation.qrs_onsets(self.signal, self.r_samples, self.fs)
 
     @timer_decorator
-    def p_wave_detector(self) -> None:
-        """Detect the P peaks of the signal."""
-        # Phasor transform
-        self.phasor = transforms.phasor_transform(self.signal, rv=0.001)
-        # Calculate the threshold
-        self.threshold = self.threshold_calc(self.phasor)
-        # Perform the peak detection on this transformed signal
-        self.p_peaks = detectors.peak(signal=self.phasor, threshold=self.threshold)
-        
-        # Combine and sort R peaks and P peaks
-        combined_peaks = np.sort(np.concatenate((self.r_peaks[:, 0], self.p_peaks[:, 0])))
-
-        # Identify unique peaks that are close to each other
-        close_peaks_indices = np.where(np.diff(combined_peaks) < 10)[0]
-
-        # Create an array of indices to add to the close peaks
-        additional_indices = close_peaks_indices + 1
-
-        # Combine and sort the unique and additional indices
-        refined_peaks_indices = np.sort(np.concatenate((close_peaks_indices, additional_indices)))
-
-        self.p_peaks = np.delete(combined_peaks, refined_peaks_indices)
-
-    def r_plot(self) -> None:
-        """Plot the ECG signal and the R peaks."""
-        plots.r_plotting(self)
+    def p_wave_detector(self) -> np.ndarray:
+        """
+        Detect the P peaks of the signal.
+
+        In chunked mode the phasor transform is never held in full.
+        """
+        if self.chunk_size is not None:
+            p_peaks = self._chunked_peak(self._p_transform, self.p_threshold)
+        else:
+            # Perform the peak detection on the phasor transform
+            p_peaks = detectors.peak(signal=self.phasor, threshold=self.p_threshold)
+
+        # Combine R peaks and P peaks, dropping peaks close to each other
+        return detectors.merge_close_peaks(self.r_peaks[:, 0], p_peaks[:, 0])
+
+    p_peaks = stage('phasor', 'p_threshold', 'r_peaks', 'chunk_size')(p_wave_detector)
+
+    @stage('r_peaks', 'p_peaks', 't_peaks')
+    def annotations(self) -> Annotations:
+        """The R, P and T peaks of the lead in a sorted annotation store."""
+        return Annotations.from_lead(self)
+
+    def detect_p_waves(self, p_window: float = delineation.P_WINDOW) -> delineation.PWaves:
+        """
+        Delineate the P wave of every beat in the window before its QRS, filling refined_p.
+
+        refined_p holds one row per beat, in the order of r_peaks, of the P onset
+        sample, the P peak sample and the PR interval in ms, NaN where the P wave
+        was not found. Unlike p_peaks, no part of the signal outside the
+        pre-QRS windows is searched.
+
+        Args:
+            p_window: Start of the P wave search window before each R peak,
+                as a fraction of the preceding RR interval
+
+        Returns:
+            The P onset, P peak and PR interval of every beat, see delineation.delineate_p_waves
+        """
+        p_waves = delineation.delineate_p_waves(self.signal, self.r_samples, self.fs, p_window=p_window,
+                                                q_onset=self.q_onsets)
+        found = p_waves.p_peak >= 0
+        self.refined_p = np.column_stack((np.where(found, p_waves.p_onset, np.nan),
+                                          np.where(found, p_waves.p_peak, np.nan), p_waves.pr))
+        return p_waves
+
+    def detect_t_waves(self, t_window: Tuple[float, float] = delineation.T_WINDOW) -> delineation.TWaves:
+        """
+        Delineate the T wave of every beat, filling t_peaks, qt_int and qtc.
+
+        t_peaks holds the T peaks that were found; qt_int and qtc hold the QT
+        interval and Bazett's QTc of every beat in ms, in the order of r_peaks,
+        NaN where the T wave or QRS onset was not found.
+
+        Args:
+            t_window: Start and end of the T wave search window after each R peak,
+                as fractions of the following RR interval
+
+        Returns:
+            The QRS onset, T peak and T end of every beat, see delineation.delineate_t_waves
+        """
+        t_waves = delineation.delineate_t_waves(self.signal, self.r_samples, self.fs, t_window=t_window,
+                                                q_onset=self.q_onsets)
+        self.t_peaks = t_waves.t_peak[t_waves.t_peak >= 0]
+        self.qt_int = t_waves.qt
+        self.qtc = t_waves.qtc
+        return t_waves
+
+    def compute_spectrogram(self, nperseg: int = 256, noverlap: Optional[int] = None,
+                            band: Optional[Tuple[float, float]] = None, out: Optional[str] = None) -> np.ndarray:
+        """
+        Compute the spectrogram of the signal chunk by chunk, filling frequency_bins and time_bins.
+
+        Args:
+            nperseg: Length of each segment
+            noverlap: Overlap between segments, defaults to an eighth of a segment
+            band: (low, high) frequencies in Hz to keep, or None for all
+            out: Path of an .npy file to write the power to, or None to keep it in memory
+
+        Returns:
+            The (frequencies x times) float32 power spectral density, also stored as spectrogram
+        """
+        self.frequency_bins, self.time_bins, self.spectrogram = spectral.chunked_spectrogram(
+            self.signal, self.fs, nperseg=nperseg, noverlap=noverlap, band=band,
+            chunk_size=self.chunk_size or spectral.SPECTROGRAM_CHUNK, out=out)
+        return self.spectrogram
+
+    def windowed_hrv(self, window: float = 300, step: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """
+        Heart rate variability of every window of the lead, computed in one batch.
+
+        Args:
+            window: Window length in seconds, 5 minutes by default
+            step: Distance between window starts in seconds, defaults to the window length
+
+        Returns:
+            Arrays of metrics with one value per window, see metrics.windowed_hrv
+        """
+        return metrics.windowed_hrv(self.r_samples / self.fs, window=window, step=step)
+
+    def _beat_window(self, before: float, after: float) -> Tuple[int, int]:
+        """Convert a window around each beat from seconds to samples."""
+        return int(round(before * self.fs)), int(round(after * self.fs))
+
+    def beat_matrix(self, before: float = 0.25, after: float = 0.45) -> np.ndarray:
+        """
+        Cut a window around every R peak into a (beats x samples) matrix.
+
+        Args:
+            before: Seconds kept before each R peak
+            after: Seconds kept from each R peak onwards
+
+        Returns:
+            The aligned beats, NaN where a window runs over the ends of the signal
+        """
+        return morphology.beat_matrix(self.signal, self.r_samples, *self._beat_window(before, after))
+
+    def iter_beats(self, before: float = 0.25, after: float = 0.45,
+                   chunk_beats: int = morphology.BEAT_CHUNK) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Cut the beat matrix chunk by chunk, for recordings too long to hold it whole.
+
+        Args:
+            before: Seconds kept before each R peak
+            after: Seconds kept from each R peak onwards
+            chunk_beats: Beats per chunk
+
+        Returns:
+            Iterator of (index of the chunk's first beat, its rows of the beat matrix)
+        """
+        return morphology.iter_beat_matrix(self.signal, self.r_samples, *self._beat_window(before, after),
+                                           chunk_beats=chunk_beats)
+
+    def beat_templates(self, before: float = 0.25, after: float = 0.45) -> Dict[str, np.ndarray]:
+        """
+        Mean and median beat of the lead, in bounded memory.
+
+        Args:
+            before: Seconds kept before each R peak
+            after: Seconds kept from each R peak onwards
+
+        Returns:
+            'mean' and 'median' templates, see morphology.beat_templates
+        """
+        return morphology.beat_templates(self.signal, self.r_samples, *self._beat_window(before, after))
+
+    def beat_correlation(self, before: float = 0.25, after: float = 0.45, template: str = 'median',
+                         chunk_beats: int = morphology.BEAT_CHUNK) -> np.ndarray:
+        """
+        Correlation of every beat with the lead's template, computed chunk by chunk.
+
+        Args:
+            before: Seconds kept before each R peak
+            after: Seconds kept from each R peak onwards
+            template: 'median' or 'mean'
+            chunk_beats: Beats per chunk
+
+        Returns:
+            Pearson correlation of each beat with the template
+        """
+        reference = self.beat_templates(before, after)[template]
+        correlation = np.empty(self.r_samples.shape[0])
+        for first, matrix in self.iter_beats(before, after, chunk_beats):
+            correlation[first:first + matrix.shape[0]] = morphology.template_correlation(matrix, reference)
+        return correlation
+
+    def cluster_beats(self, before: float = 0.25, after: float = 0.45, n_clusters: int = 8,
+                      merge_correlation: Optional[float] = clustering.MERGE_CORRELATION) -> clustering.BeatClusters:
+        """
+        Cluster the beats by shape with mini-batch k-means, storing the result as beat_clusters.
+
+        Args:
+            before: Seconds kept before each R peak
+            after: Seconds kept from each R peak onwards
+            n_clusters: Most clusters found
+            merge_correlation: Template correlation above which clusters are merged, or None to keep all
+
+        Returns:
+            Per-beat labels, in the order of r_peaks, and the template and size of each cluster
+        """
+        self.beat_clusters = clustering.cluster_beats(self.signal, self.r_samples, *self._beat_window(before, after),
+                                                      n_clusters=n_clusters, merge_correlation=merge_correlation)
+        return self.beat_clusters
+
+    beat_clusters = stage('r_samples')(cluster_beats)
+
+    def segment(self, start: float, stop: Optional[float] = None, seconds: bool = True) -> LeadSegment:
+        """
+        View a window of the lead without copying or recomputing it.
+
+        Args:
+            start: Start of the window
+            stop: End of the window, excluded, or None for the end of the signal
+            seconds: Whether start and stop are in seconds rather than samples
+
+        Returns:
+            The segment, whose arrays are views of the lead's and whose beats count from its start
+        """
+        return LeadSegment(self, *sample_bounds(self.signal.shape[0], self.fs, start, stop, seconds))
+
+    def r_plot(self, time_range: Optional[Tuple[float, float]] = None) -> None:
+        """
+        Plot the ECG signal and the R peaks.
+
+        Args:
+            time_range: (start, stop) in seconds to plot, or None for the whole recording
+        """
+        plots.r_plotting(self, time_range=time_range)
         plots.lorenz_plot(self)
 
-    def r_stats(self) -> None:
-        """Calculate R wave statistics."""
-        # Calculate Pearson's correlation coefficient
-        self.correlation_coefficient = np.corrcoef(self.rr_int[:-1], self.rr_int[1:])[0, 1]
-        # BPM calculation
-        self.bpm = 2 * self.r_peaks[:, 0].shape[0]
+    @stage('rr_int')
+    def correlation_coefficient(self) -> float:
+        """Pearson's correlation coefficient of successive RR intervals."""
+        return np.corrcoef(self.rr_int[:-1], self.rr_int[1:])[0, 1]
+
+    @stage('rr_ms')
+    def lorenz_density(self) -> lorenz.LorenzDensity:
+        """Binned counts of successive RR interval pairs in ms, see lorenz.lorenz_density."""
+        return lorenz.lorenz_density(self.rr_ms)
+
+    @stage('r_peaks')
+    def bpm(self) -> float:
+        """BPM calculation."""
+        return 2 * self.r_peaks[:, 0].shape[0]
+
+    def p_plot(self, time_range: Optional[Tuple[float, float]] = None) -> None:
+        """
+        Plot the ECG signal and the P peaks.
 
-    def p_plot(self) -> None:
-        """Plot the ECG signal and the P peaks."""
-        plots.p_plotting(self)
\ No newline at end of file
+        Args:
+            time_range: (start, stop) in seconds to plot, or None for the whole recording
+        """
+        plots.p_plotting(self, time_range=time_range)
@@ -0,0 +1,142 @@
+"""Time-window views over leads and recordings."""
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING:
+    from .ecg_data import ECGData
+    from .ecg_lead import ECGLead
+
+
+def sample_bounds(n_samples: int, fs: float, start: float, stop: Optional[float],
+                  seconds: bool = True) -> Tuple[int, int]:
+    """
+    Convert a window to sample bounds clipped to the signal.
+
+    Args:
+        n_samples: Number of samples in the signal
+        fs: Sampling frequency
+        start: Start of the window
+        stop: End of the window, excluded, or None for the end of the signal
+        seconds: Whether start and stop are in seconds rather than samples
+
+    Returns:
+        First sample and the sample after the last
+    """
+    scale = fs if seconds else 1
+    first = min(max(int(round(start * scale)), 0), n_samples)
+    if stop is None:
+        return first, n_samples
+    return first, min(max(int(round(stop * scale)), first), n_samples)
+
+
+@dataclass
+class LeadSegment:
+    """
+    A window [start, stop) of a lead, in samples.
+
+    The signal and transforms are views of the lead's arrays, and the RR
+    intervals are a view of the lead's. The beats are found by binary search
+    on the lead's memoised peaks and re-based so positions count from the start
+    of the window. Nothing is recomputed: stages the lead has not computed yet
+    are computed on the whole lead when first accessed.
+    """
+    lead: 'ECGLead'
+    start: int
+    stop: int
+
+    @property
+    def fs(self) -> float:
+        """Sampling frequency."""
+        return self.lead.fs
+
+    @property
+    def offset(self) -> float:
+        """Start of the window in seconds."""
+        return self.start / self.lead.fs
+
+    @property
+    def duration(self) -> float:
+        """Length of the window in seconds."""
+        return (self.stop - self.start) / self.lead.fs
+
+    @property
+    def signal(self) -> np.ndarray:
+        """The signal of the window."""
+        return self.lead.signal[self.start:self.stop]
+
+    @property
+    def window(self) -> np.ndarray:
+        """The transformed signal used for R peak detection."""
+        return self.lead.window[self.start:self.stop]
+
+    @property
+    def phasor(self) -> np.ndarray:
+        """The phasor transform used for P peak detection."""
+        return self.lead.phasor[self.start:self.stop]
+
+    @cached_property
+    def beats(self) -> slice:
+        """Positions of the window's R peaks within the lead's."""
+        first, last = np.searchsorted(self.lead.r_samples, (self.start, self.stop))
+        return slice(int(first), int(last))
+
+    @cached_property
+    def r_peaks(self) -> np.ndarray:
+        """R peaks of the window as (sample, width) rows, with samples counted from its start."""
+        r_peaks = self.lead.r_peaks[self.beats].copy()
+        r_peaks[:, 0] -= self.start
+        return r_peaks
+
+    @property
+    def rr_int(self) -> np.ndarray:
+        """RR intervals ending at each R peak of the window, as in ECGLead.rr_int."""
+        return self.lead.rr_int[self.beats]
+
+    @cached_property
+    def p_peaks(self) -> np.ndarray:
+        """P peaks of the window, with samples counted from its start."""
+        p_peaks = self.lead.p_peaks
+        first, last = np.searchsorted(p_peaks, (self.start, self.stop))
+        return p_peaks[first:last] - self.start
+
+
+@dataclass
+class DataSegment:
+    """
+    A window [start, stop) of every lead of a recording, in samples.
+
+    signals is a view of the recording's (leads x samples) array when it has one.
+    """
+    data: 'ECGData'
+    start: int
+    stop: int
+    channels: Dict[int, LeadSegment] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        """Creates the segment of each lead."""
+        if not self.channels:
+            self.channels = {i: LeadSegment(lead, self.start, self.stop) for i, lead in self.data.channels.items()}
+
+    @property
+    def signals(self) -> Optional[np.ndarray]:
+        """The (leads x samples) signals of the window, if the recording has them."""
+        if self.data.signals is None:
+            return None
+        return self.data.signals[:, self.start:self.stop]
+
+    @property
+    def lead_1(self) -> Optional[LeadSegment]:
+        """Segment of the first lead."""
+        return self.channels.get(0)
+
+    @property
+    def lead_2(self) -> Optional[LeadSegment]:
+        """Segment of the second lead."""
+        return self.channels.get(1)
+
+    @property
+    def lead_3(self) -> Optional[LeadSegment]:
+        """Segment of the third lead."""
+        return self.channels.get(2)
@@ -0,0 +1,87 @@
+"""Lazily computed, memoised processing stages."""
+from functools import lru_cache
+from typing import Any, Callable, FrozenSet, Tuple
+
+
+class Stage:
+    """
+    Descriptor computing a processing stage on first access and memoising it.
+
+    The result is stored in the instance dictionary, so assigning the attribute
+    replaces the computed value.
+    """
+
+    def __init__(self, func: Callable[[Any], Any], inputs: Tuple[str, ...]) -> None:
+        self.func = func
+        self.inputs = inputs
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj: Any, owner: type = None) -> Any:
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            value = obj.__dict__[self.name] = self.func(obj)
+            return value
+
+
+def stage(*inputs: str) -> Callable[[Callable[[Any], Any]], Stage]:
+    """
+    Declare a method as a memoised stage.
+
+    Args:
+        inputs: Names of the attributes and stages the stage is computed from
+
+    Returns:
+        Decorator turning the method into a Stage
+    """
+    def decorator(func: Callable[[Any], Any]) -> Stage:
+        return Stage(func, inputs)
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def dependents(owner: type, name: str) -> FrozenSet[str]:
+    """
+    Find the stages computed directly or indirectly from an attribute.
+
+    Args:
+        owner: Class declaring the stages
+        name: Name of the attribute
+
+    Returns:
+        Names of the dependent stages
+    """
+    stages = {key: value for cls in reversed(owner.__mro__)
+              for key, value in vars(cls).items() if isinstance(value, Stage)}
+    found = set()
+    pending = [name]
+    while pending:
+        current = pending.pop()
+        for key, value in stages.items():
+            if current in value.inputs and key not in found:
+                found.add(key)
+                pending.append(key)
+    return frozenset(found)
+
+
+class Staged:
+    """Mixin discarding memoised stages when an attribute they depend on is assigned."""
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        self.invalidate(*dependents(type(self), name))
+
+    def invalidate(self, *names: str) -> None:
+        """
+        Discard memoised stages so they are recomputed on next access.
+
+        Args:
+            names: Names of the stages to discard
+        """
+        for name in names:
+            self.__dict__.pop(name, None)
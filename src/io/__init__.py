@@ -1,5 +1,6 @@
 """Input/output functions."""
 from . import loaders
 from . import apple_watch
+from . import cache
 
-__all__ = ['loaders', 'apple_watch']
\ No newline at end of file
+__all__ = ['loaders', 'apple_watch', 'cache']
@@ -1,25 +1,155 @@
 """Apple Watch ECG data processing."""
-import pandas as pd
+import csv
+import glob
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
 import numpy as np
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple
+
+# Position of the sample rate in the header, for exports with translated keys
+SAMPLE_RATE_LINE = 7
+
+
+@dataclass
+class AppleWatchECG:
+    """A single Apple Watch ECG export."""
+    file_path: str
+    signal: np.ndarray
+    fs: float
+    units: Optional[str] = None
+    name: Optional[str] = None
+    recorded_date: Optional[datetime] = None
+    classification: Optional[str] = None
+    header: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class AppleWatchBatch:
+    """
+    A folder of Apple Watch ECG exports.
+
+    Signals are stacked into one (recordings x samples) array padded with NaN,
+    and each recording's signal is a view of its row.
+    """
+    signals: np.ndarray
+    lengths: np.ndarray
+    fs: np.ndarray
+    recordings: List[AppleWatchECG]
+
+    def __len__(self) -> int:
+        """Number of recordings in the batch."""
+        return len(self.recordings)
+
+
+def _is_number(text: str) -> bool:
+    """Check whether a line holds a sample value."""
+    try:
+        float(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _split_header(text: str) -> Tuple[Dict[str, str], int]:
+    """
+    Parse the header lines of an export.
+
+    Args:
+        text: Contents of the export
+
+    Returns:
+        header: Header values keyed by name, in file order
+        offset: Position of the first sample in the text
+    """
+    header = {}
+    offset = 0
+    while offset < len(text):
+        end = text.find('\n', offset)
+        if end == -1:
+            end = len(text)
+        line = text[offset:end].strip()
+        if line:
+            if _is_number(line):
+                break
+            row = next(csv.reader([line]))
+            header[row[0]] = ','.join(row[1:])
+        offset = end + 1
+    return header, offset
+
+
+def read_apple_watch_csv(file_path: str) -> AppleWatchECG:
+    """
+    Read an Apple Watch CSV export without going through pandas.
+
+    The header lines are parsed for the metadata and the samples are converted
+    into a numpy array in a single call.
+
+    Args:
+        file_path: Path to the CSV file
+
+    Returns:
+        The signal and metadata of the export
+    """
+    with open(file_path, encoding='utf-8') as f:
+        text = f.read()
+    header, offset = _split_header(text)
+    x = np.fromstring(text[offset:], dtype=np.float64, sep='\n')
+
+    sample_rate = header.get('Sample Rate')
+    if sample_rate is None:
+        sample_rate = list(header.values())[SAMPLE_RATE_LINE]
+    # Convert frequency to float
+    fs = float(sample_rate.split(' ')[0])
+
+    try:
+        recorded_date = datetime.strptime(header.get('Recorded Date', ''), '%Y-%m-%d %H:%M:%S %z')
+    except ValueError:
+        recorded_date = None
+
+    return AppleWatchECG(
+        file_path=file_path,
+        signal=x,
+        fs=fs,
+        units=header.get('Unit'),
+        name=header.get('Name'),
+        recorded_date=recorded_date,
+        classification=header.get('Classification'),
+        header=header
+    )
 
 
 def csv_to_numpy(file_path: str) -> Tuple[np.ndarray, float]:
     """
     Convert Apple Watch CSV file to numpy array.
-    
+
     Args:
         file_path: Path to the CSV file
-    
+
     Returns:
         x: The ECG signal
         fs: The sampling frequency
     """
-    df = pd.read_csv(file_path, sep=',')
-    name = df.columns[1]
-    # Convert frequency to float
-    fs = float(df.iloc[6][name].split(' ')[0])
-    
-    x = df['Name'][9:-1].astype(np.float64).to_numpy().flatten()
-    
-    return x, fs
\ No newline at end of file
+    recording = read_apple_watch_csv(file_path)
+    return recording.signal, recording.fs
+
+
+def read_apple_watch_dir(directory: str, pattern: str = '*.csv') -> AppleWatchBatch:
+    """
+    Read every Apple Watch CSV export in a folder.
+
+    Args:
+        directory: Folder holding the exports
+        pattern: Glob pattern of the exports within the folder
+
+    Returns:
+        The exports, sorted by file name, with their signals stacked into one array
+    """
+    recordings = [read_apple_watch_csv(path) for path in sorted(glob.glob(os.path.join(directory, pattern)))]
+    lengths = np.array([recording.signal.shape[0] for recording in recordings], dtype=np.int64)
+    signals = np.full((len(recordings), lengths.max(initial=0)), np.nan)
+    for i, recording in enumerate(recordings):
+        signals[i, :lengths[i]] = recording.signal
+        recording.signal = signals[i, :lengths[i]]
+    fs = np.array([recording.fs for recording in recordings])
+    return AppleWatchBatch(signals=signals, lengths=lengths, fs=fs, recordings=recordings)
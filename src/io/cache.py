@@ -0,0 +1,143 @@
+"""Memory-mapped binary cache of loaded, preprocessed recordings."""
+import hashlib
+import json
+import os
+import numpy as np
+from numpy.typing import DTypeLike
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# Bump when the cache layout changes so old caches are ignored
+CACHE_VERSION = 2
+META_FILE = 'meta.json'
+
+
+def cache_path(cache_dir: str, file_path: str, start: float = 0, duration: Optional[float] = None,
+               dtype: DTypeLike = np.float64) -> str:
+    """
+    Get the cache directory of a recording, time range and floating point type.
+
+    Each dtype has its own directory, so loading at one precision never
+    replaces the cache of another.
+
+    Args:
+        cache_dir: Root directory of the cache
+        file_path: Path to the source file
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+        dtype: Floating point type of the cached signals
+
+    Returns:
+        Path to the directory holding the cached leads
+    """
+    source = os.path.abspath(file_path)
+    key = hashlib.sha1(f'{source}|{start}|{duration}|{np.dtype(dtype).name}'.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{os.path.basename(source)}-{key}')
+
+
+def source_stamp(file_path: str) -> Dict[str, int]:
+    """
+    Get the modification time and size of a source file.
+
+    Args:
+        file_path: Path to the source file
+
+    Returns:
+        Dictionary of mtime in nanoseconds and size in bytes
+    """
+    stat = os.stat(file_path)
+    return {'mtime': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _read_meta(path: str, file_path: str) -> Optional[Dict[str, Any]]:
+    """Read the cache metadata, or None if it is missing or stale."""
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION or meta.get('source') != source_stamp(file_path):
+        return None
+    return meta
+
+
+def read_cache(cache_dir: str, file_path: str, leads: Optional[Sequence[int]] = None, start: float = 0,
+               duration: Optional[float] = None,
+               dtype: DTypeLike = np.float64) -> Optional[Tuple[Dict[int, np.ndarray], float, str]]:
+    """
+    Open the cached, preprocessed leads of a recording as read-only memory maps.
+
+    Args:
+        cache_dir: Root directory of the cache
+        file_path: Path to the source file
+        leads: Lead indices to open, or None for all leads of the source
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+        dtype: Floating point type of the signals; only a cache written in it is read
+
+    Returns:
+        signals, fs and units as returned by the loaders, or None if the cache
+        does not hold the selection or the source file has changed since it was written
+    """
+    path = cache_path(cache_dir, file_path, start, duration, dtype)
+    meta = _read_meta(path, file_path)
+    if meta is None:
+        return None
+    if leads is None:
+        if not meta['all_leads']:
+            return None
+        leads = meta['leads']
+    elif not set(leads) <= set(meta['leads']):
+        return None
+    signals = {i: np.load(os.path.join(path, f'lead_{i}.npy'), mmap_mode='r') for i in leads}
+    if any(signal.dtype != np.dtype(dtype) for signal in signals.values()):
+        return None
+    return signals, meta['fs'], meta['units']
+
+
+def write_cache(cache_dir: str, file_path: str, signals: Dict[int, np.ndarray], fs: float, units: str,
+                all_leads: bool, start: float = 0, duration: Optional[float] = None,
+                dtype: DTypeLike = np.float64) -> None:
+    """
+    Write the preprocessed leads of a recording to the cache, one .npy file per lead.
+
+    Leads already cached for the same unchanged source are kept.
+
+    Args:
+        cache_dir: Root directory of the cache
+        file_path: Path to the source file
+        signals: Preprocessed signals keyed by lead index
+        fs: The sampling frequency
+        units: The units of the signals
+        all_leads: Whether signals holds every lead of the source
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+        dtype: Floating point type the signals are stored in
+    """
+    path = cache_path(cache_dir, file_path, start, duration, dtype)
+    os.makedirs(path, exist_ok=True)
+    meta = _read_meta(path, file_path)
+    if meta is not None:
+        leads = set(meta['leads']) | set(signals)
+        all_leads = all_leads or meta['all_leads']
+    else:
+        leads = set(signals)
+    meta_path = os.path.join(path, META_FILE)
+    # Metadata is removed first and written last so an interrupted write leaves the cache invalid
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for i, signal in signals.items():
+        np.save(os.path.join(path, f'lead_{i}.npy'), np.asarray(signal, dtype=dtype))
+    meta = {
+        'version': CACHE_VERSION,
+        'file_path': os.path.abspath(file_path),
+        'source': source_stamp(file_path),
+        'fs': np.asarray(fs).item(),
+        'units': units,
+        'start': start,
+        'duration': duration,
+        'dtype': np.dtype(dtype).name,
+        'leads': sorted(leads),
+        'all_leads': all_leads,
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=2)
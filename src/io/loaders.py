@@ -1,117 +1,320 @@
 """File loading functions for various ECG formats."""
+import csv
 import numpy as np
 import pandas as pd
-from pyedflib import highlevel
-import concurrent.futures
+import pyedflib
+from . import cache
+from ..processing import parallel
 from .apple_watch import csv_to_numpy
-from typing import TYPE_CHECKING
+from numpy.typing import DTypeLike
+from typing import Callable, Dict, Optional, Sequence, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from ..core.ecg_data import ECGData
 
+# Number of samples read from an EDF channel per call
+EDF_BLOCK_SIZE = 1 << 20
 
-def read_csv_data(ecg_data: 'ECGData') -> None:
+# Reads (file_path, leads, start, duration, dtype=...) into signals keyed by lead index, fs and units
+SignalReader = Callable[..., Tuple[Dict[int, np.ndarray], float, str]]
+
+
+def sample_range(n_samples: int, fs: float, start: float = 0,
+                 duration: Optional[float] = None) -> Tuple[int, int]:
     """
-    Read ECG data from CSV file.
-    Supports both Apple Watch single-lead and multi-channel Holter formats.
+    Convert a time range to a sample range clipped to the recording.
+
+    Args:
+        n_samples: Number of samples in the recording
+        fs: Sampling frequency
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+
+    Returns:
+        First sample and number of samples in the range
+    """
+    first = min(max(int(round(start * fs)), 0), n_samples)
+    if duration is None:
+        return first, n_samples - first
+    return first, min(max(int(round(duration * fs)), 0), n_samples - first)
+
+
+def select_signals(signals: Dict[int, np.ndarray], fs: float, leads: Optional[Sequence[int]] = None,
+                   start: float = 0, duration: Optional[float] = None) -> Dict[int, np.ndarray]:
+    """
+    Select leads and a time range from signals that are already loaded.
+
+    Args:
+        signals: Signals keyed by lead index
+        fs: Sampling frequency
+        leads: Lead indices to keep, or None for all
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+
+    Returns:
+        Views of the selected signals keyed by lead index
+    """
+    if leads is not None:
+        missing = set(leads) - set(signals)
+        if missing:
+            raise IndexError(f'Leads {sorted(missing)} not found, available leads are {sorted(signals)}')
+        signals = {i: signals[i] for i in leads}
+    selected = {}
+    for i, signal in signals.items():
+        first, n = sample_range(signal.shape[0], fs, start, duration)
+        selected[i] = signal[first:first + n]
+    return selected
+
+
+def _shared_rows(rows: Sequence[np.ndarray]) -> Optional[np.ndarray]:
+    """Find the writable 2D array whose rows are the signals, in order, if they are one."""
+    base = rows[0].base
+    if not isinstance(base, np.ndarray) or base.ndim != 2 or base.shape[0] != len(rows):
+        return None
+    if not base.flags.writeable or base.dtype != rows[0].dtype:
+        return None
+    for row, signal in enumerate(rows):
+        if (signal.shape != base[row].shape or signal.strides != base[row].strides
+                or signal.__array_interface__['data'][0] != base[row].__array_interface__['data'][0]):
+            return None
+    return base
+
+
+def assign_leads(ecg_data: 'ECGData', signals: Dict[int, np.ndarray], preprocessed: bool = False) -> None:
+    """
+    Create an ECGLead for each signal and attach it to the ECGData.
+
+    Signals of equal length are preprocessed together into ecg_data.signals, a
+    (leads x samples) array of ecg_data.dtype whose rows are shared with the
+    leads. When the reader already returned the rows of one such array, it is
+    scaled in place rather than copied; with the 'processes' executor the array
+    is allocated in shared memory instead.
+
+    Signals that are already preprocessed, such as the memory maps of the
+    cache, become the leads' signals as they are and ecg_data.signals is left
+    unset, so nothing is read into memory until a stage needs it. With the
+    'processes' executor they are still copied into shared memory.
+
+    Args:
+        ecg_data: The ECGData to populate, with fs, units and dtype already set
+        signals: Signals keyed by lead index
+        preprocessed: Whether the signals are already scaled and in ecg_data.dtype
     """
     from ..core.ecg_lead import ECGLead
-    
-    # Try to read as multi-channel CSV first
-    try:
-        df = pd.read_csv(ecg_data.file_path)
-        b
-        # Check if it's multi-channel format (has channel columns)
-        if 'channel_1' in df.columns or 'channel_2' in df.columns or 'channel_3' in df.columns:
-            # Multi-channel Holter CSV format
-            ecg_data.fs = 180  # Default sampling rate for Holter data
-            
-            # Check if time_seconds column exists to calculate fs
-            if 'time_seconds' in df.columns and len(df) > 1:
-                ecg_data.fs = int(1 / (df['time_seconds'][1] - df['time_seconds'][0]))
-            
-            ecg_data.units = 'uV'
-            
-            if 'channel_1' in df.columns:
-                ecg_data.lead_1 = ECGLead(
-                    signal=df['channel_1'].values.astype(np.float64),
-                    fs=ecg_data.fs,
-                    units=ecg_data.units,
-                    lead=0
-                )
-            if 'channel_2' in df.columns:
-                ecg_data.lead_2 = ECGLead(
-                    signal=df['channel_2'].values.astype(np.float64),
-                    fs=ecg_data.fs,
-                    units=ecg_data.units,
-                    lead=1
-                )
-            if 'channel_3' in df.columns:
-                ecg_data.lead_3 = ECGLead(
-                    signal=df['channel_3'].values.astype(np.float64),
-                    fs=ecg_data.fs,
-                    units=ecg_data.units,
-                    lead=2
-                )
+
+    dtype = np.dtype(ecg_data.dtype)
+    rows = list(signals.values())
+    # Worker processes read the signals from shared memory, so they are scaled into it
+    in_processes = ecg_data.executor == 'processes'
+    if preprocessed and not in_processes:
+        for i, signal in signals.items():
+            ecg_data.channels[i] = ECGLead(signal=signal, fs=ecg_data.fs, units=ecg_data.units, lead=i,
+                                           preprocessed=True)
+    elif rows and len({signal.shape[0] for signal in rows}) == 1:
+        stacked = _shared_rows(rows)
+        if stacked is not None and stacked.dtype == dtype and not in_processes and not preprocessed:
+            ecg_data.signals = np.divide(stacked, 1000, out=stacked)
         else:
-            # Apple Watch format
-            data = csv_to_numpy(ecg_data.file_path)
-            ecg_data.fs = data[1]
-            ecg_data.units = 'uV'
-            ecg_data.lead_1 = ECGLead(
-                signal=data[0],
-                fs=ecg_data.fs,
-                units=ecg_data.units,
-                lead=0
-            )
-    except:
-        # Fall back to Apple Watch format
-        data = csv_to_numpy(ecg_data.file_path)
-        ecg_data.fs = data[1]
-        ecg_data.units = 'uV'
-        ecg_data.lead_1 = ECGLead(
-            signal=data[0],
-            fs=ecg_data.fs,
-            units=ecg_data.units,
-            lead=0
-        )
+            # Scale and convert each lead straight into the stacked array
+            shape = (len(rows), rows[0].shape[0])
+            ecg_data.signals = parallel.shared_empty(shape, dtype) if in_processes else np.empty(shape, dtype=dtype)
+            for row, signal in enumerate(rows):
+                if preprocessed:
+                    ecg_data.signals[row] = signal
+                else:
+                    np.divide(signal, 1000, out=ecg_data.signals[row])
+        for row, i in enumerate(signals):
+            ecg_data.channels[i] = ECGLead(signal=ecg_data.signals[row], fs=ecg_data.fs,
+                                           units=ecg_data.units, lead=i, preprocessed=True)
+    else:
+        for i, signal in signals.items():
+            ecg_data.channels[i] = ECGLead(signal=signal, fs=ecg_data.fs, units=ecg_data.units, lead=i,
+                                           dtype=dtype, preprocessed=preprocessed)
+    # The first three leads are also available under their own names
+    ecg_data.lead_1 = ecg_data.channels.get(0)
+    ecg_data.lead_2 = ecg_data.channels.get(1)
+    ecg_data.lead_3 = ecg_data.channels.get(2)
+
+
+def read_csv_signals(file_path: str, leads: Optional[Sequence[int]] = None, start: float = 0,
+                     duration: Optional[float] = None,
+                     dtype: DTypeLike = np.float64) -> Tuple[Dict[int, np.ndarray], float, str]:
+    """
+    Read ECG signals from CSV file.
+    Supports both Apple Watch single-lead and multi-channel Holter formats.
+
+    Args:
+        file_path: Path to the CSV file
+        leads: Lead indices to read, or None for all
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+        dtype: Floating point type of the signals
+
+    Returns:
+        signals: Signals keyed by lead index
+        fs: The sampling frequency
+        units: The units of the signals
+    """
+    with open(file_path, encoding='utf-8') as f:
+        columns = next(csv.reader([f.readline()]), [])
+    # Multi-channel Holter CSV format has channel_1, channel_2, ... columns
+    channels = {int(column.split('_')[1]) - 1: column for column in columns
+                if column.startswith('channel_') and column.split('_')[1].isdigit()}
+    if channels:
+        if leads is not None:
+            # Only parse the requested channels
+            channels = {i: channels[i] for i in leads if i in channels}
+        usecols = list(channels.values())
+        if 'time_seconds' in columns:
+            usecols.append('time_seconds')
+        # Channels are parsed straight into dtype
+        df = pd.read_csv(file_path, usecols=usecols, dtype={column: dtype for column in channels.values()})
+        fs = 180  # Default sampling rate for Holter data
+
+        # Check if time_seconds column exists to calculate fs
+        if 'time_seconds' in df.columns and len(df) > 1:
+            fs = int(1 / (df['time_seconds'][1] - df['time_seconds'][0]))
+
+        signals = {i: df[column].to_numpy() for i, column in sorted(channels.items())}
+    else:
+        # Apple Watch format
+        signal, fs = csv_to_numpy(file_path)
+        signals = {0: signal.astype(dtype, copy=False)}
+    return select_signals(signals, fs, leads, start, duration), fs, 'uV'
+
+
+def read_npz_signals(file_path: str, leads: Optional[Sequence[int]] = None, start: float = 0,
+                     duration: Optional[float] = None,
+                     dtype: DTypeLike = np.float64) -> Tuple[Dict[int, np.ndarray], float, str]:
+    """
+    Read ECG signals from NPZ file.
+
+    Leads are stored as ecg_1, ecg_2, ... (or a single lead as x), and only the
+    requested leads are decompressed.
+
+    Args:
+        file_path: Path to the NPZ file
+        leads: Lead indices to read, or None for all
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+        dtype: Floating point type of the signals
+
+    Returns:
+        signals: Signals keyed by lead index
+        fs: The sampling frequency
+        units: The units of the signals
+    """
+    with np.load(file_path) as data:
+        keys = {int(key.split('_')[1]) - 1: key for key in data.files
+                if key.startswith('ecg_') and key.split('_')[1].isdigit()}
+        if not keys and 'x' in data.files:
+            keys = {0: 'x'}
+        if leads is None:
+            leads = sorted(keys)
+        missing = set(leads) - set(keys)
+        if missing:
+            raise IndexError(f'Leads {sorted(missing)} not found, available leads are {sorted(keys)}')
+        fs = data['fs'].item()
+        signals = {i: data[keys[i]].astype(dtype, copy=False) for i in leads}
+    return select_signals(signals, fs, start=start, duration=duration), fs, 'uV'
+
+
+def read_edf_signals(file_path: str, leads: Optional[Sequence[int]] = None, start: float = 0,
+                     duration: Optional[float] = None, dtype: DTypeLike = np.float64,
+                     block_size: int = EDF_BLOCK_SIZE) -> Tuple[Dict[int, np.ndarray], float, str]:
+    """
+    Read selected channels and a time range from an EDF file.
+
+    Only the requested samples are read, one block at a time, so memory use is
+    set by the selection rather than the size of the file. Channels of equal
+    length are read into the rows of one (leads x samples) array of dtype;
+    other dtypes than float64 go through a float64 buffer of one block.
+
+    Args:
+        file_path: Path to the EDF file
+        leads: Channel indices to read, or None for all
+        start: Start of the range in seconds
+        duration: Length of the range in seconds, or None for the rest of the recording
+        dtype: Floating point type of the signals
+        block_size: Number of samples read per call
+
+    Returns:
+        signals: Signals keyed by channel index
+        fs: The sampling frequency
+        units: The physical dimension of the signals
+    """
+    with pyedflib.EdfReader(file_path) as reader:
+        if leads is None:
+            leads = range(reader.signals_in_file)
+        missing = [i for i in leads if not 0 <= i < reader.signals_in_file]
+        if missing:
+            raise IndexError(f'Leads {missing} not found, file has {reader.signals_in_file} channels')
+        frequencies = {reader.getSampleFrequency(i) for i in leads}
+        if len(frequencies) > 1:
+            raise ValueError(f'Selected leads have different sampling frequencies: {sorted(frequencies)}')
+        fs = frequencies.pop()
+        units = reader.getPhysicalDimension(leads[0])
+        n_samples = reader.getNSamples()
+
+        ranges = {i: sample_range(int(n_samples[i]), fs, start, duration) for i in leads}
+        lengths = {n for _, n in ranges.values()}
+        if len(lengths) == 1:
+            stacked = np.empty((len(ranges), lengths.pop()), dtype=dtype)
+            signals = {i: stacked[row] for row, i in enumerate(ranges)}
+        else:
+            signals = {i: np.empty(n, dtype=dtype) for i, (_, n) in ranges.items()}
+        direct = np.dtype(dtype) == np.float64
+        buffer = None if direct else np.empty(min(block_size, max((n for _, n in ranges.values()), default=0)))
+        for i, (first, n) in ranges.items():
+            for offset in range(0, n, block_size):
+                count = min(block_size, n - offset)
+                if direct:
+                    reader.readsignal(i, first + offset, count, signals[i][offset:offset + count])
+                else:
+                    reader.readsignal(i, first + offset, count, buffer[:count])
+                    signals[i][offset:offset + count] = buffer[:count]
+    return signals, fs, units
+
+
+def load_signals(ecg_data: 'ECGData', read_signals: SignalReader) -> None:
+    """
+    Read the selected signals of an ECGData and attach them as leads.
+
+    When ecg_data.cache_dir is set, the preprocessed signals are opened as
+    memory maps from the cache if it holds them, and kept as the leads'
+    signals; otherwise they are read, preprocessed and written to it.
+
+    Args:
+        ecg_data: The ECGData to populate
+        read_signals: Reader for the file format
+    """
+    args = (ecg_data.file_path, ecg_data.leads, ecg_data.start, ecg_data.duration)
+    if ecg_data.cache_dir is not None:
+        cached = cache.read_cache(ecg_data.cache_dir, *args, dtype=ecg_data.dtype)
+        if cached is not None:
+            signals, ecg_data.fs, ecg_data.units = cached
+            assign_leads(ecg_data, signals, preprocessed=True)
+            return
+    signals, ecg_data.fs, ecg_data.units = read_signals(*args, dtype=ecg_data.dtype)
+    assign_leads(ecg_data, signals)
+    if ecg_data.cache_dir is not None:
+        preprocessed = {i: lead.signal for i, lead in ecg_data.channels.items()}
+        cache.write_cache(ecg_data.cache_dir, ecg_data.file_path, preprocessed, ecg_data.fs, ecg_data.units,
+                          all_leads=ecg_data.leads is None,
+                          start=ecg_data.start, duration=ecg_data.duration, dtype=ecg_data.dtype)
+
+
+def read_csv_data(ecg_data: 'ECGData') -> None:
+    """Read ECG data from CSV file."""
+    load_signals(ecg_data, read_csv_signals)
 
 
 def read_npz_data(ecg_data: 'ECGData') -> None:
     """Read ECG data from NPZ file."""
-    from ..core.ecg_lead import ECGLead
-    
-    data = np.load(ecg_data.file_path)
-    ecg_data.fs = int(data['fs'])
-    ecg_data.units = 'uV'
-    ecg_data.lead_1 = ECGLead(signal=data['ecg_1'], fs=ecg_data.fs, units=ecg_data.units, lead=0)
-    ecg_data.lead_2 = ECGLead(signal=data['ecg_2'], fs=ecg_data.fs, units=ecg_data.units, lead=1)
-    ecg_data.lead_3 = ECGLead(signal=data['ecg_3'], fs=ecg_data.fs, units=ecg_data.units, lead=2)
+    load_signals(ecg_data, read_npz_signals)
 
 
 def read_edf_data(ecg_data: 'ECGData') -> None:
     """Read ECG data from EDF file."""
-    from ..core.ecg_lead import ECGLead
-    
-    signals, signal_headers, header = highlevel.read_edf(ecg_data.file_path)
-    # Check available keys
-    print(f"Signal header keys: {signal_headers[0].keys()}")
-    ecg_data.fs = signal_headers[0].get('sample_frequency', signal_headers[0].get('sample_rate'))
-    ecg_data.units = signal_headers[0]['dimension']
     print(f'File: {ecg_data.file_path}')
-
-    # Process the leads in parallel
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Submit tasks
-        futures = [
-            executor.submit(ECGLead, i, signals[i], ecg_data.fs, ecg_data.units)
-            for i in range(3)
-        ]
-
-        # Wait for all futures to complete and collect results
-        results = [future.result() for future in concurrent.futures.as_completed(futures)]
-
-    # Assign the results using ECGLead.lead
-    ecg_data.lead_1 = [result for result in results if result.lead == 0][0]
-    ecg_data.lead_2 = [result for result in results if result.lead == 1][0]
-    ecg_data.lead_3 = [result for result in results if result.lead == 2][0]
\ No newline at end of file
+    load_signals(ecg_data, read_edf_signals)
@@ -1,10 +1,24 @@
 """Signal processing functions."""
 from .filters import butter_highpass_filter, standardise
 from .transforms import grad_square_conv, phasor_transform, timer_decorator
-from .detectors import peak, filter_by_width
+from .detectors import peak, threshold_calc, filter_by_width, merge_close_peaks
+from .compiled import BACKENDS, get_backend, set_backend
+from .chunking import chunked_threshold, chunked_peak
+from .delineation import PWaves, TWaves, delineate_p_waves, delineate_t_waves, qrs_onsets
+from .fusion import fuse_beats, match_nearest
+from .parallel import EXECUTORS, parallel_peak, parallel_threshold, shared_empty
+from .streaming import StreamingRDetector
+from .spectral import chunked_spectrogram, spectrogram_bins
 
 __all__ = [
     'butter_highpass_filter', 'standardise',
     'grad_square_conv', 'phasor_transform', 'timer_decorator',
-    'peak', 'filter_by_width'
+    'peak', 'threshold_calc', 'filter_by_width', 'merge_close_peaks',
+    'BACKENDS', 'get_backend', 'set_backend',
+    'chunked_threshold', 'chunked_peak',
+    'PWaves', 'TWaves', 'delineate_p_waves', 'delineate_t_waves', 'qrs_onsets',
+    'fuse_beats', 'match_nearest',
+    'EXECUTORS', 'parallel_peak', 'parallel_threshold', 'shared_empty',
+    'StreamingRDetector',
+    'chunked_spectrogram', 'spectrogram_bins'
 ]
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""Chunked processing of long recordings with bounded memory."""
+import numpy as np
+from typing import Callable, Iterator, List, Tuple
+from .detectors import peak
+
+
+def chunk_bounds(n: int, chunk_size: int, overlap: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Split a signal of length n into overlapping chunks.
+
+    Args:
+        n: Length of the signal
+        chunk_size: Number of samples owned by each chunk
+        overlap: Number of extra samples read on either side of a chunk
+
+    Returns:
+        Iterator of (start, stop, ext_start, ext_stop), where [start, stop) is the
+        region owned by the chunk and [ext_start, ext_stop) is the region read
+    """
+    if chunk_size <= 0:
+        raise ValueError('chunk_size must be positive')
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        yield start, stop, max(start - overlap, 0), min(stop + overlap, n)
+
+
+def chunked_threshold(signal: np.ndarray, transform: Callable[[np.ndarray], np.ndarray],
+                      chunk_size: int, overlap: int,
+                      lower: float = 0.01, upper: float = 2) -> np.ndarray:
+    """
+    Calculate the peak detector threshold over a transformed signal one chunk at a time.
+
+    Gives the same result as taking the mean over the fully transformed signal.
+
+    Args:
+        signal: The signal, or a (leads x samples) array of signals
+        transform: Function mapping a slice of the signal to its transformed values
+        chunk_size: Number of samples owned by each chunk
+        overlap: Number of extra samples read on either side of a chunk
+        lower: Values at or below this are ignored
+        upper: Values at or above this are ignored
+
+    Returns:
+        The threshold, one per lead for a 2D array
+    """
+    total = np.zeros(signal.shape[:-1])
+    count = np.zeros(signal.shape[:-1], dtype=np.int64)
+    for start, stop, ext_start, ext_stop in chunk_bounds(signal.shape[-1], chunk_size, overlap):
+        transformed = transform(signal[..., ext_start:ext_stop])[..., start - ext_start:stop - ext_start]
+        mask = (transformed > lower) & (transformed < upper)
+        total += np.where(mask, transformed, 0).sum(axis=-1)
+        count += np.count_nonzero(mask, axis=-1)
+    return total / count / 4
+
+
+def chunked_peak(signal: np.ndarray, transform: Callable[[np.ndarray], np.ndarray],
+                 threshold: np.ndarray, chunk_size: int, overlap: int) -> np.ndarray:
+    """
+    Find the peaks of a transformed signal one chunk at a time.
+
+    Peaks are kept by the chunk owning their position, so beats in the overlap
+    between two chunks are reported once. The overlap must be longer than both
+    the transform's edge effects and the widest peak.
+
+    Args:
+        signal: The signal, or a (leads x samples) array of signals
+        transform: Function mapping a slice of the signal to its transformed values
+        threshold: The threshold, or one per lead
+        chunk_size: Number of samples owned by each chunk
+        overlap: Number of extra samples read on either side of a chunk
+
+    Returns:
+        The peaks of the signal as returned by detectors.peak, or a list of the
+        peaks of each lead for a 2D array
+    """
+    n_rows = signal.shape[0] if signal.ndim == 2 else 1
+    peaks: List[List[np.ndarray]] = [[] for _ in range(n_rows)]
+    # Samples above the threshold before the current chunk
+    preceding = np.zeros(signal.shape[:-1], dtype=np.int64)
+    for start, stop, ext_start, ext_stop in chunk_bounds(signal.shape[-1], chunk_size, overlap):
+        transformed = transform(signal[..., ext_start:ext_stop])
+        above = transformed > np.reshape(threshold, signal.shape[:-1] + (1,))
+        rank_offset = preceding - np.count_nonzero(above[..., :start - ext_start], axis=-1)
+        preceding += np.count_nonzero(above[..., start - ext_start:stop - ext_start], axis=-1)
+        found = peak(signal=transformed, threshold=threshold, rank_offset=rank_offset)
+        for row, row_found in enumerate(found if signal.ndim == 2 else [found]):
+            row_found[:, 0] += ext_start
+            peaks[row].append(row_found[(row_found[:, 0] >= start) & (row_found[:, 0] < stop)])
+    stitched = [np.concatenate(row) if row else np.empty((0, 2), dtype=int) for row in peaks]
+    return stitched if signal.ndim == 2 else stitched[0]
@@ -0,0 +1,270 @@
+"""Optional compiled kernels for the detectors, used when Numba is installed."""
+import math
+import numpy as np
+from typing import List, Optional, Tuple, Union
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Backends the detectors can run on
+BACKENDS = ('auto', 'numpy', 'numba')
+# Whether Numba could be imported
+NUMBA_AVAILABLE = numba is not None
+
+_backend = 'auto'
+
+
+def set_backend(name: str) -> None:
+    """
+    Choose the backend of peak, threshold_calc and merge_close_peaks.
+
+    Args:
+        name: 'numba' for the compiled kernels, 'numpy' for the array code, or
+            'auto' to use Numba when it is installed and numpy otherwise
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown backend {name!r}, expected one of {BACKENDS}')
+    if name == 'numba' and not NUMBA_AVAILABLE:
+        raise ImportError("The 'numba' backend needs Numba installed")
+    _backend = name
+
+
+def get_backend() -> str:
+    """The backend in use, 'numba' or 'numpy'."""
+    if _backend == 'auto':
+        return 'numba' if NUMBA_AVAILABLE else 'numpy'
+    return _backend
+
+
+def use_compiled() -> bool:
+    """Whether the detectors should call the compiled kernels."""
+    return get_backend() == 'numba'
+
+
+def _jit(func):
+    """Compile a kernel with Numba when it is installed; otherwise leave it as Python."""
+    if numba is None:
+        return func
+    return numba.njit(cache=True, nogil=True)(func)
+
+
+@_jit
+def _masked(value, lower, upper):
+    """A value within (lower, upper) as float64, or zero."""
+    return float(value) if lower < value < upper else 0.0
+
+
+@_jit
+def _pairwise_sum(x, start, n, lower, upper):
+    """
+    Sum of x[start:start + n] within (lower, upper), in the order numpy's add.reduce
+    sums a contiguous float64 array, so the result is bitwise identical.
+    """
+    if n < 8:
+        total = 0.0
+        for i in range(start, start + n):
+            total += _masked(x[i], lower, upper)
+        return total
+    if n <= 128:
+        r0 = _masked(x[start], lower, upper)
+        r1 = _masked(x[start + 1], lower, upper)
+        r2 = _masked(x[start + 2], lower, upper)
+        r3 = _masked(x[start + 3], lower, upper)
+        r4 = _masked(x[start + 4], lower, upper)
+        r5 = _masked(x[start + 5], lower, upper)
+        r6 = _masked(x[start + 6], lower, upper)
+        r7 = _masked(x[start + 7], lower, upper)
+        unrolled = n - n % 8
+        for i in range(start + 8, start + unrolled, 8):
+            r0 += _masked(x[i], lower, upper)
+            r1 += _masked(x[i + 1], lower, upper)
+            r2 += _masked(x[i + 2], lower, upper)
+            r3 += _masked(x[i + 3], lower, upper)
+            r4 += _masked(x[i + 4], lower, upper)
+            r5 += _masked(x[i + 5], lower, upper)
+            r6 += _masked(x[i + 6], lower, upper)
+            r7 += _masked(x[i + 7], lower, upper)
+        total = ((r0 + r1) + (r2 + r3)) + ((r4 + r5) + (r6 + r7))
+        for i in range(start + unrolled, start + n):
+            total += _masked(x[i], lower, upper)
+        return total
+    half = n // 2
+    half -= half % 8
+    return _pairwise_sum(x, start, half, lower, upper) + _pairwise_sum(x, start + half, n - half, lower, upper)
+
+
+@_jit
+def _threshold_row(x, lower, upper, block):
+    """Sum and count of the values of a signal within (lower, upper), summed block by block."""
+    n = x.shape[0]
+    total = 0.0
+    count = 0
+    for first in range(0, n, block):
+        size = min(block, n - first)
+        total += _pairwise_sum(x, first, size, lower, upper)
+        for i in range(first, first + size):
+            if lower < x[i] < upper:
+                count += 1
+    return total, count
+
+
+def threshold_sums(transformed_signal: np.ndarray, lower: float, upper: float,
+                   block: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sum and count of the transformed values within (lower, upper), in one pass per row.
+
+    Args:
+        transformed_signal: The transformed signal, or a (leads x samples) array of them
+        lower: Values at or below this are ignored
+        upper: Values at or above this are ignored
+        block: Samples summed pairwise before adding to the total, as in threshold_calc
+
+    Returns:
+        The sums and counts, one per lead for a 2D array
+    """
+    rows = np.reshape(transformed_signal, (-1, transformed_signal.shape[-1]))
+    total = np.zeros(rows.shape[0])
+    count = np.zeros(rows.shape[0], dtype=np.int64)
+    for row in range(rows.shape[0]):
+        total[row], count[row] = _threshold_row(np.ascontiguousarray(rows[row]), lower, upper, block)
+    return total.reshape(transformed_signal.shape[:-1]), count.reshape(transformed_signal.shape[:-1])
+
+
+@_jit
+def _rint(value):
+    """Round to the nearest integer, halves to even, as np.rint does."""
+    floor = math.floor(value)
+    fraction = value - floor
+    if fraction > 0.5 or (fraction == 0.5 and floor % 2 == 1):
+        floor += 1
+    return int(floor)
+
+
+@_jit
+def _peak_row(signal, threshold, rank_offset):
+    """
+    Peaks of a signal in one pass, with the positions, rounding and dropped runs of peak.
+
+    Positions count from the pinned sample before the signal, so sample i is
+    position i + 1 and the pins are positions 0 and n + 1.
+    """
+    n = signal.shape[0]
+    out = np.empty((n // 64 + 16, 2), dtype=np.int64)
+    count = 0
+    pinned = 1 > threshold
+    # Positions above the threshold seen so far, which is the rank of the next one
+    rank = 0
+    previous = -2
+    # Index, first rank and first position of the current run
+    run = -1
+    run_rank = 0
+    run_position = 0
+    for i in range(-1, n + 1):
+        if i == -1 or i == n:
+            above = pinned
+        else:
+            above = signal[i] > threshold
+        if not above:
+            continue
+        position = i + 1
+        if position != previous + 1:
+            # A new run ends the current one, which is reported unless it is the first
+            if run >= 1:
+                if count == out.shape[0]:
+                    grown = np.empty((2 * count, 2), dtype=np.int64)
+                    grown[:count] = out
+                    out = grown
+                middle = _rint(0.5 * (run_rank + rank) + rank_offset) - rank_offset
+                # Rounding up a single sample run lands on the next run, as indexing T does in peak
+                out[count, 0] = run_position + middle - run_rank if middle < rank else position
+                out[count, 1] = rank - run_rank
+                count += 1
+            run += 1
+            run_rank = rank
+            run_position = position
+        previous = position
+        rank += 1
+    return out[:count].copy()
+
+
+def peak(signal: np.ndarray, threshold: Union[float, np.ndarray],
+         rank_offset: Union[int, np.ndarray] = 0) -> Union[np.ndarray, List[np.ndarray]]:
+    """
+    Find the peaks of a signal without temporary arrays; see detectors.peak.
+
+    Args:
+        signal: The signal, or a (leads x samples) array of signals
+        threshold: The threshold, or one per lead
+        rank_offset: Samples above the threshold preceding the signal, or one per lead
+
+    Returns:
+        The peaks of the signal, or a list of the peaks of each lead for a 2D array
+    """
+    if signal.ndim == 1:
+        return _peak_row(signal, float(np.reshape(threshold, -1)[0]), int(np.reshape(rank_offset, -1)[0]))
+    thresholds = np.broadcast_to(np.reshape(threshold, -1), signal.shape[:1])
+    offsets = np.broadcast_to(np.reshape(rank_offset, -1), signal.shape[:1])
+    return [_peak_row(signal[row], float(thresholds[row]), int(offsets[row])) for row in range(signal.shape[0])]
+
+
+@_jit
+def _is_sorted(values):
+    """Whether values are in ascending order."""
+    for i in range(1, values.shape[0]):
+        if values[i] < values[i - 1]:
+            return False
+    return True
+
+
+@_jit
+def _merge_close(first, second, min_distance):
+    """Merge two sorted arrays, dropping values closer than min_distance to a neighbour."""
+    n_first = first.shape[0]
+    n_second = second.shape[0]
+    out = np.empty(n_first + n_second, dtype=np.int64)
+    count = 0
+    i = 0
+    j = 0
+    current = 0
+    # Whether the current value is close to the one before it
+    current_close = False
+    for k in range(n_first + n_second):
+        if j >= n_second or (i < n_first and first[i] <= second[j]):
+            value = first[i]
+            i += 1
+        else:
+            value = second[j]
+            j += 1
+        if k > 0:
+            close = value - current < min_distance
+            if not current_close and not close:
+                out[count] = current
+                count += 1
+            current_close = close
+        current = value
+    if n_first + n_second > 0 and not current_close:
+        out[count] = current
+        count += 1
+    return out[:count].copy()
+
+
+def merge_close_peaks(first: np.ndarray, second: np.ndarray, min_distance: int) -> Optional[np.ndarray]:
+    """
+    Merge two sorted peak arrays in one pass; see detectors.merge_close_peaks.
+
+    Args:
+        first: Sorted peak samples
+        second: Sorted peak samples
+        min_distance: Peaks closer than this to a neighbour are dropped
+
+    Returns:
+        The merged peaks, or None when either input is not sorted
+    """
+    first = np.ascontiguousarray(first, dtype=np.int64)
+    second = np.ascontiguousarray(second, dtype=np.int64)
+    if not (_is_sorted(first) and _is_sorted(second)):
+        return None
+    return _merge_close(first, second, min_distance)
@@ -0,0 +1,283 @@
+"""Vectorised delineation of the P wave, QRS onset and T wave of every beat."""
+from dataclasses import dataclass
+import numpy as np
+from typing import Iterator, Optional, Tuple
+from ..analysis import morphology
+
+# Fractions of the RR interval after the R peak the T wave is searched between
+T_WINDOW = (0.15, 0.6)
+# Latest end of the T wave search window after the R peak, in seconds, so a pause or gap cannot widen it
+T_MAX = 0.9
+# Seconds before the R peak the QRS onset is searched in
+QRS_ONSET_WINDOW = 0.1
+# Fraction of the steepest QRS slope below which the signal counts as flat
+ONSET_SLOPE = 0.2
+# Length of the moving average smoothing the T wave, in seconds
+T_SMOOTHING = 0.04
+# Fraction of the preceding RR interval before the R peak the P wave search starts at
+P_WINDOW = 0.35
+# Longest P wave search window before the QRS onset, in seconds, so a pause or gap cannot widen it
+P_MAX = 0.4
+# Length of the moving average smoothing the P wave, in seconds
+P_SMOOTHING = 0.02
+
+
+@dataclass
+class TWaves:
+    """
+    QRS onset, T peak and T end of every beat, in samples, -1 where not found,
+    with the QT interval and Bazett's QTc in ms, NaN where not found.
+    """
+    q_onset: np.ndarray
+    t_peak: np.ndarray
+    t_end: np.ndarray
+    qt: np.ndarray
+    qtc: np.ndarray
+
+
+@dataclass
+class PWaves:
+    """
+    P onset and P peak of every beat, in samples, -1 where not found, with the
+    PR interval from the P onset to the QRS onset in ms, NaN where not found.
+    """
+    p_onset: np.ndarray
+    p_peak: np.ndarray
+    pr: np.ndarray
+
+
+def _rr_intervals(r_samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """RR interval following and preceding each beat, borrowing the neighbouring one at the ends."""
+    rr = np.diff(r_samples)
+    if rr.shape[0] == 0:
+        return np.zeros(r_samples.shape[0], dtype=np.int64), np.zeros(r_samples.shape[0], dtype=np.int64)
+    following = np.append(rr, rr[-1])
+    preceding = np.insert(rr, 0, rr[0])
+    return following, preceding
+
+
+def _smoothed_windows(signal: np.ndarray, starts: np.ndarray, lengths: np.ndarray,
+                      width: int) -> np.ndarray:
+    """Moving average of each beat's search window, NaN past the window's own length."""
+    half = width // 2
+    raw = morphology.beat_matrix(signal, starts, half, int(lengths.max(initial=0)) + half).astype(np.float64)
+    cumulative = np.zeros((raw.shape[0], raw.shape[1] + 1))
+    np.cumsum(raw, axis=1, out=cumulative[:, 1:])
+    smoothed = (cumulative[:, width:] - cumulative[:, :-width]) / width
+    smoothed[np.arange(smoothed.shape[1]) >= lengths[:, None]] = np.nan
+    return smoothed
+
+
+def _qrs_onsets(signal: np.ndarray, r_samples: np.ndarray, window: int) -> np.ndarray:
+    """Last flat sample before the steepest slope in the window before each R peak."""
+    raw = morphology.beat_matrix(signal, r_samples, window, 1)
+    slope = np.abs(np.diff(raw, axis=1))
+    slope = np.where(np.isnan(slope), 0, slope)
+    steepest = np.argmax(slope, axis=1)
+    columns = np.arange(window)
+    flat = (slope < ONSET_SLOPE * slope.max(axis=1, keepdims=True)) & (columns < steepest[:, None])
+    # The onset follows the last flat step, or is the start of the window if there is none
+    last_flat = window - 1 - np.argmax(flat[:, ::-1], axis=1)
+    onset = np.where(flat.any(axis=1), last_flat + 1, 0)
+    found = ~np.isnan(raw).any(axis=1)
+    return np.where(found, r_samples - window + onset, -1)
+
+
+def _wave_peaks(smoothed: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Peak of the wave in each smoothed window.
+
+    The isoelectric level runs in a straight line between the two ends of the
+    window, and the peak is the largest deviation from it, of either polarity.
+    """
+    rows = np.arange(smoothed.shape[0])
+    first = smoothed[:, 0]
+    drift = (smoothed[rows, lengths - 1] - first) / (lengths - 1)
+    deviation = smoothed - (first[:, None] + drift[:, None] * np.arange(smoothed.shape[1]))
+    peak = np.argmax(np.where(np.isnan(deviation), -np.inf, np.abs(deviation)), axis=1)
+    found = np.isfinite(drift) & np.isfinite(deviation[rows, peak])
+    return deviation, peak, found
+
+
+def _tangent_crossings(deviation: np.ndarray, peak: np.ndarray, lengths: np.ndarray, after: bool) -> np.ndarray:
+    """
+    Where the tangent at the steepest slope towards the baseline, after or before
+    each peak, meets the baseline, falling back to the end or start of the window.
+    """
+    rows = np.arange(deviation.shape[0])
+    polarity = np.sign(deviation[rows, peak])
+    slope = np.diff(deviation, axis=1)
+    columns = np.arange(slope.shape[1])
+    if after:
+        steepness = -polarity[:, None] * slope
+        outside = (columns <= peak[:, None]) | (columns >= (lengths - 1)[:, None])
+        lowest, highest, fallback = peak, lengths - 1, lengths - 1
+    else:
+        steepness = polarity[:, None] * slope
+        outside = columns >= peak[:, None]
+        lowest, highest, fallback = np.zeros_like(peak), peak, np.zeros_like(peak)
+    steepness[outside | np.isnan(steepness)] = -np.inf
+    steepest = np.argmax(steepness, axis=1)
+    towards = np.isfinite(steepness[rows, steepest]) & (steepness[rows, steepest] > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        crossing = steepest - deviation[rows, steepest] / slope[rows, steepest]
+    return np.where(towards & np.isfinite(crossing), np.clip(crossing, lowest, highest), fallback)
+
+
+def _length_groups(lengths: np.ndarray, chunk_beats: int) -> Iterator[np.ndarray]:
+    """
+    Indices of the beats in groups of at most chunk_beats with similar window
+    lengths, so one long window cannot widen the arrays of a whole chunk.
+    """
+    order = np.argsort(lengths, kind='stable')
+    for first in range(0, order.shape[0], chunk_beats):
+        yield order[first:first + chunk_beats]
+
+
+def _t_waves(signal: np.ndarray, starts: np.ndarray, lengths: np.ndarray,
+             smoothing: int) -> Tuple[np.ndarray, np.ndarray]:
+    """T peak and T end of a group of beats, from their search windows."""
+    deviation, peak, found = _wave_peaks(_smoothed_windows(signal, starts, lengths, smoothing), lengths)
+    end = _tangent_crossings(deviation, peak, lengths, after=True)
+    t_peak = np.where(found, starts + peak, -1)
+    t_end = np.where(found, starts + np.rint(end).astype(np.int64), -1)
+    return t_peak, t_end
+
+
+def _p_waves(signal: np.ndarray, starts: np.ndarray, lengths: np.ndarray, usable: np.ndarray,
+             smoothing: int) -> Tuple[np.ndarray, np.ndarray]:
+    """P onset and P peak of a group of beats, from their search windows."""
+    deviation, peak, found = _wave_peaks(_smoothed_windows(signal, starts, lengths, smoothing), lengths)
+    onset = _tangent_crossings(deviation, peak, lengths, after=False)
+    found &= usable
+    p_peak = np.where(found, starts + peak, -1)
+    p_onset = np.where(found, starts + np.rint(onset).astype(np.int64), -1)
+    return p_onset, p_peak
+
+
+def qrs_onsets(signal: np.ndarray, r_samples: np.ndarray, fs: float,
+               chunk_beats: int = morphology.BEAT_CHUNK) -> np.ndarray:
+    """
+    Find the QRS onset of every beat with array operations.
+
+    The QRS onset is the last flat sample before the steepest slope in the
+    QRS_ONSET_WINDOW seconds before the R peak. Both delineations need it, so
+    it can be found once and passed to each.
+
+    Args:
+        signal: The signal
+        r_samples: Sorted samples of the R peaks
+        fs: Sampling frequency
+        chunk_beats: Beats per chunk
+
+    Returns:
+        The QRS onset sample of every beat, -1 where not found
+    """
+    r_samples = np.asarray(r_samples, dtype=np.int64)
+    window = max(int(round(QRS_ONSET_WINDOW * fs)), 1)
+    q_onset = np.empty(r_samples.shape[0], dtype=np.int64)
+    for first in range(0, r_samples.shape[0], chunk_beats):
+        chunk = slice(first, first + chunk_beats)
+        q_onset[chunk] = _qrs_onsets(signal, r_samples[chunk], window)
+    return q_onset
+
+
+def delineate_t_waves(signal: np.ndarray, r_samples: np.ndarray, fs: float,
+                      t_window: Tuple[float, float] = T_WINDOW,
+                      chunk_beats: int = morphology.BEAT_CHUNK,
+                      q_onset: Optional[np.ndarray] = None) -> TWaves:
+    """
+    Find the QRS onset, T peak and T end of every beat with array operations.
+
+    The T wave of each beat is searched for between t_window fractions of the
+    following RR interval after its R peak, with the window scaling no further
+    once its end is T_MAX seconds after the R peak, on the signal smoothed over
+    T_SMOOTHING seconds. The isoelectric level is the straight line between the
+    two ends of the window. The T peak is the largest deviation from it, of
+    either polarity, and the T end is where the tangent at the steepest return
+    to it crosses it. The QRS onset is found by qrs_onsets unless given. Beats
+    are processed as (beats x window) arrays of at most chunk_beats beats of
+    similar window length, so memory is bounded whatever the RR intervals and
+    there is no per-beat loop.
+
+    Args:
+        signal: The signal
+        r_samples: Sorted samples of the R peaks
+        fs: Sampling frequency
+        t_window: Start and end of the T wave search window, as fractions of the RR interval
+        chunk_beats: Beats per chunk
+        q_onset: QRS onsets from qrs_onsets, found here if not given
+
+    Returns:
+        The onsets, T peaks and ends of every beat, and their QT and QTc intervals
+    """
+    r_samples = np.asarray(r_samples, dtype=np.int64)
+    following, preceding = _rr_intervals(r_samples)
+    smoothing = max(int(round(T_SMOOTHING * fs)) // 2 * 2 + 1, 1)
+    if q_onset is None:
+        q_onset = qrs_onsets(signal, r_samples, fs, chunk_beats)
+
+    scale = np.minimum(following, T_MAX * fs / t_window[1])
+    starts = r_samples + np.rint(t_window[0] * scale).astype(np.int64)
+    lengths = np.maximum(np.rint((t_window[1] - t_window[0]) * scale).astype(np.int64), 2)
+    t_peak = np.empty(r_samples.shape[0], dtype=np.int64)
+    t_end = np.empty(r_samples.shape[0], dtype=np.int64)
+    for group in _length_groups(lengths, chunk_beats):
+        t_peak[group], t_end[group] = _t_waves(signal, starts[group], lengths[group], smoothing)
+
+    found = (q_onset >= 0) & (t_end >= 0) & (preceding > 0)
+    qt = np.where(found, (t_end - q_onset) / fs * 1000, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Bazett's correction by the preceding RR interval in seconds
+        qtc = qt / np.sqrt(preceding / fs)
+    return TWaves(q_onset=q_onset, t_peak=t_peak, t_end=t_end, qt=qt, qtc=qtc)
+
+
+def delineate_p_waves(signal: np.ndarray, r_samples: np.ndarray, fs: float, p_window: float = P_WINDOW,
+                      chunk_beats: int = morphology.BEAT_CHUNK,
+                      q_onset: Optional[np.ndarray] = None) -> PWaves:
+    """
+    Find the P onset, P peak and PR interval of every beat with array operations.
+
+    The P wave of each beat is searched for only before its QRS, from p_window
+    of the preceding RR interval before the R peak, but no more than P_MAX
+    seconds, up to the QRS onset, on the signal smoothed over P_SMOOTHING
+    seconds, so neither the QRS nor the rest of the recording is scanned. The
+    P peak is the largest deviation from the straight line between the two
+    ends of the window, and the P onset is where the tangent at the steepest
+    slope leading up to the peak crosses that line. Beats are processed as
+    (beats x window) arrays of at most chunk_beats beats of similar window
+    length, so the cost is proportional to the number of beats times the
+    window length and memory is bounded whatever the RR intervals.
+
+    Args:
+        signal: The signal
+        r_samples: Sorted samples of the R peaks
+        fs: Sampling frequency
+        p_window: Start of the P wave search window, as a fraction of the RR interval before the R peak
+        chunk_beats: Beats per chunk
+        q_onset: QRS onsets from qrs_onsets, found here if not given
+
+    Returns:
+        The P onsets and peaks of every beat, and their PR intervals
+    """
+    r_samples = np.asarray(r_samples, dtype=np.int64)
+    _, preceding = _rr_intervals(r_samples)
+    smoothing = max(int(round(P_SMOOTHING * fs)) // 2 * 2 + 1, 1)
+    if q_onset is None:
+        q_onset = qrs_onsets(signal, r_samples, fs, chunk_beats)
+
+    # The window ends at the QRS onset, so no QRS energy is searched
+    ends = np.where(q_onset >= 0, q_onset, r_samples)
+    starts = np.maximum(r_samples - np.rint(p_window * preceding).astype(np.int64),
+                        ends - int(round(P_MAX * fs)))
+    lengths = ends - starts
+    usable = (lengths >= 2) & (q_onset >= 0)
+    lengths = np.maximum(lengths, 2)
+    p_onset = np.empty(r_samples.shape[0], dtype=np.int64)
+    p_peak = np.empty(r_samples.shape[0], dtype=np.int64)
+    for group in _length_groups(lengths, chunk_beats):
+        p_onset[group], p_peak[group] = _p_waves(signal, starts[group], lengths[group], usable[group], smoothing)
+
+    pr = np.where(p_onset >= 0, (q_onset - p_onset) / fs * 1000, np.nan)
+    return PWaves(p_onset=p_onset, p_peak=p_peak, pr=pr)
@@ -1,45 +1,147 @@
 """Wave detection algorithms."""
 import numpy as np
-import time
-from typing import Callable, Any
+from typing import List
+from ..profiling import timer_decorator
+from . import compiled
 
+# Samples summed pairwise before adding to the threshold total, which fixes the
+# summation order so the numpy and compiled backends agree bitwise
+THRESHOLD_BLOCK = 1 << 16
 
-def timer_decorator(func: Callable[..., Any]) -> Callable[..., Any]:
-    """Decorator to time function execution."""
-    def wrapper(*args: Any, **kwargs: Any) -> Any:
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(f"Execution time for {func.__name__}: {execution_time} seconds")
-        return result
-    return wrapper
+
+@timer_decorator
+def threshold_calc(transformed_signal: np.ndarray, lower: float = 0.01, upper: float = 2) -> np.ndarray:
+    """
+    Calculate the threshold for the peak detector.
+
+    Args:
+        transformed_signal: The transformed signal, or a (leads x samples) array of them
+        lower: Values at or below this are ignored
+        upper: Values at or above this are ignored
+
+    Returns:
+        The threshold, one per lead for a 2D array
+    """
+    if compiled.use_compiled():
+        total, count = compiled.threshold_sums(transformed_signal, lower, upper, THRESHOLD_BLOCK)
+        return total / count / 4
+    # Calculate the mean of the transformed signal within the bounds, one block at a time
+    total = np.zeros(transformed_signal.shape[:-1])
+    count = np.zeros(transformed_signal.shape[:-1], dtype=np.int64)
+    for first in range(0, transformed_signal.shape[-1], THRESHOLD_BLOCK):
+        block = transformed_signal[..., first:first + THRESHOLD_BLOCK]
+        mask = (block > lower) & (block < upper)
+        total += np.where(mask, block, np.float64(0)).sum(axis=-1)
+        count += np.count_nonzero(mask, axis=-1)
+    return total / count / 4
+
+
+def _peak_2d(signal: np.ndarray, threshold: np.ndarray, rank_offset: np.ndarray) -> List[np.ndarray]:
+    """
+    Find the peaks of every row of a (leads x samples) array in one pass.
+
+    Gives the same result as peak on each row: runs above the threshold, other
+    than the first and last of each row, are reported at their middle sample.
+
+    Args:
+        signal: The (leads x samples) signals
+        threshold: The threshold of each row
+        rank_offset: The rank offset of each row
+
+    Returns:
+        The peaks of each row
+    """
+    n_rows = signal.shape[0]
+    threshold = np.reshape(threshold, (-1, 1))
+    # Calibrate the signals by pinning a 1 to the start and end of each row,
+    # inside a zero border so run boundaries are differences of int8 flags
+    above = np.zeros((n_rows, signal.shape[1] + 4), dtype=np.int8)
+    np.greater(signal, threshold, out=above[:, 2:-2].view(bool))
+    above[:, 1:2] = above[:, -2:-1] = 1 > threshold
+    # Run boundaries within each row
+    change = np.diff(above, axis=1)
+    rows, starts = np.nonzero(change == 1)
+    ends = np.nonzero(change == -1)[1]
+    lengths = ends - starts
+
+    # Rank of each run's first sample among the samples above the threshold in its row
+    ranks = np.cumsum(lengths) - lengths
+    first = np.ones(rows.shape[0], dtype=bool)
+    first[1:] = rows[1:] != rows[:-1]
+    ranks -= np.repeat(ranks[first], np.diff(np.append(np.flatnonzero(first), rows.shape[0])))
+
+    # The first and last run of each row are not reported
+    last = np.ones(rows.shape[0], dtype=bool)
+    last[:-1] = first[1:]
+    keep = np.flatnonzero(~first & ~last)
+    offset = np.reshape(rank_offset, -1)[rows[keep]] if np.ndim(rank_offset) else rank_offset
+    # Middle of the run, rounded on the rank as peak does; a single sample run can round onto the next run
+    middle = np.rint(0.5 * (2 * ranks[keep] + lengths[keep]) + offset).astype(int) - offset - ranks[keep]
+    positions = np.where(middle < lengths[keep], starts[keep] + middle, starts[keep + 1])
+    F_in = np.column_stack((positions, lengths[keep]))
+
+    return np.split(F_in, np.cumsum(np.bincount(rows[keep], minlength=n_rows))[:-1])
 
 
 @timer_decorator
-def peak(signal: np.ndarray, threshold: float) -> np.ndarray:
+def peak(signal: np.ndarray, threshold: float, rank_offset: int = 0) -> np.ndarray:
     """
     Find the peaks of a signal.
     
     Args:
-        signal: The signal
-        threshold: The threshold
+        signal: The signal, or a (leads x samples) array of signals
+        threshold: The threshold, or one per lead
+        rank_offset: Number of samples above the threshold preceding this signal when it
+            is a slice of a longer one, so peak positions round as they do in the full signal
         
     Returns:
-        The peaks of the signal
+        The peaks of the signal, or a list of the peaks of each lead for a 2D array
     """
-    # Calibrate the signal by pinning a 1 to the start and end of the signal
-    signal = np.concatenate((np.ones(1), signal, np.ones(1)))
-    T = np.flatnonzero(signal > threshold)
+    if compiled.use_compiled():
+        return compiled.peak(signal, threshold, rank_offset)
+    if signal.ndim == 2:
+        return _peak_2d(signal, threshold, rank_offset)
+    # Calibrate the signal by pinning a 1 to the start and end of the signal,
+    # without copying it: positions above the threshold are shifted past the pin
+    pinned = np.flatnonzero([1 > threshold])
+    T = np.concatenate((pinned, np.flatnonzero(signal > threshold) + 1, pinned + signal.shape[0] + 1))
     dT = np.diff(T) - 1
     edges = np.flatnonzero(dT) + 1
     W = np.column_stack((edges[:-1], edges[1:]))
-    WE = np.rint(0.5 * (W[:, 0] + W[:, 1])).astype(int)
+    WE = np.rint(0.5 * (W[:, 0] + W[:, 1]) + rank_offset).astype(int) - rank_offset
     F_in = np.column_stack((T[WE], (np.diff(W)[:, 0])))
 
     return F_in
 
 
+def merge_close_peaks(first: np.ndarray, second: np.ndarray, min_distance: int = 10) -> np.ndarray:
+    """
+    Merge two sets of peaks, dropping peaks closer than min_distance samples to a neighbour.
+
+    Args:
+        first: Peak samples, such as the R peaks
+        second: Peak samples, such as the P peaks
+        min_distance: Peaks closer than this to the peak before or after them are dropped
+
+    Returns:
+        The sorted samples of the peaks that are kept
+    """
+    if compiled.use_compiled():
+        merged = compiled.merge_close_peaks(first, second, min_distance)
+        if merged is not None:
+            return merged
+    # Combine and sort the peaks
+    combined_peaks = np.sort(np.concatenate((first, second)))
+
+    # Identify peaks that are close to the next one
+    close_peaks_indices = np.where(np.diff(combined_peaks) < min_distance)[0]
+
+    # Both peaks of each close pair are dropped
+    refined_peaks_indices = np.sort(np.concatenate((close_peaks_indices, close_peaks_indices + 1)))
+
+    return np.delete(combined_peaks, refined_peaks_indices)
+
+
 def filter_by_width(beat_array: np.ndarray, lower: float, upper: float) -> np.ndarray:
     """
     Filter beats by width.
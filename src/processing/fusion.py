@@ -0,0 +1,70 @@
+"""Reconciling the beats detected on several leads."""
+import numpy as np
+from typing import Optional, Sequence, Tuple
+
+
+def match_nearest(samples: np.ndarray, query: np.ndarray, tolerance: int) -> np.ndarray:
+    """
+    Find the beat nearest each query position, by binary search.
+
+    Args:
+        samples: Sorted beat samples
+        query: Positions to match
+        tolerance: Largest distance of a match in samples
+
+    Returns:
+        Index of the nearest beat for each query, or -1 where none is within tolerance;
+        ties go to the earlier beat
+    """
+    matched = np.full(query.shape[0], -1, dtype=np.int64)
+    if samples.shape[0] == 0:
+        return matched
+    right = np.minimum(np.searchsorted(samples, query), samples.shape[0] - 1)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(query - samples[left] <= samples[right] - query, left, right)
+    close = np.abs(samples[nearest] - query) <= tolerance
+    matched[close] = nearest[close]
+    return matched
+
+
+def fuse_beats(beats: Sequence[np.ndarray], tolerance: int,
+               min_leads: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge the beats of several leads into one consensus beat list.
+
+    The beats of all leads are merged in sorted order and split wherever two
+    neighbours are more than tolerance apart, so each group holds the detections
+    of one beat; the tolerance must be well below the shortest RR interval. A
+    beat sits at the median of its group, and each lead is matched to it by
+    binary search, so the cost is O(N log N) in the total number of detections.
+
+    Args:
+        beats: Sorted beat samples of each lead
+        tolerance: Largest distance in samples between detections of the same beat
+        min_leads: Leads that must agree on a beat for it to be kept, defaults to a majority
+
+    Returns:
+        samples: Sample of each consensus beat
+        agreement: Number of leads with a detection within tolerance of each beat
+        matched: (beats x leads) index of each lead's matching beat, or -1
+    """
+    beats = [np.asarray(lead_beats, dtype=np.int64) for lead_beats in beats]
+    if min_leads is None:
+        min_leads = len(beats) // 2 + 1
+    merged = np.sort(np.concatenate(beats)) if beats else np.empty(0, dtype=np.int64)
+    if merged.shape[0] == 0:
+        return merged, np.empty(0, dtype=np.int64), np.empty((0, len(beats)), dtype=np.int64)
+
+    # Groups of detections start where the gap to the previous one exceeds the tolerance
+    new_group = np.empty(merged.shape[0], dtype=bool)
+    new_group[0] = True
+    np.greater(np.diff(merged), tolerance, out=new_group[1:])
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, merged.shape[0]))
+    # Lower median of each group, which is sorted
+    samples = merged[starts + (counts - 1) // 2]
+
+    matched = np.column_stack([match_nearest(lead_beats, samples, tolerance) for lead_beats in beats])
+    agreement = np.count_nonzero(matched >= 0, axis=1)
+    keep = agreement >= min_leads
+    return samples[keep], agreement[keep], matched[keep]
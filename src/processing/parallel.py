@@ -0,0 +1,265 @@
+"""Chunked R peak detection spread over threads or processes."""
+import concurrent.futures
+import contextlib
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple, Union
+import numpy as np
+from numpy.typing import DTypeLike
+from .chunking import chunk_bounds
+from .detectors import peak
+
+# Ways of running the tasks of one recording
+EXECUTORS = ('serial', 'threads', 'processes')
+# Samples owned by each task when the leads are not already chunked
+PARALLEL_CHUNK = 1 << 20
+
+Executor = Union[str, concurrent.futures.Executor, None]
+
+
+class _SharedBuffer:
+    """
+    Exposes a shared memory block to numpy and keeps it open while any array uses it.
+
+    Arrays built from it hold it as their base, so the block is closed, and
+    unlinked by the process that created it, only once the last view is gone.
+    """
+
+    def __init__(self, memory: SharedMemory, shape: Tuple[int, ...], dtype: np.dtype, owner: bool) -> None:
+        self.memory = memory
+        self.owner = owner
+        # The address is read through a temporary view, which is released straight away
+        address = np.frombuffer(memory.buf, dtype=np.uint8).ctypes.data
+        self.__array_interface__ = {'shape': shape, 'typestr': dtype.str, 'data': (address, False), 'version': 3}
+
+    def __del__(self) -> None:
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+@dataclass(frozen=True)
+class SharedHandle:
+    """A picklable reference to an array in shared memory."""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    @contextlib.contextmanager
+    def attach(self) -> Iterator[np.ndarray]:
+        """
+        Attach to the array for the duration of a task.
+
+        The segment is closed on exit, so a long-lived worker holds no mapping
+        of recordings it has finished with; nothing read from the array may be
+        kept past the block without a copy.
+        """
+        memory = SharedMemory(name=self.name)
+        try:
+            yield np.asarray(_SharedBuffer(memory, self.shape, np.dtype(self.dtype), owner=False))
+        finally:
+            memory.close()
+
+
+def shared_empty(shape: Tuple[int, ...], dtype: DTypeLike = np.float64) -> np.ndarray:
+    """
+    Allocate an array in shared memory, which workers open by name instead of copying.
+
+    Args:
+        shape: Shape of the array
+        dtype: Type of the array
+
+    Returns:
+        The uninitialised array; the memory is released when it and its views are gone
+    """
+    dtype = np.dtype(dtype)
+    memory = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    return np.asarray(_SharedBuffer(memory, tuple(shape), dtype, owner=True))
+
+
+def share(array: np.ndarray) -> Tuple[SharedHandle, np.ndarray]:
+    """
+    Get a handle on an array in shared memory, copying it there only if it is not already.
+
+    Args:
+        array: The array
+
+    Returns:
+        The handle, and the shared array, which must be kept alive while the handle is used
+    """
+    base = array.base
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if (isinstance(base, _SharedBuffer) and array.flags.c_contiguous
+            and array.__array_interface__['data'][0] == base.__array_interface__['data'][0]):
+        return SharedHandle(base.memory.name, array.shape, array.dtype.str), array
+    shared = shared_empty(array.shape, array.dtype)
+    shared[...] = array
+    return share(shared)
+
+
+@contextlib.contextmanager
+def pool(executor: Executor = 'threads', workers: Optional[int] = None) -> Iterator[Optional[concurrent.futures.Executor]]:
+    """
+    Open the executor tasks are submitted to.
+
+    Args:
+        executor: One of EXECUTORS, or an executor that is already open and is left open
+        workers: Number of threads or processes, defaults to the number of CPUs
+
+    Returns:
+        The executor, or None to run tasks in the calling thread
+    """
+    if executor is None or isinstance(executor, concurrent.futures.Executor):
+        yield executor
+    elif executor == 'serial':
+        yield None
+    elif executor == 'threads':
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as threads:
+            yield threads
+    elif executor == 'processes':
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as processes:
+            yield processes
+    else:
+        raise ValueError(f'Unknown executor {executor!r}, expected one of {EXECUTORS}')
+
+
+def _run(func: Callable[..., Any], tasks: Sequence[Tuple[Any, ...]],
+         executor: Optional[concurrent.futures.Executor]) -> List[Any]:
+    """Run func on each task's arguments, returning the results in task order."""
+    if executor is None:
+        return [func(*task) for task in tasks]
+    futures = [executor.submit(func, *task) for task in tasks]
+    return [future.result() for future in futures]
+
+
+def _source(signals: np.ndarray, executor: Optional[concurrent.futures.Executor]) -> Tuple[Any, np.ndarray]:
+    """What tasks read the signals from: a shared memory handle for processes, the array otherwise."""
+    rows = np.reshape(signals, (-1, signals.shape[-1]))
+    if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+        return share(rows)
+    return rows, rows
+
+
+@contextlib.contextmanager
+def _attached(source: Union[np.ndarray, SharedHandle]) -> Iterator[np.ndarray]:
+    """The (leads x samples) signals a task reads, attached from shared memory for the task if needed."""
+    if isinstance(source, SharedHandle):
+        with source.attach() as signals:
+            yield signals
+    else:
+        yield source
+
+
+def _threshold_task(source: Union[np.ndarray, SharedHandle], row: int, bounds: Tuple[int, int, int, int],
+                    transform: Callable[[np.ndarray], np.ndarray], lower: float, upper: float) -> Tuple[float, int]:
+    """Sum and count of one chunk's transformed values within the bounds."""
+    start, stop, ext_start, ext_stop = bounds
+    with _attached(source) as signals:
+        transformed = transform(signals[row, ext_start:ext_stop])[start - ext_start:stop - ext_start]
+        mask = (transformed > lower) & (transformed < upper)
+        return np.where(mask, transformed, 0).sum(), np.count_nonzero(mask)
+
+
+def _peak_task(source: Union[np.ndarray, SharedHandle], row: int, bounds: Tuple[int, int, int, int],
+               transform: Callable[[np.ndarray], np.ndarray],
+               threshold: float) -> Tuple[int, int, List[np.ndarray]]:
+    """
+    Peaks of one chunk, for an even and an odd rank offset.
+
+    The rank offset only changes how the middle of a run rounds, and only by its
+    parity, so both candidates are found before the offset is known.
+    """
+    start, stop, ext_start, ext_stop = bounds
+    with _attached(source) as signals:
+        transformed = transform(signals[row, ext_start:ext_stop])
+        above = transformed > threshold
+        leading = np.count_nonzero(above[:start - ext_start])
+        owned = np.count_nonzero(above[start - ext_start:stop - ext_start])
+        candidates = []
+        for parity in (0, 1):
+            found = peak(signal=transformed, threshold=threshold, rank_offset=parity)
+            found[:, 0] += ext_start
+            candidates.append(found[(found[:, 0] >= start) & (found[:, 0] < stop)])
+    return leading, owned, candidates
+
+
+def parallel_threshold(signals: np.ndarray, transform: Callable[[np.ndarray], np.ndarray],
+                       chunk_size: int, overlap: int, lower: float = 0.01, upper: float = 2,
+                       executor: Executor = 'threads', workers: Optional[int] = None) -> np.ndarray:
+    """
+    Calculate the peak detector threshold of each lead, one task per lead and chunk.
+
+    Gives the same result as chunking.chunked_threshold.
+
+    Args:
+        signals: The signal, or a (leads x samples) array of signals
+        transform: Picklable function mapping a slice of a signal to its transformed values
+        chunk_size: Number of samples owned by each task
+        overlap: Number of extra samples read on either side of a chunk
+        lower: Values at or below this are ignored
+        upper: Values at or above this are ignored
+        executor: One of EXECUTORS, or an open executor
+        workers: Number of threads or processes, defaults to the number of CPUs
+
+    Returns:
+        The threshold, one per lead for a 2D array
+    """
+    bounds = list(chunk_bounds(signals.shape[-1], chunk_size, overlap))
+    with pool(executor, workers) as opened:
+        source, rows = _source(signals, opened)
+        tasks = [(source, row, chunk, transform, lower, upper) for row in range(rows.shape[0]) for chunk in bounds]
+        results = iter(_run(_threshold_task, tasks, opened))
+    total = np.zeros(rows.shape[0])
+    count = np.zeros(rows.shape[0], dtype=np.int64)
+    # Chunks are added in order, as chunked_threshold adds them
+    for row in range(rows.shape[0]):
+        for _ in bounds:
+            chunk_total, chunk_count = next(results)
+            total[row] += chunk_total
+            count[row] += chunk_count
+    return (total / count / 4).reshape(signals.shape[:-1])
+
+
+def parallel_peak(signals: np.ndarray, transform: Callable[[np.ndarray], np.ndarray],
+                  threshold: Union[float, np.ndarray], chunk_size: int, overlap: int,
+                  executor: Executor = 'threads',
+                  workers: Optional[int] = None) -> Union[np.ndarray, List[np.ndarray]]:
+    """
+    Find the peaks of each lead, one task per lead and chunk.
+
+    Gives the same result as chunking.chunked_peak. With processes, the signals
+    are placed in shared memory, unless they are already there, and workers
+    read their chunks from it rather than receiving a copy.
+
+    Args:
+        signals: The signal, or a (leads x samples) array of signals
+        transform: Picklable function mapping a slice of a signal to its transformed values
+        threshold: The threshold, or one per lead
+        chunk_size: Number of samples owned by each task
+        overlap: Number of extra samples read on either side of a chunk
+        executor: One of EXECUTORS, or an open executor
+        workers: Number of threads or processes, defaults to the number of CPUs
+
+    Returns:
+        The peaks of the signal as returned by detectors.peak, or a list of the
+        peaks of each lead for a 2D array
+    """
+    bounds = list(chunk_bounds(signals.shape[-1], chunk_size, overlap))
+    with pool(executor, workers) as opened:
+        source, rows = _source(signals, opened)
+        thresholds = np.broadcast_to(np.reshape(threshold, -1), rows.shape[:1])
+        tasks = [(source, row, chunk, transform, float(thresholds[row]))
+                 for row in range(rows.shape[0]) for chunk in bounds]
+        results = iter(_run(_peak_task, tasks, opened))
+    peaks = []
+    for _ in range(rows.shape[0]):
+        # Samples above the threshold before the current chunk
+        preceding = 0
+        found = []
+        for _ in bounds:
+            leading, owned, candidates = next(results)
+            found.append(candidates[(preceding - leading) % 2])
+            preceding += owned
+        peaks.append(np.concatenate(found) if found else np.empty((0, 2), dtype=int))
+    return peaks if signals.ndim == 2 else peaks[0]
@@ -0,0 +1,97 @@
+"""Chunked time-frequency analysis of long recordings."""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal as si
+from typing import Optional, Tuple, Union
+
+# Number of samples transformed per chunk
+SPECTROGRAM_CHUNK = int(1e6)
+
+
+def spectrogram_bins(n_samples: int, fs: float, nperseg: int = 256, noverlap: Optional[int] = None,
+                     band: Optional[Tuple[float, float]] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Frequency and time bins of a spectrogram, without computing it.
+
+    Args:
+        n_samples: Length of the signal
+        fs: Sampling frequency
+        nperseg: Length of each segment
+        noverlap: Overlap between segments, defaults to an eighth of a segment as in scipy
+        band: (low, high) frequencies in Hz to keep, inclusive, or None for all
+
+    Returns:
+        frequencies: Frequencies of the kept bins
+        times: Centre of each segment in seconds
+        keep: Indices of the kept bins within the full one-sided spectrum
+    """
+    noverlap = nperseg // 8 if noverlap is None else noverlap
+    if not 0 <= noverlap < nperseg:
+        raise ValueError('noverlap must be at least 0 and less than nperseg')
+    hop = nperseg - noverlap
+    n_frames = max((n_samples - nperseg) // hop + 1, 0)
+    frequencies = np.fft.rfftfreq(nperseg, 1 / fs)
+    keep = np.arange(frequencies.shape[0])
+    if band is not None:
+        keep = np.flatnonzero((frequencies >= band[0]) & (frequencies <= band[1]))
+    times = (np.arange(n_frames) * hop + nperseg / 2) / fs
+    return frequencies[keep], times, keep
+
+
+def chunked_spectrogram(signal: np.ndarray, fs: float, nperseg: int = 256, noverlap: Optional[int] = None,
+                        window: Union[str, Tuple] = ('tukey', 0.25), band: Optional[Tuple[float, float]] = None,
+                        chunk_size: int = SPECTROGRAM_CHUNK, out: Optional[str] = None,
+                        dtype: type = np.float32) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Power spectral density spectrogram of a signal, computed one chunk at a time.
+
+    Matches scipy.signal.spectrogram given the same window, scipy's Tukey
+    window with a shape parameter of 0.25 by default, with detrend='constant',
+    scaling='density' and mode='psd', but only holds one chunk of segments in
+    memory, keeps only the bins within band, and stores the power as dtype, in
+    memory or in an .npy file opened as a memory map.
+
+    Args:
+        signal: The signal, which may itself be a memory map
+        fs: Sampling frequency
+        nperseg: Length of each segment
+        noverlap: Overlap between segments, defaults to an eighth of a segment as in scipy
+        window: Window applied to each segment, as understood by scipy.signal.get_window
+        band: (low, high) frequencies in Hz to keep, inclusive, or None for all
+        chunk_size: Approximate number of samples transformed per chunk
+        out: Path of an .npy file to write the power to, or None to keep it in memory
+        dtype: Floating point type of the power
+
+    Returns:
+        frequencies: Frequencies of the kept bins
+        times: Centre of each segment in seconds
+        power: (frequencies x times) power spectral density
+    """
+    frequencies, times, keep = spectrogram_bins(signal.shape[0], fs, nperseg, noverlap, band)
+    hop = nperseg - (nperseg // 8 if noverlap is None else noverlap)
+    n_frames = times.shape[0]
+    shape = (frequencies.shape[0], n_frames)
+    if out is not None:
+        power = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+    else:
+        power = np.empty(shape, dtype=dtype)
+
+    taper = si.get_window(window, nperseg)
+    scale = np.full(nperseg // 2 + 1, 2 / (fs * (taper ** 2).sum()))
+    # The DC and Nyquist bins are not doubled in the one-sided spectrum
+    scale[0] /= 2
+    if nperseg % 2 == 0:
+        scale[-1] /= 2
+    scale = scale[keep, None]
+
+    frames_per_chunk = max(chunk_size // hop, 1)
+    for first in range(0, n_frames, frames_per_chunk):
+        last = min(first + frames_per_chunk, n_frames)
+        chunk = np.asarray(signal[first * hop:(last - 1) * hop + nperseg], dtype=np.float64)
+        segments = sliding_window_view(chunk, nperseg)[::hop]
+        segments = (segments - segments.mean(axis=-1, keepdims=True)) * taper
+        spectrum = np.fft.rfft(segments, axis=-1)[:, keep].T
+        power[:, first:last] = (spectrum.real ** 2 + spectrum.imag ** 2) * scale
+    if out is not None:
+        power.flush()
+    return frequencies, times, power
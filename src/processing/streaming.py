@@ -0,0 +1,149 @@
+"""Incremental R peak detection on live signals."""
+import numpy as np
+from scipy import signal as si
+from typing import Optional
+
+
+class StreamingRDetector:
+    """
+    Push-based R peak detector for signals that arrive in blocks and never end.
+
+    Samples are transformed as in grad_square_conv with a boxcar window, and a
+    run of the transformed signal above the threshold is reported at its middle
+    sample once it ends, as peak does. The transform and run state are kept
+    between calls, so splitting the signal into blocks does not change the result.
+
+    The threshold adapts: it is a quarter of the exponentially weighted mean of
+    the transformed values within (lower, upper), with a time constant of
+    threshold_window seconds, where threshold_calc takes the mean over the whole
+    signal. No peaks are reported during the first warmup seconds.
+
+    A peak is reported after at most `latency` samples, counted from its
+    position to the sample that completes it. That is half the longest run plus
+    the transform delay, since a run is reported on its first sample below the
+    threshold. Runs longer than max_width seconds (lead off, saturation) are
+    dropped rather than reported, which bounds the wait. Blocks add their own
+    buffering on top, up to one block less a sample, as the peak is returned by
+    the push holding the completing sample.
+
+    Example:
+        detector = StreamingRDetector(fs=180)
+        for block in feed:
+            for position, width in detector.push(block):
+                ...
+    """
+
+    def __init__(self, fs: float, threshold_window: float = 10, warmup: float = 2,
+                 max_width: float = 0.5, lower: float = 0.01, upper: float = 2,
+                 preprocessed: bool = False) -> None:
+        """
+        Args:
+            fs: Sampling frequency
+            threshold_window: Time constant of the adaptive threshold in seconds
+            warmup: Seconds of signal before peaks are reported
+            max_width: Longest run above the threshold reported as a peak, in seconds
+            lower: Transformed values at or below this are ignored by the threshold
+            upper: Transformed values at or above this are ignored by the threshold
+            preprocessed: Whether samples are already scaled as ECGLead.signal is;
+                otherwise they are divided by 1000 as they arrive
+        """
+        self.fs = fs
+        self.window_length = int(fs / 5)
+        if self.window_length < 1:
+            raise ValueError('fs must be at least 5 Hz')
+        self.max_width = int(max_width * fs)
+        self.warmup = int(warmup * fs)
+        self.lower = lower
+        self.upper = upper
+        self.scale = 1 if preprocessed else 1 / 1000
+        # Weight of the previous threshold state per sample
+        self.decay = np.exp(-1 / (threshold_window * fs))
+        # Offset of the running sum's window relative to grad_square_conv's centred window
+        self._centre = self.window_length - (self.window_length - 1) // 2 - 1
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all samples pushed so far."""
+        self.n_samples = 0
+        self._last: Optional[float] = None
+        self._tail = np.empty(0)
+        # Exponentially weighted sum and count of the values within the bounds
+        self._total = 0.0
+        self._count = 0.0
+        # Start of the run above the threshold at the end of the last block, if any;
+        # the stream starts in a run that is never reported, as peak drops the first run
+        self._run_start: Optional[int] = -1
+
+    @property
+    def latency(self) -> int:
+        """Worst-case delay in samples between an R peak and the push that reports it."""
+        return -(-self.max_width // 2) + (self.window_length - 1) // 2
+
+    @property
+    def latency_seconds(self) -> float:
+        """Worst-case delay in seconds between an R peak and the push that reports it."""
+        return self.latency / self.fs
+
+    def _transform(self, samples: np.ndarray) -> np.ndarray:
+        """Continue the transformed signal with a block of samples."""
+        samples = np.asarray(samples, dtype=np.float64) * self.scale
+        if self._last is not None:
+            samples = np.concatenate(([self._last], samples))
+        if samples.shape[0] == 0:
+            return samples
+        self._last = samples[-1]
+        gradient_squared = np.concatenate((self._tail, np.diff(samples) ** 2))
+        if gradient_squared.shape[0] < self.window_length:
+            self._tail = gradient_squared
+            return np.empty(0)
+        self._tail = gradient_squared[gradient_squared.shape[0] - self.window_length + 1:]
+        cumulative = np.concatenate(([0], np.cumsum(gradient_squared)))
+        return cumulative[self.window_length:] - cumulative[:-self.window_length]
+
+    def _threshold(self, transformed: np.ndarray) -> np.ndarray:
+        """Update the adaptive threshold, returning its value at each transformed sample."""
+        mask = (transformed > self.lower) & (transformed < self.upper)
+        feedback = [1, -self.decay]
+        total, (self._total,) = si.lfilter([1], feedback, np.where(mask, transformed, 0),
+                                           zi=[self.decay * self._total])
+        count, (self._count,) = si.lfilter([1], feedback, mask.astype(np.float64),
+                                           zi=[self.decay * self._count])
+        self._total /= self.decay
+        self._count /= self.decay
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / count / 4
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Process a block of samples.
+
+        Args:
+            samples: The next samples of the signal, of any length
+
+        Returns:
+            The R peaks completed by this block as (position, width) rows, with
+            positions in the sample coordinates of ECGLead.r_peaks
+        """
+        transformed = self._transform(samples)
+        self.n_samples += np.shape(samples)[0]
+        if transformed.shape[0] == 0:
+            return np.empty((0, 2), dtype=int)
+        # Index of the first transformed sample of this block in grad_square_conv's output
+        first = self.n_samples - transformed.shape[0] - self.window_length + self._centre
+
+        above = transformed > self._threshold(transformed)
+        change = np.diff(above.astype(np.int8), prepend=np.int8(self._run_start is not None))
+        starts = np.flatnonzero(change == 1) + first
+        ends = np.flatnonzero(change == -1) + first
+        if self._run_start is not None:
+            starts = np.concatenate(([self._run_start], starts))
+        # A run still above the threshold at the end of the block carries over
+        self._run_start = None
+        if starts.shape[0] > ends.shape[0]:
+            self._run_start = int(starts[-1])
+            starts = starts[:-1]
+
+        widths = ends - starts
+        keep = (widths <= self.max_width) & (starts >= self.warmup)
+        # Positions are shifted by one, as peak reports them on the padded signal
+        return np.column_stack((starts[keep] + widths[keep] // 2 + 1, widths[keep]))
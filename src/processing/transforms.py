@@ -1,35 +1,106 @@
 """Signal transformation functions."""
 import numpy as np
 from scipy import signal as si
-import time
-from typing import Callable, Any
+from typing import Optional
+from ..profiling import timer_decorator
 
+# Engines available to grad_square_conv
+ENGINES = ('auto', 'direct', 'cumsum', 'fft')
+# Window lengths from which the running sum beats direct correlation of a boxcar
+CUMSUM_MIN_WINDOW = 16
+# Window lengths from which overlap-add beats direct correlation of a sin window, for a single float64 signal
+FFT_MIN_WINDOW = 160
+# Samples accumulated per block when the running sum converts to float64
+CUMSUM_BLOCK = 1 << 16
 
-def timer_decorator(func: Callable[..., Any]) -> Callable[..., Any]:
-    """Decorator to time function execution."""
-    def wrapper(*args: Any, **kwargs: Any) -> Any:
-        start_time = time.time()
-        result = func(*args, **kwargs)
-        end_time = time.time()
-        execution_time = end_time - start_time
-        print(f"Execution time for {func.__name__}: {execution_time} seconds")
-        return result
-    return wrapper
+
+def _running_sum(X: np.ndarray, window_length: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Correlate a signal with a window of ones using a cumulative sum.
+
+    Matches scipy.signal.correlate(X, np.ones(window_length), mode='same') in O(N),
+    along the last axis. The cumulative sum is kept in float64 whatever the
+    signal's dtype, so long float32 signals do not lose precision.
+
+    Args:
+        X: The signal, or a (leads x samples) array of signals
+        window_length: The length of the window
+        out: Array to write the result to, which may be X itself
+
+    Returns:
+        The running sum of the signal
+    """
+    n = X.shape[-1]
+    # Cumulative sum of the signal zero padded either side, which reproduces
+    # the edges of the full correlation, without building the padded signal
+    cumulative = np.empty(X.shape[:-1] + (n + 2 * window_length + 1,))
+    cumulative[..., :window_length + 1] = 0
+    body = cumulative[..., window_length + 1:window_length + 1 + n]
+    if X.dtype == np.float64:
+        np.cumsum(X, axis=-1, out=body)
+    else:
+        # Accumulate block by block so X is never converted to float64 in full
+        total = np.zeros(X.shape[:-1] + (1,))
+        for first in range(0, n, CUMSUM_BLOCK):
+            block = body[..., first:first + CUMSUM_BLOCK]
+            np.cumsum(X[..., first:first + CUMSUM_BLOCK], axis=-1, dtype=np.float64, out=block)
+            block += total
+            total = block[..., -1:]
+    cumulative[..., window_length + 1 + n:] = cumulative[..., window_length + n:window_length + n + 1]
+    # Offset of the 'same' output within the full correlation
+    start = (window_length - 1) // 2 + 1
+    return np.subtract(cumulative[..., start + window_length:start + window_length + n],
+                       cumulative[..., start:start + n], out=out)
+
+
+def _select_engine(X: np.ndarray, window_length: int, sin_wave: bool) -> str:
+    """
+    Pick the fastest engine for grad_square_conv.
+
+    Args:
+        X: The signal, or a (leads x samples) array of signals
+        window_length: The length of the window
+        sin_wave: Flag to indicate whether the window is a sin wave
+
+    Returns:
+        The engine name
+    """
+    if X.shape[-1] <= window_length:
+        return 'direct'
+    if sin_wave:
+        # Direct correlation is only fast for a single float64 signal; otherwise overlap-add wins at any length
+        if X.ndim > 1 or X.dtype != np.float64:
+            return 'fft'
+        return 'fft' if window_length >= FFT_MIN_WINDOW else 'direct'
+    return 'cumsum' if window_length >= CUMSUM_MIN_WINDOW else 'direct'
 
 
 @timer_decorator
-def grad_square_conv(X: np.ndarray, freq: int = 125, sin_wave: bool = False) -> np.ndarray:
+def grad_square_conv(X: np.ndarray, freq: int = 125, sin_wave: bool = False,
+                     engine: str = 'auto') -> np.ndarray:
     """
     Transform the signal to find the peaks.
 
+    A (leads x samples) array transforms every lead in one pass.
+
     Args:
-        X: The signal
+        X: The signal, or a (leads x samples) array of signals
         freq: The frequency of the signal
         sin_wave: Flag to indicate whether to create a sin wave
+        engine: How to correlate with the window; 'direct', 'cumsum' (running sum,
+            boxcar window only), 'fft' (overlap-add) or 'auto' to pick the fastest
+            for the signal and window; at 180 and 513 Hz that is the running sum
+            for the boxcar window, and overlap-add for the sin window unless the
+            signal is a single float64 lead
 
     Returns:
         The transformed signal
     """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown engine {engine!r}, expected one of {ENGINES}')
+    if engine == 'cumsum' and sin_wave:
+        raise ValueError("The 'cumsum' engine only supports the boxcar window")
+
     # Window length is the size of the correlation sliding window
     window_length = int(freq / 5)
 
@@ -41,10 +112,24 @@ def grad_square_conv(X: np.ndarray, freq: int = 125, sin_wave: bool = False) ->
         # Create a sliding window of ones
         sliding = np.ones(window_length)
 
-    # Perform differentiation & squaring, as per Pan-Tompkins
-    gradient_squared = (np.diff(X)) ** 2
+    # Perform differentiation & squaring, as per Pan-Tompkins, squaring in place
+    gradient_squared = np.diff(X)
+    np.square(gradient_squared, out=gradient_squared)
+    sliding = sliding.astype(gradient_squared.dtype)
+    if engine == 'auto':
+        engine = _select_engine(gradient_squared, window_length, sin_wave)
     # Perform the correlation of transformed peak signal with the sliding window
-    window = si.correlate(gradient_squared, sliding, mode='same', method='direct')
+    if engine == 'cumsum':
+        # The gradient is not needed afterwards, so the result reuses its buffer
+        window = _running_sum(gradient_squared, window_length, out=gradient_squared)
+    else:
+        # Match the window's dimensions to the signal's, correlating along the last axis
+        sliding = sliding.reshape((1,) * (gradient_squared.ndim - 1) + (-1,))
+        if engine == 'fft':
+            # Correlation is convolution with the reversed window
+            window = si.oaconvolve(gradient_squared, sliding[..., ::-1], mode='same', axes=-1)
+        else:
+            window = si.correlate(gradient_squared, sliding, mode='same', method='direct')
 
     return window
 
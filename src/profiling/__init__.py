@@ -0,0 +1,9 @@
+"""Pipeline instrumentation."""
+from .registry import (
+    Registry, StageStats, REGISTRY, collect, enable, disable, is_enabled, timer, timer_decorator
+)
+
+__all__ = [
+    'Registry', 'StageStats', 'REGISTRY', 'collect', 'enable', 'disable', 'is_enabled',
+    'timer', 'timer_decorator'
+]
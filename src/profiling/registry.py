@@ -0,0 +1,266 @@
+"""
+Per-stage timing and memory registry.
+
+Instrumentation is off by default and costs a single flag check per call.
+Turn it on globally with enable(), or for one recording or batch with collect():
+
+    with profiling.collect(memory=True) as registry:
+        ECGData(file_path).lead_1.r_peaks
+    print(registry.table())
+"""
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+
+class StageStats:
+    """Durations and peak memory deltas recorded for one stage."""
+
+    def __init__(self) -> None:
+        self.durations: List[int] = []
+        self.memory: List[int] = []
+
+    @property
+    def count(self) -> int:
+        """Number of recorded calls."""
+        return len(self.durations)
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Summarise the recorded calls.
+
+        Returns:
+            Call count, total, mean, percentile and maximum durations in ms, and the
+            largest peak memory delta in bytes when memory was traced
+        """
+        durations = np.array(self.durations) / 1e6
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        summary = {
+            'count': self.count,
+            'total_ms': durations.sum(),
+            'mean_ms': durations.mean(),
+            'p50_ms': p50,
+            'p90_ms': p90,
+            'p99_ms': p99,
+            'max_ms': durations.max(),
+        }
+        if self.memory:
+            summary['peak_memory'] = max(self.memory)
+        return summary
+
+
+class Registry:
+    """Collects the timings of each instrumented stage."""
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        """Drop the lock so a registry can be returned from a worker process."""
+        return {'stages': self.stages}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Restore a registry returned from a worker process."""
+        self.stages = state['stages']
+        self._lock = threading.Lock()
+
+    def record(self, name: str, duration: int, memory: Optional[int] = None) -> None:
+        """
+        Record one call of a stage.
+
+        Args:
+            name: Name of the stage
+            duration: Duration of the call in ns
+            memory: Peak memory allocated during the call in bytes, if traced
+        """
+        with self._lock:
+            stats = self.stages.setdefault(name, StageStats())
+            stats.durations.append(duration)
+            if memory is not None:
+                stats.memory.append(memory)
+
+    def merge(self, other: 'Registry') -> None:
+        """
+        Add the calls recorded by another registry, such as one from a worker process.
+
+        Args:
+            other: The registry to merge
+        """
+        with self._lock:
+            for name, other_stats in other.stages.items():
+                stats = self.stages.setdefault(name, StageStats())
+                stats.durations.extend(other_stats.durations)
+                stats.memory.extend(other_stats.memory)
+
+    def reset(self) -> None:
+        """Discard all recorded calls."""
+        with self._lock:
+            self.stages.clear()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Summarise every stage.
+
+        Returns:
+            StageStats.summary of each stage, keyed by stage name
+        """
+        return {name: stats.summary() for name, stats in sorted(self.stages.items())}
+
+    def to_json(self, path: Optional[str] = None) -> str:
+        """
+        Export the summary as JSON.
+
+        Args:
+            path: File to write the JSON to, if given
+
+        Returns:
+            The JSON summary
+        """
+        text = json.dumps({name: {key: np.asarray(value).item() for key, value in stats.items()}
+                           for name, stats in self.summary().items()}, indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def table(self) -> str:
+        """
+        Format the summary as a text table, slowest stage first.
+
+        Returns:
+            The table
+        """
+        summary = sorted(self.summary().items(), key=lambda item: -item[1]['total_ms'])
+        columns = ['count', 'total_ms', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms']
+        if any('peak_memory' in stats for _, stats in summary):
+            columns.append('peak_memory')
+        width = max([len('stage')] + [len(name) for name, _ in summary])
+        lines = [f'{"stage":<{width}}' + ''.join(f'{column:>13}' for column in columns)]
+        for name, stats in summary:
+            cells = [f'{stats[column]:>13.3f}' if column.endswith('_ms')
+                     else f'{stats.get(column, ""):>13}' for column in columns]
+            lines.append(f'{name:<{width}}' + ''.join(cells))
+        return '\n'.join(lines)
+
+
+class _State:
+    """Whether instrumentation is on, and where calls are recorded."""
+    enabled = False
+    memory = False
+    started_tracing = False
+    registry: Registry
+
+
+# Registry used when no collect() block is active
+REGISTRY = Registry()
+_state = _State()
+_state.registry = REGISTRY
+# Peak memory seen by each enclosing timer of the current thread
+_local = threading.local()
+
+
+def enable(memory: bool = False) -> None:
+    """
+    Turn instrumentation on.
+
+    Args:
+        memory: Also record the peak memory allocated by each stage, using tracemalloc
+    """
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _state.started_tracing = True
+    _state.memory = memory
+    _state.enabled = True
+
+
+def disable() -> None:
+    """Turn instrumentation off."""
+    _state.enabled = False
+    _state.memory = False
+    if _state.started_tracing:
+        tracemalloc.stop()
+        _state.started_tracing = False
+
+
+def is_enabled() -> bool:
+    """Check whether instrumentation is on."""
+    return _state.enabled
+
+
+@contextmanager
+def collect(memory: bool = False) -> Iterator[Registry]:
+    """
+    Record the calls made within a block into a fresh registry.
+
+    Args:
+        memory: Also record the peak memory allocated by each stage
+
+    Returns:
+        The registry, filled as the block runs
+    """
+    previous = (_state.enabled, _state.memory, _state.registry)
+    tracing = tracemalloc.is_tracing()
+    registry = Registry()
+    enable(memory)
+    _state.registry = registry
+    try:
+        yield registry
+    finally:
+        if memory and not tracing:
+            tracemalloc.stop()
+            _state.started_tracing = False
+        _state.enabled, _state.memory, _state.registry = previous
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    """
+    Time a block as a stage.
+
+    Args:
+        name: Name of the stage
+    """
+    if not _state.enabled:
+        yield
+        return
+    registry = _state.registry
+    memory = _state.memory and tracemalloc.is_tracing()
+    if memory:
+        stack = _local.__dict__.setdefault('stack', [])
+        current, peak = tracemalloc.get_traced_memory()
+        # Keep the enclosing timer's peak before resetting it for this block
+        if stack:
+            stack[-1] = max(stack[-1], peak)
+        tracemalloc.reset_peak()
+        stack.append(current)
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter_ns() - start
+        delta = None
+        if memory:
+            peak = max(stack.pop(), tracemalloc.get_traced_memory()[1])
+            delta = peak - current
+            if stack:
+                stack[-1] = max(stack[-1], peak)
+        registry.record(name, duration, delta)
+
+
+def timer_decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Decorator to record the execution time of a function as a stage."""
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if not _state.enabled:
+            return func(*args, **kwargs)
+        with timer(name):
+            return func(*args, **kwargs)
+    return wrapper
@@ -1,4 +1,4 @@
 """Visualisation functions."""
-from .plots import r_plotting, p_plotting, lorenz_plot
+from .plots import DENSITY_POINTS, MAX_POINTS, minmax_envelope, r_plotting, p_plotting, lorenz_plot
 
-__all__ = ['r_plotting', 'p_plotting', 'lorenz_plot']
\ No newline at end of file
+__all__ = ['DENSITY_POINTS', 'MAX_POINTS', 'minmax_envelope', 'r_plotting', 'p_plotting', 'lorenz_plot']
\ No newline at end of file
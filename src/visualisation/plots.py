@@ -1,62 +1,140 @@
 """ECG visualisation functions."""
 import numpy as np
+from matplotlib.colors import LogNorm
 import matplotlib.pyplot as plt
-from typing import TYPE_CHECKING
+from typing import Optional, Tuple, TYPE_CHECKING
+from ..core.segment import sample_bounds
 
 if TYPE_CHECKING:
     from ..core.ecg_lead import ECGLead
 
+# Most points drawn per signal line; about two per horizontal pixel of the 30 inch figure
+MAX_POINTS = 6000
+# RR pairs above which the Lorenz plot draws the binned density instead of every pair
+DENSITY_POINTS = 20000
 
-def r_plotting(lead: 'ECGLead') -> None:
+
+def minmax_envelope(signal: np.ndarray, max_points: int = MAX_POINTS) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Plot the ECG signal and the R peaks.
-    
+    Decimate a signal to its min/max envelope for plotting.
+
+    The signal is split into max_points / 2 equal bins and the lowest and
+    highest sample of each bin are kept, in time order, so every peak and
+    trough still reaches its full height once drawn. The bins are reduced as a
+    strided view of the signal, without copying it.
+
     Args:
-        lead: The lead to plot
+        signal: The signal
+        max_points: Most points returned
+
+    Returns:
+        The positions of the kept samples and their values
     """
+    n_samples = signal.shape[0]
+    if n_samples <= max_points:
+        return np.arange(n_samples), signal
+    size = -(-n_samples // max(max_points // 2, 1))
+    full = n_samples // size
+    bins = signal[:full * size].reshape(full, size)
+    low, high = np.argmin(bins, axis=1), np.argmax(bins, axis=1)
+    pairs = [np.minimum(low, high) + np.arange(full) * size, np.maximum(low, high) + np.arange(full) * size]
+    positions = np.column_stack(pairs).ravel()
+    if full * size < n_samples:
+        tail = signal[full * size:]
+        positions = np.append(positions, np.sort([np.argmin(tail), np.argmax(tail)]) + full * size)
+    return positions, signal[positions]
+
+
+def _signal_plot(lead: 'ECGLead', peaks: np.ndarray, title: str, label: str,
+                 time_range: Optional[Tuple[float, float]], max_points: int) -> None:
+    """Draw the decimated signal of a lead within a time range, with every peak in it marked."""
+    start, stop = (0, lead.signal.shape[0]) if time_range is None else sample_bounds(
+        lead.signal.shape[0], lead.fs, *time_range)
+    positions, values = minmax_envelope(lead.signal[start:stop], max_points)
+    peaks = np.asarray(peaks)
+    peaks = peaks[(peaks >= start) & (peaks < stop)]
     plt.figure(figsize=(30, 10))
-    plt.title(r'$\text{Apple Watch ECG, QRS Detection}$')
-    plt.plot(lead.signal, label=r'$\text{Lead 1}$', c='black')
-    plt.scatter(lead.r_peaks[:, 0], lead.signal[lead.r_peaks[:, 0]], c='r',
-                label=r'$\text{R Peaks, N = ' + str(len(lead.r_peaks)) + '}$')
+    plt.title(title)
+    plt.plot(positions + start, values, label=r'$\text{Lead 1}$', c='black')
+    plt.scatter(peaks, lead.signal[peaks], c='r', label=label + str(len(peaks)) + '}$')
     plt.xlabel(r'$\text{Samples (n)}$')
     plt.ylabel(r'$\text{Voltage (uV)}$')
     plt.legend(title=r'$' + str(lead.bpm) + '$' + r'$\text{ BPM}$')
     plt.show()
 
 
-def p_plotting(lead: 'ECGLead') -> None:
+def r_plotting(lead: 'ECGLead', time_range: Optional[Tuple[float, float]] = None,
+               max_points: int = MAX_POINTS) -> None:
+    """
+    Plot the ECG signal and the R peaks.
+
+    The signal is drawn as its min/max envelope, so a recording of any length
+    is drawn with at most max_points points; every R peak is still marked.
+
+    Args:
+        lead: The lead to plot
+        time_range: (start, stop) in seconds to plot, or None for the whole recording
+        max_points: Most points drawn for the signal
+    """
+    _signal_plot(lead, lead.r_peaks[:, 0], r'$\text{Apple Watch ECG, QRS Detection}$',
+                 r'$\text{R Peaks, N = ', time_range, max_points)
+
+
+def p_plotting(lead: 'ECGLead', time_range: Optional[Tuple[float, float]] = None,
+               max_points: int = MAX_POINTS) -> None:
     """
     Plot the ECG signal and the P peaks.
-    
+
+    The signal is drawn as its min/max envelope, so a recording of any length
+    is drawn with at most max_points points; every P peak is still marked.
+
     Args:
         lead: The lead to plot
+        time_range: (start, stop) in seconds to plot, or None for the whole recording
+        max_points: Most points drawn for the signal
     """
     plt.clf()
-    plt.figure(figsize=(30, 10))
-    plt.title(r'$\text{Apple Watch ECG, P Wave Detection}$')
-    plt.plot(lead.signal, label=r'$\text{Lead 1}$', c='black')
-    plt.scatter(lead.p_peaks, lead.signal[lead.p_peaks], c='r',
-                label=r'$\text{P Peaks, N = ' + str(len(lead.p_peaks)) + '}$')
-    plt.xlabel(r'$\text{Samples (n)}$')
-    plt.ylabel(r'$\text{Voltage (uV)}$')
-    plt.legend(title=r'$' + str(lead.bpm) + '$' + r'$\text{ BPM}$')
-    plt.show()
+    _signal_plot(lead, lead.p_peaks, r'$\text{Apple Watch ECG, P Wave Detection}$',
+                 r'$\text{P Peaks, N = ', time_range, max_points)
 
 
-def lorenz_plot(lead: 'ECGLead') -> None:
-    """Plot the Lorenz plot of the RR intervals."""
+def lorenz_plot(lead: 'ECGLead', density: Optional[bool] = None) -> None:
+    """
+    Plot the Lorenz plot of the RR intervals in ms.
+
+    Up to DENSITY_POINTS pairs every pair is scattered; above it the binned
+    counts of lead.lorenz_density are drawn on a log colour scale, which costs
+    the same whatever the number of beats. Both modes share the same axes.
+
+    Args:
+        lead: The lead to plot
+        density: Whether to draw the binned density, defaults to choosing by the number of pairs
+    """
+    rr_ms = lead.rr_ms
+    if density is None:
+        density = rr_ms.shape[0] - 1 > DENSITY_POINTS
+    limit = (rr_ms.max() if rr_ms.shape[0] else 0) + 100
     plt.clf()
     plt.figure(figsize=(10, 10))
     plt.title(r'$\text{Lorenz Plot}$')
-    plt.scatter(x=lead.rr_int[:-1], y=lead.rr_int[1:], c='black', s=5,
-                label=r'$\text{RR}_n$' + r'$\text{ vs RR_n+1}$')
+    if density:
+        lorenz_density = lead.lorenz_density
+        edges = lorenz_density.edges
+        # Rows of counts are RR_n, which runs along the x axis
+        mesh = plt.pcolormesh(edges, edges, np.ma.masked_equal(lorenz_density.counts.T, 0), cmap='viridis',
+                              norm=LogNorm())
+        plt.colorbar(mesh, label=r'$\text{Pairs}$')
+        title = r'$\rho = ' + str(np.round(lead.correlation_coefficient, 2)) + r',\ N = ' + str(
+            lorenz_density.n_pairs) + '$'
+    else:
+        plt.scatter(x=rr_ms[:-1], y=rr_ms[1:], c='black', s=5,
+                    label=r'$\text{RR}_n$' + r'$\text{ vs RR_n+1}$')
+        title = r'$\rho = ' + str(np.round(lead.correlation_coefficient, 2)) + '$'
     # Add a linear line y = x
-    plt.plot([0, lead.rr_int.max() + 100], [0, lead.rr_int.max() + 100],
-             c='r', label=r'$\text{y=x}$', linestyle='--')
+    plt.plot([0, limit], [0, limit], c='r', label=r'$\text{y=x}$', linestyle='--')
     plt.xlabel(r'$\text{RR}_n$' + r'$\text{ (ms)}$')
-    plt.xlim(0, lead.rr_int.max() + 100)
+    plt.xlim(0, limit)
     plt.ylabel(r'$\text{RR}_n+1$' + r'$\text{ (ms)}$')
-    plt.ylim(0, lead.rr_int.max() + 100)
-    plt.legend(title=r'$\rho = ' + str(np.round(lead.correlation_coefficient, 2)) + '$')
-    plt.show()
\ No newline at end of file
+    plt.ylim(0, limit)
+    plt.legend(title=title)
+    plt.show()